@@ -454,12 +454,64 @@ Compressor_flush(Compressor *self, PyObject *noargs)
     return result;
 }
 
+/* The multi-threaded encoder is available since liblzma 5.2.0. */
+#if LZMA_VERSION >= 50020002
+#define HAVE_LZMA_MT 1
+#endif
+
+#ifdef HAVE_LZMA_MT
+static int
+Compressor_init_xz_mt(lzma_stream *lzs, int check, uint32_t preset,
+                      PyObject *filterspecs, int threads)
+{
+    lzma_ret lzret;
+    lzma_mt mt;
+    lzma_filter filters[LZMA_FILTERS_MAX + 1];
+
+    memset(&mt, 0, sizeof(mt));
+
+    /* Use one thread per CPU if no number was given. */
+    if (threads > 0)
+        mt.threads = threads;
+    else
+        mt.threads = lzma_cputhreads();
+
+    if (mt.threads == 0)
+        mt.threads = 1;
+
+    mt.preset = preset;
+    mt.check = check;
+
+    if (filterspecs != Py_None) {
+        if (parse_filter_chain_spec(filters, filterspecs) == -1)
+            return -1;
+        mt.filters = filters;
+    }
+
+    lzret = lzma_stream_encoder_mt(lzs, &mt);
+
+    if (filterspecs != Py_None)
+        free_filter_chain(filters);
+
+    if (catch_lzma_error(lzret))
+        return -1;
+    else
+        return 0;
+}
+#endif
+
 static int
 Compressor_init_xz(lzma_stream *lzs, int check, uint32_t preset,
-                   PyObject *filterspecs)
+                   PyObject *filterspecs, int threads)
 {
     lzma_ret lzret;
 
+#ifdef HAVE_LZMA_MT
+    /* Split the input into blocks that are compressed in parallel. */
+    if (threads != 1)
+        return Compressor_init_xz_mt(lzs, check, preset, filterspecs, threads);
+#endif
+
     if (filterspecs == Py_None) {
         lzret = lzma_easy_encoder(lzs, preset, check);
     } else {
@@ -535,18 +587,26 @@ Compressor_init_raw(lzma_stream *lzs, PyObject *filterspecs)
 static int
 Compressor_init(Compressor *self, PyObject *args, PyObject *kwargs)
 {
-    static char *arg_names[] = {"format", "check", "preset", "filters", NULL};
+    static char *arg_names[] = {"format", "check", "preset", "filters",
+                                "threads", NULL};
     int format = FORMAT_XZ;
     int check = -1;
     uint32_t preset = LZMA_PRESET_DEFAULT;
     PyObject *preset_obj = Py_None;
     PyObject *filterspecs = Py_None;
+    int threads = 1;
 
     if (!PyArg_ParseTupleAndKeywords(args, kwargs,
-                                     "|iiOO:LZMACompressor", arg_names,
+                                     "|iiOOi:LZMACompressor", arg_names,
                                      &format, &check, &preset_obj,
-                                     &filterspecs))
+                                     &filterspecs, &threads))
+        return -1;
+
+    if (threads < 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Number of threads must not be negative");
         return -1;
+    }
 
     if (format != FORMAT_XZ && check != -1 && check != LZMA_CHECK_NONE) {
         PyErr_SetString(PyExc_ValueError,
@@ -577,7 +637,8 @@ Compressor_init(Compressor *self, PyObject *args, PyObject *kwargs)
         case FORMAT_XZ:
             if (check == -1)
                 check = LZMA_CHECK_CRC64;
-            if (Compressor_init_xz(&self->lzs, check, preset, filterspecs) != 0)
+            if (Compressor_init_xz(&self->lzs, check, preset, filterspecs,
+                                   threads) != 0)
                 break;
             return 0;
 
@@ -624,7 +685,8 @@ static PyMethodDef Compressor_methods[] = {
 };
 
 PyDoc_STRVAR(Compressor_doc,
-"LZMACompressor(format=FORMAT_XZ, check=-1, preset=None, filters=None)\n"
+"LZMACompressor(format=FORMAT_XZ, check=-1, preset=None, filters=None,\n"
+"               threads=1)\n"
 "\n"
 "Create a compressor object for compressing data incrementally.\n"
 "\n"
@@ -649,6 +711,11 @@ PyDoc_STRVAR(Compressor_doc,
 "have an entry for \"id\" indicating the ID of the filter, plus\n"
 "additional entries for options to the filter.\n"
 "\n"
+"threads is the number of threads that are used for FORMAT_XZ. If it is\n"
+"not 1, the input is split into blocks that are compressed in parallel,\n"
+"and 0 means one thread per CPU. It is ignored if liblzma does not\n"
+"support multi-threaded compression.\n"
+"\n"
 "For one-shot compression, use the compress() function instead.\n");
 
 static PyTypeObject Compressor_type = {
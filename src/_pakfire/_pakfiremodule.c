@@ -105,6 +105,7 @@ static PyMethodDef Repo_methods[] = {
 	{"read", (PyCFunction)Repo_read, METH_VARARGS, NULL},
 	{"internalize", (PyCFunction)Repo_internalize, METH_NOARGS, NULL},
 	{"clear", (PyCFunction)Repo_clear, METH_NOARGS, NULL},
+	{"rem_solvable", (PyCFunction)Repo_rem_solvable, METH_VARARGS, NULL},
 	{"get_all", (PyCFunction)Repo_get_all, METH_NOARGS, NULL},
 	{ NULL, NULL, 0, NULL }
 };
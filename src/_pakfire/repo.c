@@ -151,16 +151,32 @@ PyObject *Repo_write(RepoObject *self, PyObject *args) {
 
 PyObject *Repo_read(RepoObject *self, PyObject *args) {
 	const char *filename;
+	char exception[STRING_SIZE];
 
 	if (!PyArg_ParseTuple(args, "s", &filename)) {
 		return NULL;
 	}
 
-	// XXX catch if file cannot be opened
-	FILE *fp = fopen(filename, "rb");
-	repo_add_solv(self->_repo, fp, 0);
+	FILE *fp = NULL;
+	if ((fp = fopen(filename, "rb")) == NULL) {
+		snprintf(exception, STRING_SIZE - 1, "Could not open file for reading: %s (%s).",
+			filename, strerror(errno));
+		PyErr_SetString(PyExc_RuntimeError, exception);
+		return NULL;
+	}
+
+	int ret = repo_add_solv(self->_repo, fp, 0);
 	fclose(fp);
 
+	// Raise an exception if the file could not be parsed, so that
+	// callers can throw away broken or incompatible cache files.
+	if (ret) {
+		snprintf(exception, STRING_SIZE - 1, "Could not read SOLV file: %s (%s).",
+			filename, pool_errstr(self->_repo->pool));
+		PyErr_SetString(PyExc_RuntimeError, exception);
+		return NULL;
+	}
+
 	Py_RETURN_NONE;
 }
 
@@ -176,6 +192,31 @@ PyObject *Repo_clear(RepoObject *self) {
 	Py_RETURN_NONE;
 }
 
+PyObject *Repo_rem_solvable(RepoObject *self, PyObject *args) {
+	SolvableObject *solv;
+	char exception[STRING_SIZE];
+
+	if (!PyArg_ParseTuple(args, "O!", &SolvableType, &solv)) {
+		return NULL;
+	}
+
+	Solvable *s = pool_id2solvable(solv->_pool, solv->_id);
+
+	if (s->repo != self->_repo) {
+		snprintf(exception, STRING_SIZE - 1, "Solvable %d is not part of repository %s.",
+			solv->_id, self->_repo->name);
+		PyErr_SetString(PyExc_RuntimeError, exception);
+		return NULL;
+	}
+
+	// Free the solvable. Its id is reused if it was the last one
+	// of the repository. The pool needs to be prepared again before
+	// the next solver run.
+	repo_free_solvable_block(self->_repo, solv->_id, 1, 1);
+
+	Py_RETURN_NONE;
+}
+
 PyObject *Repo_get_all(RepoObject *self) {
 	Solvable *s;
 	Id p;
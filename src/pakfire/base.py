@@ -575,6 +575,22 @@ class Pakfire(object):
 		# Clean up repository caches.
 		self.repos.clean()
 
+	def clean_cache(self, keep_size=None, max_age=None):
+		# Initialize this pakfire instance.
+		self.initialize()
+
+		log.debug("Cleaning up the package cache...")
+
+		self.repos.clean_cache(max_size=keep_size, max_age=max_age)
+
+	def clean_database(self):
+		# Initialize this pakfire instance.
+		self.initialize()
+
+		log.debug("Cleaning up the database of installed packages...")
+
+		self.repos.local.vacuum()
+
 	def check(self, allow_downgrade=True, allow_uninstall=True):
 		"""
 			Try to fix any errors in the system.
@@ -732,7 +748,7 @@ class PakfireClient(Pakfire):
 class PakfireServer(Pakfire):
 	mode = "server"
 
-	def repo_create(self, path, input_paths, name=None, key_id=None, type="binary"):
+	def repo_create(self, path, input_paths, name=None, key_id=None, type="binary", deltas=0):
 		assert type in ("binary", "source",)
 
 		if not name:
@@ -746,7 +762,7 @@ class PakfireServer(Pakfire):
 		repo.add_packages(input_paths)
 
 		# Write metadata to disk.
-		repo.save()
+		repo.save(deltas=deltas)
 
 		# Return the new repository.
 		return repo
@@ -714,6 +714,17 @@ class BuildEnviron(object):
 		# Write builder.conf.
 		f = open(self.chrootPath(CONFIG_DIR, "builder.conf"), "w")
 		f.write(self.distro.get_config())
+
+		# Pass the compression settings to the packager.
+		lines = []
+		for key in ("compression_preset", "compression_threads"):
+			val = self.config.get("builder", key)
+			if val is not None:
+				lines.append("%s = %s" % (key, val))
+
+		if lines:
+			f.write("\n\n[builder]\n%s\n" % "\n".join(lines))
+
 		f.close()
 
 		# Create pakfire configuration files.
@@ -98,6 +98,8 @@ class Cli(object):
 			"groupinstall" : self.handle_groupinstall,
 			"repolist"     : self.handle_repolist,
 			"clean_all"    : self.handle_clean_all,
+			"clean_cache"  : self.handle_clean_cache,
+			"clean_database" : self.handle_clean_database,
 			"check"        : self.handle_check,
 			"resolvdep"    : self.handle_resolvdep,
 			"extract"      : self.handle_extract,
@@ -285,12 +287,28 @@ class Cli(object):
 		sub_clean_commands = sub_clean.add_subparsers()
 
 		self.parse_command_clean_all(sub_clean_commands)
+		self.parse_command_clean_cache(sub_clean_commands)
+		self.parse_command_clean_database(sub_clean_commands)
 
 	def parse_command_clean_all(self, sub_commands):
 		sub_create = sub_commands.add_parser("all",
 			help=_("Cleanup all temporary files."))
 		sub_create.add_argument("action", action="store_const", const="clean_all")
 
+	def parse_command_clean_cache(self, sub_commands):
+		sub_create = sub_commands.add_parser("cache",
+			help=_("Remove the least recently used packages from the cache."))
+		sub_create.add_argument("--keep-size", nargs="?",
+			help=_("Maximum size of the cache (e.g. 10G)."))
+		sub_create.add_argument("--max-age", nargs="?", type=int,
+			help=_("Remove all packages that have not been used for this many days."))
+		sub_create.add_argument("action", action="store_const", const="clean_cache")
+
+	def parse_command_clean_database(self, sub_commands):
+		sub_create = sub_commands.add_parser("database",
+			help=_("Remove stale data from the package database and compact it."))
+		sub_create.add_argument("action", action="store_const", const="clean_database")
+
 	def parse_command_check(self):
 		# Implement the "check" command
 		sub_check = self.sub_commands.add_parser("check",
@@ -413,6 +431,25 @@ class Cli(object):
 		p = self.create_pakfire()
 		p.clean_all()
 
+	def handle_clean_cache(self):
+		keep_size = None
+		if self.args.keep_size:
+			try:
+				keep_size = util.parse_size(self.args.keep_size)
+			except ValueError:
+				raise Error, _("Invalid size: %s") % self.args.keep_size
+
+		print _("Cleaning up the package cache...")
+
+		p = self.create_pakfire()
+		p.clean_cache(keep_size=keep_size, max_age=self.args.max_age)
+
+	def handle_clean_database(self):
+		print _("Cleaning up the package database...")
+
+		p = self.create_pakfire()
+		p.clean_database()
+
 	def handle_check(self):
 		p = self.create_pakfire()
 		p.check()
@@ -509,6 +546,8 @@ class CliBuilder(Cli):
 			"grouplist"   : self.handle_grouplist,
 			"repolist"    : self.handle_repolist,
 			"clean_all"   : self.handle_clean_all,
+			"clean_cache"  : self.handle_clean_cache,
+			"clean_database" : self.handle_clean_database,
 			"resolvdep"   : self.handle_resolvdep,
 			"extract"     : self.handle_extract,
 		}
@@ -761,6 +800,8 @@ class CliServer(Cli):
 			help=_("Path to input packages."))
 		sub_create.add_argument("--key", "-k", nargs="?",
 			help=_("Key to sign the repository with."))
+		sub_create.add_argument("--deltas", type=int, default=0,
+			help=_("Number of previous databases to create deltas from."))
 		sub_create.add_argument("action", action="store_const", const="repo_create")
 
 	def parse_command_info(self):
@@ -805,7 +846,8 @@ class CliServer(Cli):
 		path = self.args.path[0]
 
 		p = self.create_pakfire()
-		p.repo_create(path, self.args.inputs, key_id=self.args.key)
+		p.repo_create(path, self.args.inputs, key_id=self.args.key,
+			deltas=self.args.deltas)
 
 	def handle_info(self):
 		info = self.server.info()
@@ -89,11 +89,18 @@ def decompressobj(name=None, fileobj=None, algo=ALGO_DEFAULT):
 	return f
 
 
-def compressobj(name=None, fileobj=None, algo=ALGO_DEFAULT):
+def compressobj(name=None, fileobj=None, algo=ALGO_DEFAULT, preset=None, threads=1):
+	"""
+		Returns a file object that compresses everything that is
+		written to it.
+
+		preset is the compression level and threads is the number of
+		threads that compress the data (0 means one per CPU).
+	"""
 	f_cls = FILES.get(algo, None)
 	if not f_cls:
 		raise CompressionError, _("Given algorithm '%s' is not supported.")
 
-	f = f_cls(name, fileobj=fileobj, mode="w")
+	f = f_cls(name, fileobj=fileobj, mode="w", preset=preset, threads=threads)
 
 	return f
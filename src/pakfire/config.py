@@ -172,8 +172,8 @@ class _Config(object):
 	def get_int(self, section, key, default=None):
 		val = self.get(section=section, key=key, default=default)
 		try:
-			val = int(val)
-		except ValueError:
+			return int(val)
+		except (TypeError, ValueError):
 			return default
 
 	def get_bool(self, section, key, default=None):
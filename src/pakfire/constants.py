@@ -50,6 +50,7 @@ LOCAL_TMP_PATH = "/var/tmp"
 PACKAGES_DB_DIR = "var/lib/pakfire"
 PACKAGES_DB = os.path.join(PACKAGES_DB_DIR, "packages.db")
 PACKAGES_SOLV = os.path.join(PACKAGES_DB_DIR, "packages.solv")
+PACKAGES_SOLV_KEY = os.path.join(PACKAGES_DB_DIR, "packages.solv.key")
 REPOSITORY_DB = "index.db"
 
 BUFFER_SIZE = 102400
@@ -68,6 +69,7 @@ METADATA_DOWNLOAD_LIMIT = 1024**2
 METADATA_DOWNLOAD_PATH  = "repodata"
 METADATA_DOWNLOAD_FILE  = "repomd.json"
 METADATA_DATABASE_FILE  = "packages.solv"
+METADATA_MANIFEST_FILE  = "manifest.json"
 
 PACKAGE_FORMAT = 5
 # XXX implement this properly
@@ -75,8 +77,8 @@ PACKAGE_FORMATS_SUPPORTED = [0, 1, 2, 3, 4, 5]
 PACKAGE_EXTENSION = "pfm"
 MAKEFILE_EXTENSION = "nm"
 
-DATABASE_FORMAT = 7
-DATABASE_FORMATS_SUPPORTED = [0, 1, 2, 3, 4, 5, 6, 7]
+DATABASE_FORMAT = 8
+DATABASE_FORMATS_SUPPORTED = [0, 1, 2, 3, 4, 5, 6, 7, 8]
 
 PACKAGE_FILENAME_FMT = "%(name)s-%(version)s-%(release)s.%(arch)s.%(ext)s"
 
@@ -237,5 +239,8 @@ SCRIPTS_PREREQUIRES = (
 
 LDCONFIG = "/sbin/ldconfig"
 
+# Number of threads that write files when a package is extracted.
+EXTRACT_WRITERS = 2
+
 CONFIG_FILE_SUFFIX_NEW  = ".paknew"
 CONFIG_FILE_SUFFIX_SAVE = ".paksave"
@@ -14,6 +14,7 @@ import pakfire.builder
 import pakfire.config
 import pakfire.downloader
 import pakfire.system
+import pakfire.transaction
 import pakfire.util
 from pakfire.system import system
 
@@ -39,6 +40,118 @@ class BuildJob(dict):
 			raise AttributeError, key
 
 
+class PrefetchStatistics(object):
+	"""
+		Remembers the configurations of recent build jobs and which
+		packages were installed in their build environments.
+
+		The data is shared by all worker processes.
+	"""
+	filename = os.path.join(CACHE_DIR, "prefetch.json")
+
+	# Number of build environments after which all counters are halved,
+	# so that packages that are not used any more are forgotten.
+	MAX_BUILDROOTS = 100
+
+	def __init__(self):
+		self.data = self.load()
+
+	def load(self):
+		try:
+			with open(self.filename) as f:
+				return json.load(f)
+
+		except (IOError, ValueError):
+			return {}
+
+	def save(self):
+		dirname = os.path.dirname(self.filename)
+		if not os.path.exists(dirname):
+			os.makedirs(dirname)
+
+		tmp_filename = "%s.%s.tmp" % (self.filename, os.getpid())
+
+		with open(tmp_filename, "w") as f:
+			json.dump(self.data, f)
+
+		os.rename(tmp_filename, self.filename)
+
+	def update(self, job, callback):
+		"""
+			Calls callback with the entry of the job's configuration
+			and saves the result.
+		"""
+		key = "%s\n%s" % (job.arch, job.config)
+		key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+		# Lock the file, so that no other worker changes it at the same time.
+		lock = pakfire.util.lock("%s.lock" % self.filename)
+		try:
+			self.data = self.load()
+
+			entry = self.data.setdefault(key, {
+				"arch"       : job.arch,
+				"config"     : job.config,
+				"buildroots" : 0,
+				"packages"   : {},
+			})
+			entry["last_used"] = time.time()
+
+			callback(entry)
+
+			self.save()
+
+		finally:
+			lock.close()
+
+	def add_job(self, job):
+		self.update(job, lambda entry: None)
+
+	def add_buildroot(self, job, installed_packages):
+		def callback(entry):
+			entry["buildroots"] += 1
+
+			for pkg in installed_packages:
+				try:
+					entry["packages"][pkg.name] += 1
+				except KeyError:
+					entry["packages"][pkg.name] = 1
+
+			if entry["buildroots"] > self.MAX_BUILDROOTS:
+				entry["buildroots"] //= 2
+
+				for name, count in entry["packages"].items():
+					if count // 2:
+						entry["packages"][name] = count // 2
+					else:
+						del entry["packages"][name]
+
+		self.update(job, callback)
+
+	def get_recent(self, count=5, max_age=7 * 24 * 3600):
+		"""
+			Returns the entries of the most recently used configurations.
+		"""
+		entries = [e for e in self.data.values() \
+			if time.time() - e.get("last_used", 0) < max_age]
+
+		entries.sort(key=lambda e: e.get("last_used", 0), reverse=True)
+
+		return entries[:count]
+
+	def get_frequent_packages(self, entry, ratio=0.25):
+		"""
+			Returns the names of all packages that have been installed
+			in at least the given ratio of all build environments.
+		"""
+		buildroots = entry.get("buildroots", 0)
+		if not buildroots:
+			return []
+
+		return sorted(name for name, count in entry.get("packages", {}).items() \
+			if count >= buildroots * ratio)
+
+
 class PakfireDaemon(object):
 	def __init__(self, config):
 		self.config = config
@@ -59,6 +172,12 @@ class PakfireDaemon(object):
 		# Number of running workers.
 		self.max_running = system.cpu_count * 2
 
+		# Time between downloading packages for the next jobs (in minutes).
+		self.prefetch_interval = self.config.get_int("daemon", "prefetch_interval", 60)
+
+		self.prefetcher = None
+		self.prefetch_time = 0
+
 	def run(self, heartbeat=30):
 		"""
 			Main loop.
@@ -80,6 +199,9 @@ class PakfireDaemon(object):
 			# Spawn a sufficient number of worker processes.
 			self.spawn_workers_if_needed()
 
+			# Warm up the package cache while no build is running.
+			self.prefetch_if_needed()
+
 			# Get runtime of this loop iteration.
 			time_elapsed = time.time() - time_started
 
@@ -159,6 +281,31 @@ class PakfireDaemon(object):
 		log.debug("Spawned new worker process: %s" % worker)
 		self.__workers.append(worker)
 
+	def prefetch_if_needed(self):
+		"""
+			Starts downloading packages for the next jobs, if the
+			builder is idle.
+		"""
+		if not self.__running or not self.prefetch_interval:
+			return
+
+		if self.prefetcher and self.prefetcher.is_alive():
+			return
+
+		# Do not take bandwidth away from running builds.
+		if self.running_workers:
+			return
+
+		if time.time() - self.prefetch_time < self.prefetch_interval * 60:
+			return
+
+		self.prefetch_time = time.time()
+
+		self.prefetcher = PakfirePrefetcher(self.config)
+		self.prefetcher.start()
+
+		log.debug("Started prefetch process: %s" % self.prefetcher)
+
 	def terminate_worker(self, worker):
 		"""
 			Terminates the given worker.
@@ -176,11 +323,17 @@ class PakfireDaemon(object):
 		for worker in self.workers:
 			self.terminate_worker(worker)
 
+		if self.prefetcher and self.prefetcher.is_alive():
+			self.terminate_worker(self.prefetcher)
+
 		# Then wait until they all have finished.
 		self.keepalive.join()
 		for worker in self.workers:
 			worker.join()
 
+		if self.prefetcher:
+			self.prefetcher.join()
+
 	def remove_worker(self, worker):
 		"""
 			Removes a worker from the internal list of worker processes.
@@ -364,6 +517,91 @@ class PakfireDaemonKeepalive(multiprocessing.Process):
 		return mp.space_left
 
 
+class PakfirePrefetcher(multiprocessing.Process):
+	"""
+		Refreshes the repository metadata and downloads the packages
+		that the next build jobs will most likely need, so that their
+		build environments can be created from the cache.
+	"""
+	def __init__(self, config):
+		multiprocessing.Process.__init__(self)
+
+		# Save config.
+		self.config = config
+
+	def run(self):
+		# Register signal handlers.
+		self.register_signal_handlers()
+
+		stats = PrefetchStatistics()
+
+		for entry in stats.get_recent():
+			try:
+				self.prefetch(entry, stats.get_frequent_packages(entry))
+
+			# Prefetching is optional, so errors are only logged.
+			except Exception, e:
+				log.warning(_("Could not prefetch packages: %s") % e)
+
+	def prefetch(self, entry, frequent_packages):
+		config = pakfire.config.ConfigDaemon()
+		config.parse(entry["config"])
+
+		p = pakfire.base.PakfireBuilder(config=config, arch=entry["arch"])
+
+		try:
+			# Refresh the repository metadata.
+			p.initialize()
+
+			requires = BUILD_PACKAGES[:]
+
+			if config.get_bool("builder", "use_ccache", True):
+				requires.append("ccache")
+
+			if config.get_bool("builder", "use_icecream", False):
+				requires.append("icecream")
+
+			# Skip packages that do not exist any more.
+			for name in frequent_packages:
+				if not name in requires and p.pool.whatprovides(p, name):
+					requires.append(name)
+
+			log.debug("Prefetching %s package(s) for %s" % (len(requires), entry["arch"]))
+
+			request = p.pool.create_request(install=requires)
+			solver = p.pool.solve(request, logger=log)
+
+			t = pakfire.transaction.Transaction.from_solver(p, solver)
+			t.download(logger=log)
+
+		finally:
+			p.destroy()
+
+			# Remove the empty build environment.
+			pakfire.util.rm(p.path)
+
+	# Signal handling.
+
+	def register_signal_handlers(self):
+		signal.signal(signal.SIGCHLD, self.handle_SIGCHLD)
+		signal.signal(signal.SIGINT,  self.handle_SIGTERM)
+		signal.signal(signal.SIGTERM, self.handle_SIGTERM)
+
+	def handle_SIGCHLD(self, signum, frame):
+		"""
+			Handle signal SIGCHLD.
+		"""
+		# Must be here so that SIGCHLD won't be propagated to
+		# PakfireDaemon.
+		pass
+
+	def handle_SIGTERM(self, signum, frame):
+		"""
+			Handle signal SIGTERM.
+		"""
+		sys.exit(1)
+
+
 class PakfireWorker(multiprocessing.Process):
 	def __init__(self, config, waiting=None):
 		multiprocessing.Process.__init__(self)
@@ -484,6 +722,10 @@ class PakfireWorker(multiprocessing.Process):
 			config = pakfire.config.ConfigDaemon()
 			config.parse(job.config)
 
+			# Remember the configuration, so the packages for the
+			# next jobs can be downloaded in advance.
+			self.add_prefetch_statistics(job)
+
 			# Create pakfire instance.
 			p = None
 			try:
@@ -612,7 +854,24 @@ class PakfireWorker(multiprocessing.Process):
 		self.transport.post("/builders/jobs/%s/addfile/%s" % (job.id, upload_id),
 			data=data)
 
+	def add_prefetch_statistics(self, job, installed_packages=None):
+		stats = PrefetchStatistics()
+
+		try:
+			if installed_packages is None:
+				stats.add_job(job)
+			else:
+				stats.add_buildroot(job, installed_packages)
+
+		except (IOError, OSError), e:
+			log.warning(_("Could not save prefetch statistics: %s") % e)
+
 	def upload_buildroot(self, job, installed_packages):
+		installed_packages = list(installed_packages)
+
+		# Remember which packages are needed for builds.
+		self.add_prefetch_statistics(job, installed_packages)
+
 		pkgs = []
 		for pkg in installed_packages:
 			pkgs.append((pkg.friendly_name, pkg.uuid))
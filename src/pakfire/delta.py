@@ -0,0 +1,155 @@
+#!/usr/bin/python
+###############################################################################
+#                                                                             #
+# Pakfire - The IPFire package management system                              #
+# Copyright (C) 2011 Pakfire development team                                 #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU General Public License as published by        #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU General Public License for more details.                                #
+#                                                                             #
+# You should have received a copy of the GNU General Public License           #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+#                                                                             #
+###############################################################################
+
+"""
+	Binary deltas between two versions of a file.
+
+	A delta is a sequence of instructions that either copy a range of
+	the old file or insert new data:
+
+		"C" <offset (4 bytes)> <length (4 bytes)>
+		"I" <length (4 bytes)> <data>
+
+	All numbers are unsigned and in network byte order. Deltas are
+	supposed to be compressed when they are stored.
+"""
+
+import cStringIO
+import struct
+
+from errors import DeltaError
+from i18n import _
+
+DELTA_MAGIC = "PFDELTA1"
+
+# Size of the blocks that are looked up in the old file.
+BLOCK_SIZE = 32
+
+OP_COPY   = "C"
+OP_INSERT = "I"
+
+def _match_length(old, old_pos, new, new_pos):
+	"""
+		Returns how many bytes of old (starting at old_pos) and new
+		(starting at new_pos) are equal.
+	"""
+	length = 0
+	step = 4096
+
+	while step:
+		while old[old_pos + length:old_pos + length + step] \
+				== new[new_pos + length:new_pos + length + step] \
+				and old_pos + length + step <= len(old) \
+				and new_pos + length + step <= len(new):
+			length += step
+
+		step /= 2
+
+	return length
+
+def create(old, new, block_size=BLOCK_SIZE):
+	"""
+		Creates a delta that transforms the string old into new.
+	"""
+	# Index all aligned blocks of the old data.
+	blocks = {}
+	for offset in xrange(len(old) - block_size, -1, -block_size):
+		blocks[old[offset:offset + block_size]] = offset
+
+	delta = cStringIO.StringIO()
+	delta.write(DELTA_MAGIC)
+
+	# Start of the data that has not been found in old.
+	literal = 0
+
+	pos = 0
+	end = len(new) - block_size
+
+	while pos <= end:
+		offset = blocks.get(new[pos:pos + block_size])
+
+		if offset is None:
+			pos += 1
+			continue
+
+		length = _match_length(old, offset, new, pos)
+
+		# Extend the match backwards into the pending literal data.
+		while pos > literal and offset > 0 and old[offset - 1] == new[pos - 1]:
+			offset -= 1
+			pos -= 1
+			length += 1
+
+		if pos > literal:
+			delta.write(OP_INSERT + struct.pack(">I", pos - literal))
+			delta.write(new[literal:pos])
+
+		delta.write(OP_COPY + struct.pack(">II", offset, length))
+
+		pos += length
+		literal = pos
+
+	if literal < len(new):
+		delta.write(OP_INSERT + struct.pack(">I", len(new) - literal))
+		delta.write(new[literal:])
+
+	return delta.getvalue()
+
+def apply(old, delta):
+	"""
+		Applies a delta to the string old and returns the new data.
+	"""
+	if not delta.startswith(DELTA_MAGIC):
+		raise DeltaError, _("Unknown delta format.")
+
+	new = cStringIO.StringIO()
+
+	pos = len(DELTA_MAGIC)
+	while pos < len(delta):
+		op = delta[pos]
+
+		try:
+			if op == OP_COPY:
+				offset, length = struct.unpack(">II", delta[pos + 1:pos + 9])
+				pos += 9
+
+				if offset + length > len(old):
+					raise DeltaError, _("Delta does not match the old data.")
+
+				new.write(old[offset:offset + length])
+
+			elif op == OP_INSERT:
+				length, = struct.unpack(">I", delta[pos + 1:pos + 5])
+				pos += 5
+
+				if pos + length > len(delta):
+					raise DeltaError, _("Delta is truncated.")
+
+				new.write(delta[pos:pos + length])
+				pos += length
+
+			else:
+				raise DeltaError, _("Delta is corrupt.")
+
+		except struct.error:
+			raise DeltaError, _("Delta is truncated.")
+
+	return new.getvalue()
@@ -19,10 +19,14 @@
 #                                                                             #
 ###############################################################################
 
+import Queue
 import json
 import os
 import pycurl
 import random
+import sys
+import threading
+import time
 
 import logging
 log = logging.getLogger("pakfire")
@@ -32,11 +36,57 @@ from config import _Config
 import urlgrabber.grabber
 from urlgrabber.grabber import URLGrabber, URLGrabError
 from urlgrabber.mirror import MirrorGroup
-from urlgrabber.progress import TextMeter
+from urlgrabber.progress import TextMeter, TextMultiFileMeter
+
+import pakfire.util as util
 
 from pakfire.constants import *
 from pakfire.i18n import _
 
+# urlgrabber uses one curl handle for all downloads, which cannot be
+# used by more than one thread at a time. So every thread gets its own.
+_thread_data = threading.local()
+
+def get_curl_obj():
+	try:
+		return _thread_data.curl_obj
+	except AttributeError:
+		_thread_data.curl_obj = pycurl.Curl()
+
+	return _thread_data.curl_obj
+
+# Messages of errors that are caused by a requested range that the
+# server cannot deliver, i.e. because a partial file is too long.
+RANGE_ERRORS = (
+	"HTTP Error 416",
+	"Range Not Satisfiable",
+	"Range failed",
+	"Couldn't resume download",
+)
+
+def is_range_error(e):
+	"""
+		Tells if a download failed because the requested range
+		was not available.
+	"""
+	if e.errno == 9 or getattr(e, "code", None) == 416:
+		return True
+
+	# A mirror group only keeps the messages of the errors of all
+	# mirrors it has tried. All of them must have failed this way.
+	errors = getattr(e, "errors", None)
+	if errors:
+		for url, msg in errors:
+			for error in RANGE_ERRORS:
+				if error in msg:
+					break
+			else:
+				return False
+
+		return True
+
+	return False
+
 class PakfireGrabber(URLGrabber):
 	"""
 		Class to make some modifications on the urlgrabber configuration.
@@ -48,6 +98,8 @@ class PakfireGrabber(URLGrabber):
 
 			"ssl_verify_host" : False,
 			"ssl_verify_peer" : False,
+
+			"curl_obj" : get_curl_obj(),
 		})
 
 		if isinstance(pakfire, _Config):
@@ -56,6 +108,9 @@ class PakfireGrabber(URLGrabber):
 			config = pakfire.config
 		self.config = config
 
+		# The URL of the last file that has been opened successfully.
+		self.url = None
+
 		# Set throttle setting.
 		bandwidth_throttle = config.get("downloader", "bandwidth_throttle")
 		if bandwidth_throttle:
@@ -95,7 +150,12 @@ class PakfireGrabber(URLGrabber):
 		# This is for older versions of urlgrabber which are packaged in Debian
 		# and Ubuntu and cannot handle filenames as a normal Python string but need
 		# a unicode string.
-		return URLGrabber.urlopen(self, filename.encode("utf-8"), *args, **kwargs)
+		ret = URLGrabber.urlopen(self, filename.encode("utf-8"), *args, **kwargs)
+
+		# Remember where the file came from (i.e. which mirror).
+		self.url = filename
+
+		return ret
 
 	def urlgrab(self, url, *args, **kwargs):
 		self.check_offline_mode()
@@ -103,14 +163,18 @@ class PakfireGrabber(URLGrabber):
 		# This is for older versions of urlgrabber which are packaged in Debian
 		# and Ubuntu and cannot handle filenames as a normal Python string but need
 		# a unicode string.
-		return URLGrabber.urlgrab(self, url.encode("utf-8"), *args, **kwargs)
+		ret = URLGrabber.urlgrab(self, url.encode("utf-8"), *args, **kwargs)
+
+		# Remember where the file came from (i.e. which mirror).
+		self.url = url
+
+		return ret
 
 
 class PackageDownloader(PakfireGrabber):
 	def __init__(self, pakfire, *args, **kwargs):
-		kwargs.update({
-			"progress_obj" : TextMeter(),
-		})
+		if kwargs.get("progress_obj") is None:
+			kwargs["progress_obj"] = TextMeter()
 
 		PakfireGrabber.__init__(self, pakfire, *args, **kwargs)
 
@@ -137,9 +201,12 @@ class SourceDownloader(object):
 	def __init__(self, pakfire, mirrors=None):
 		self.pakfire = pakfire
 
+		# The progress meter is told the size of every file.
+		self.progress_obj = TextMeter()
+
 		self.grabber = PakfireGrabber(
 			self.pakfire,
-			progress_obj = TextMeter(),
+			progress_obj = self.progress_obj,
 		)
 
 		if mirrors:
@@ -172,24 +239,58 @@ class SourceDownloader(object):
 				os.makedirs(SOURCE_CACHE_DIR)
 
 			for filename in download_files:
+				# Download to a temporary file which is kept when the
+				# download fails, so it can be continued later.
+				part_filename = "%s.part" % filename
+
+				# Other builders on this host might download the same file.
+				lock = util.lock("%s.lock" % filename)
 				try:
-					self.grabber.urlgrab(os.path.basename(filename), filename=filename)
-				except URLGrabError, e:
-					# Remove partly downloaded file.
+					# Somebody else has finished the download in the meantime.
+					if os.path.exists(filename) and os.path.getsize(filename):
+						continue
+
+					# The size of the data we already have.
 					try:
-						os.unlink(filename)
+						offset = os.path.getsize(part_filename)
 					except OSError:
-						pass
+						offset = 0
+
+					self.progress_obj.size = None
+
+					try:
+						self.grabber.urlgrab(os.path.basename(filename),
+							filename=part_filename, reget="simple")
+					except URLGrabError, e:
+						# The partial file is longer than the file on the server.
+						if offset and is_range_error(e):
+							os.unlink(part_filename)
 
-					raise DownloadError, "%s %s" % (os.path.basename(filename), e)
+						raise DownloadError, "%s %s" % (os.path.basename(filename), e)
 
-				# Check if the downloaded file was empty.
-				if os.path.getsize(filename) == 0:
-					# Remove the file and raise an error.
-					os.unlink(filename)
+					# The partial file might have come from a different file,
+					# so the result must have the size the server told us.
+					# (If the server did not send it, it is the offset.)
+					size = getattr(self.progress_obj, "size", None)
+					if size and not size == offset \
+							and not os.path.getsize(part_filename) == size:
+						os.unlink(part_filename)
 
-					raise DownloadError, _("Downloaded empty file: %s") \
-						% os.path.basename(filename)
+						raise DownloadError, _("Downloaded file has the wrong size: %s") \
+							% os.path.basename(filename)
+
+					# Check if the downloaded file was empty.
+					if os.path.getsize(part_filename) == 0:
+						# Remove the file and raise an error.
+						os.unlink(part_filename)
+
+						raise DownloadError, _("Downloaded empty file: %s") \
+							% os.path.basename(filename)
+
+					os.rename(part_filename, filename)
+
+				finally:
+					lock.close()
 
 			log.info("")
 
@@ -208,16 +309,196 @@ class Mirror(object):
 		self.preferred = False
 
 
+class MirrorScoreboard(object):
+	"""
+		Keeps track of how fast and reliable the mirrors of a repository
+		are.
+
+		For every mirror, the time until the server answers (latency), the
+		download speed (throughput) and the rate of failed downloads are
+		kept as moving averages.
+	"""
+	# Weight of a new measurement in the moving averages.
+	WEIGHT = 0.3
+
+	# Size of the download that is used to compare latency and throughput.
+	TYPICAL_SIZE = 1024**2
+
+	# Time after which changed scores are written to disk (in seconds).
+	SAVE_INTERVAL = 60
+
+	def __init__(self, cache, filename):
+		self.cache = cache
+		self.filename = filename
+
+		# Downloads may run in several threads at the same time.
+		self.lock = threading.Lock()
+
+		self.scores = self.load()
+
+		# Scores are not written after every download, but from time to
+		# time and when flush() is called.
+		self.changed = False
+		self.saved = time.time()
+
+	def load(self):
+		try:
+			with self.cache.open(self.filename) as f:
+				return json.load(f)
+
+		except (IOError, ValueError):
+			return {}
+
+	def flush(self):
+		"""
+			Writes the scores to disk if they have been changed.
+		"""
+		with self.lock:
+			if self.changed:
+				self.save()
+
+	def save(self):
+		self.changed = False
+		self.saved = time.time()
+
+		# Other processes might read the file at the same time.
+		tmp_filename = "%s.%s.tmp" % (self.filename, os.getpid())
+
+		try:
+			with self.cache.open(tmp_filename, "w") as f:
+				json.dump(self.scores, f)
+
+			os.rename(self.cache.abspath(tmp_filename), self.cache.abspath(self.filename))
+
+		except (IOError, OSError), e:
+			log.debug("Could not save the mirror scores: %s" % e)
+
+	def update(self, url, **values):
+		with self.lock:
+			score = self.scores.setdefault(url, {})
+
+			for key, value in values.items():
+				old_value = score.get(key)
+
+				if old_value is None:
+					score[key] = value
+				else:
+					score[key] = (1 - self.WEIGHT) * old_value + self.WEIGHT * value
+
+			score["updated"] = time.time()
+
+			self.changed = True
+
+			if time.time() - self.saved >= self.SAVE_INTERVAL:
+				self.save()
+
+	def record_success(self, url, latency=None, size=None, duration=None):
+		"""
+			Records a successful download of size bytes, which took duration
+			seconds after the server answered in latency seconds.
+		"""
+		values = { "failures" : 0.0 }
+
+		if latency is not None:
+			values["latency"] = latency
+
+		if size and duration:
+			values["throughput"] = size / max(duration, 0.001)
+
+		self.update(url, **values)
+
+	def record_failure(self, url):
+		self.update(url, failures=1.0)
+
+	def needs_probe(self, url, interval):
+		"""
+			Returns True, if the mirror has not been measured in the
+			last interval minutes.
+		"""
+		score = self.scores.get(url)
+		if not score:
+			return True
+
+		return time.time() - score.get("updated", 0) > interval * 60
+
+	def cost(self, url, default_throughput=None):
+		"""
+			Returns the estimated time of a typical download from this
+			mirror or None, if the mirror has not been measured, yet.
+
+			Mirrors that have only been probed are assumed to have the
+			default throughput.
+		"""
+		score = self.scores.get(url)
+		if not score or not score.has_key("latency"):
+			return
+
+		cost = score["latency"]
+
+		throughput = score.get("throughput", default_throughput)
+		if throughput:
+			cost += self.TYPICAL_SIZE / throughput
+
+		# Mirrors that failed recently are used later.
+		return cost * (1 + 10 * score.get("failures", 0))
+
+	def rank(self, urls):
+		"""
+			Sorts the given mirrors so that the fastest healthy one is first.
+
+			Mirrors that have not been measured, yet, come after all others in
+			random order and mirrors that only failed are last.
+		"""
+		known, unknown, broken = [], [], []
+
+		with self.lock:
+			# The median throughput of all mirrors that have one.
+			throughputs = sorted(s["throughput"] for s in self.scores.values() \
+				if s.get("throughput"))
+
+			if throughputs:
+				default_throughput = throughputs[len(throughputs) // 2]
+			else:
+				default_throughput = None
+
+			for url in urls:
+				cost = self.cost(url, default_throughput)
+
+				if cost is not None:
+					known.append((cost, url))
+				elif url in self.scores:
+					broken.append(url)
+				else:
+					unknown.append(url)
+
+		random.shuffle(unknown)
+
+		return [url for cost, url in sorted(known)] + unknown + broken
+
+
 class MirrorList(object):
+	# Time after which a mirror is given up while probing (in seconds).
+	PROBE_TIMEOUT = 5
+
+	# Number of mirrors that are probed at the same time.
+	PROBE_THREADS = 4
+
 	def __init__(self, pakfire, repo, mirrorlist):
 		self.pakfire = pakfire
 		self.repo = repo
 
 		self.__mirrors = []
+		self.__scoreboard = None
 
 		# Save URL to more mirrors.
 		self.mirrorlist = mirrorlist
 
+		# Downloads may run in several threads at the same time.
+		self.__lock = threading.Lock()
+
+		# Mirrors that are being probed right now.
+		self.__probing = set()
+
 	@property
 	def base_mirror(self):
 		if not self.repo.baseurl:
@@ -236,6 +517,19 @@ class MirrorList(object):
 		"""
 		return self.repo.cache
 
+	@property
+	def scoreboard(self):
+		"""
+			The measured performance of all mirrors.
+		"""
+		if self.__scoreboard is None:
+			cache_filename = os.path.join("repodata", self.distro.sname, self.distro.release,
+				self.repo.name, self.distro.arch, "mirrors.scores")
+
+			self.__scoreboard = MirrorScoreboard(self.cache, cache_filename)
+
+		return self.__scoreboard
+
 	def update(self, force=False):
 		# XXX should this be allowed?
 		if not self.mirrorlist:
@@ -322,40 +616,541 @@ class MirrorList(object):
 		for mirror in self.__mirrors:
 			yield mirror
 
-	def group(self, grabber):
+	def probe(self, urls):
 		"""
-			Return a MirrorGroup object for the given grabber.
+			Measures the latency of all mirrors that have not been
+			measured for a while.
+
+			This is done in the background, so the mirrors are ranked
+			by their measurements as soon as those are available.
+		"""
+		if self.pakfire.offline:
+			return
+
+		interval = self.pakfire.config.get_int("downloader", "mirror_probe_interval", TIME_24H)
+
+		with self.__lock:
+			urls = [u for u in urls if not u in self.__probing \
+				and self.scoreboard.needs_probe(u, interval)]
+
+			self.__probing.update(urls)
+
+		if not urls:
+			return
+
+		log.debug("Probing %s mirror(s) of repository '%s'" % (len(urls), self.repo.name))
+
+		queue = Queue.Queue()
+		for url in urls:
+			queue.put(url)
+
+		def worker():
+			while True:
+				try:
+					url = queue.get_nowait()
+				except Queue.Empty:
+					break
+
+				try:
+					self.probe_mirror(url)
+				finally:
+					with self.__lock:
+						self.__probing.discard(url)
+
+		for i in range(min(self.PROBE_THREADS, len(urls))):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+
+	def probe_mirror(self, url):
+		"""
+			Measures the latency of the given mirror.
+		"""
+		filename = os.path.join(METADATA_DOWNLOAD_PATH, METADATA_DOWNLOAD_FILE)
+
+		grabber = MetadataDownloader(self.pakfire, timeout=self.PROBE_TIMEOUT)
+
+		time_start = time.time()
+		try:
+			f = grabber.urlopen("%s/%s" % (url.rstrip("/"), filename))
+			try:
+				f.read(METADATA_DOWNLOAD_LIMIT)
+			finally:
+				f.close()
+
+		except (URLGrabError, IOError), e:
+			log.debug("Probing mirror %s failed: %s" % (url, e))
+			self.scoreboard.record_failure(url)
+			return
+
+		self.scoreboard.record_success(url, latency=time.time() - time_start)
+
+	def failure_callback(self, obj):
+		"""
+			Called by the mirror group when a download from a mirror failed.
+		"""
+		self.scoreboard.record_failure(obj.mirror)
+
+	def current(self, group):
+		"""
+			Returns the URL of the mirror that the last file of the
+			mirror group has been downloaded from.
+		"""
+		url = getattr(group.grabber, "url", None)
+		if not url:
+			return
+
+		mirrors = [m.url.encode("utf-8") for m in self.all]
+
+		base_mirror = self.base_mirror
+		if base_mirror:
+			mirrors.append(base_mirror.url.encode("utf-8"))
+
+		# Find the mirror with the longest matching URL.
+		for mirror in sorted(mirrors, key=len, reverse=True):
+			if url.startswith(mirror):
+				return mirror
+
+	def close(self):
+		"""
+			Writes the measured performance of the mirrors to disk.
 		"""
-		# Make sure the mirrorlist is up to date.
-		self.update()
+		if self.__scoreboard:
+			self.__scoreboard.flush()
 
-		# A list of mirrors that is passed to MirrorGroup.
-		mirrors = []
+	def get_urls(self):
+		"""
+			Returns the URLs of all mirrors in the order they
+			should be tried.
+		"""
+		with self.__lock:
+			# Make sure the mirrorlist is up to date.
+			self.update()
 
-		# Add all preferred mirrors at the first place and shuffle them
-		# that we will start at a random place.
-		for mirror in self.preferred:
-			mirrors.append({ "mirror" : mirror.url.encode("utf-8") })
-		random.shuffle(mirrors)
+			preferred = [m.url.encode("utf-8") for m in self.preferred]
+			others = [m.url.encode("utf-8") for m in self.non_preferred]
 
-		# All other mirrors are added as well and will only be used if all
-		# preferred mirrors did not work.
-		for mirror in self.all:
-			mirror = { "mirror" : mirror.url.encode("utf-8") }
-			if mirror in mirrors:
-				continue
+			# Add all preferred mirrors at the first place, the fastest first.
+			# All other mirrors are added as well and will only be used if all
+			# preferred mirrors did not work.
+			urls = []
+			for url in self.scoreboard.rank(preferred) + self.scoreboard.rank(others):
+				if not url in urls:
+					urls.append(url)
 
-			mirrors.append(mirror)
+		# Measure the mirrors from time to time.
+		if len(preferred + others) > 1:
+			self.probe(preferred + others)
 
 		# Always add the base mirror if any.
 		base_mirror = self.base_mirror
 		if base_mirror:
-			mirror = { "mirror" : base_mirror.url.encode("utf-8") }
-			if not mirror in mirrors:
-				mirrors.append(mirror)
+			url = base_mirror.url.encode("utf-8")
+			if not url in urls:
+				urls.append(url)
+
+		return urls
+
+	def group(self, grabber, first=None):
+		"""
+			Return a MirrorGroup object for the given grabber.
+
+			If first is given, this mirror is tried before all others.
+		"""
+		urls = self.get_urls()
+
+		if first in urls:
+			urls.remove(first)
+			urls.insert(0, first)
+
+		return MirrorGroup(grabber, [{ "mirror" : url } for url in urls],
+			failure_callback=self.failure_callback)
+
+
+class DownloadQueue(object):
+	"""
+		Downloads packages in several threads at the same time.
+
+		Every download starts at the mirror with the fewest running
+		downloads and no more than a certain number of downloads are
+		started on the same mirror at the same time.
+	"""
+	def __init__(self, pakfire, max_threads=None, max_per_mirror=None):
+		self.pakfire = pakfire
+
+		if max_threads is None:
+			max_threads = self.pakfire.config.get_int("downloader",
+				"parallel_downloads", 4)
+		self.max_threads = max(max_threads, 1)
+
+		if max_per_mirror is None:
+			max_per_mirror = self.pakfire.config.get_int("downloader",
+				"parallel_downloads_per_mirror", 2)
+		self.max_per_mirror = max(max_per_mirror, 1)
+
+		# Number of running downloads per mirror.
+		self.__running = {}
+		self.__cond = threading.Condition()
+
+		# Tells the threads to start no more downloads.
+		self.__stop = threading.Event()
+
+	def acquire_mirror(self, repo):
+		"""
+			Waits until one of the mirrors of the given repository can
+			take another download and returns its URL.
+
+			Returns None if the queue has been stopped in the meantime.
+		"""
+		urls = repo.mirrors.get_urls()
+		if not urls:
+			return
+
+		with self.__cond:
+			while True:
+				# No more downloads are started.
+				if self.__stop.is_set():
+					return
+
+				urls_free = [u for u in urls \
+					if self.__running.get(u, 0) < self.max_per_mirror]
+
+				if urls_free:
+					# Take the mirror with the fewest downloads. On a tie,
+					# the order of the mirror list is kept.
+					url = min(urls_free, key=lambda u: self.__running.get(u, 0))
+					self.__running[url] = self.__running.get(url, 0) + 1
+
+					return url
+
+				self.__cond.wait()
+
+	def release_mirror(self, url):
+		if url is None:
+			return
+
+		with self.__cond:
+			self.__running[url] -= 1
+			self.__cond.notify_all()
+
+	def download(self, pkgs, logger=None):
+		"""
+			Downloads all given packages and returns the binary
+			packages in the same order.
+		"""
+		return list(self.iter_download(pkgs, logger=logger))
+
+	def iter_download(self, pkgs, logger=None):
+		"""
+			Starts downloading all given packages in the background and
+			returns an iterator that yields the binary packages in the
+			same order as soon as they are available.
+		"""
+		if logger is None:
+			logger = log
+
+		results = {}
+		errors = []
+
+		stop = self.__stop
+		stop.clear()
+
+		# Signals that a download has finished.
+		cond = threading.Condition()
+
+		jobs = Queue.Queue()
+		for i, pkg in enumerate(pkgs):
+			jobs.put((i, pkg))
+
+		# Show one progress bar for all downloads.
+		progress = TextMultiFileMeter()
+		progress.start(numfiles=len(pkgs), total_size=sum((p.size for p in pkgs)))
+
+		def worker():
+			while not stop.is_set():
+				try:
+					i, pkg = jobs.get_nowait()
+				except Queue.Empty:
+					break
+
+				mirror = None
+				if not pkg.repo.local:
+					mirror = self.acquire_mirror(pkg.repo)
+
+				# The queue has been stopped while we were waiting.
+				if stop.is_set():
+					self.release_mirror(mirror)
+					break
+
+				try:
+					result = pkg.download(logger=logger,
+						progress_obj=progress.newMeter(), mirror=mirror)
+
+				# Stop all other downloads and raise the error later.
+				except:
+					with cond:
+						errors.append(sys.exc_info())
+						cond.notify_all()
+
+					self.stop()
+
+				else:
+					with cond:
+						results[i] = result
+						cond.notify_all()
+
+				finally:
+					self.release_mirror(mirror)
+
+		threads = []
+		for i in range(min(self.max_threads, len(pkgs))):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+
+			threads.append(thread)
+
+		def iterate():
+			try:
+				for i in range(len(pkgs)):
+					with cond:
+						while not i in results and not errors:
+							# Wait with a timeout so that the main thread
+							# can still be interrupted.
+							cond.wait(1)
+
+						if errors:
+							type, value, traceback = errors[0]
+							raise type, value, traceback
+
+						result = results.pop(i)
+
+					yield result
+
+			finally:
+				self.stop()
+
+				for thread in threads:
+					while thread.is_alive():
+						thread.join(1)
+
+				progress.end()
+
+		return iterate()
+
+	def stop(self):
+		"""
+			Cancels all downloads that have not been started, yet.
+		"""
+		self.__stop.set()
+
+		# Wake up all threads that are waiting for a mirror.
+		with self.__cond:
+			self.__cond.notify_all()
+
+
+class SegmentedDownloader(object):
+	"""
+		Downloads a file in several parts from different mirrors at
+		the same time.
+
+		Every mirror is used by one thread, which fetches one segment
+		after the other. Segments that failed are fetched from one of
+		the other mirrors.
+	"""
+	SEGMENT_SIZE = 4 * 1024**2
+
+	def __init__(self, pakfire, urls, max_mirrors=None, scoreboard=None):
+		self.pakfire = pakfire
+
+		if max_mirrors is None:
+			max_mirrors = self.pakfire.config.get_int("downloader",
+				"parallel_downloads", 4)
+		self.urls = urls[:max(max_mirrors, 1)]
+
+		self.scoreboard = scoreboard
+
+	def download(self, filename, size, output, state, text="", progress_obj=None):
+		"""
+			Downloads filename, which has got size bytes, into the file
+			output.
+
+			The segments that have been downloaded are recorded in the
+			file state, so that an interrupted download is continued
+			where it stopped.
+
+			Returns False if the file could not be downloaded in parts.
+		"""
+		done = self.read_state(state, output, size)
+
+		segments = Queue.Queue()
+		for start in xrange(0, size, self.SEGMENT_SIZE):
+			if not start in done:
+				segments.put((start, min(start + self.SEGMENT_SIZE, size)))
+
+		# Allocate the whole file, so that all segments can be written
+		# at their place.
+		if not done:
+			with open(output, "wb") as f:
+				f.truncate(size)
+
+			self.write_state(state, size, done)
+		else:
+			log.debug("Resuming download of %s with %s of %s segments" \
+				% (filename, len(done), len(done) + segments.qsize()))
+
+		if progress_obj:
+			progress_obj.start(text=text, size=size)
+
+		lock = threading.Lock()
+		progress = [sum(min(start + self.SEGMENT_SIZE, size) - start for start in done)]
+
+		def update_progress(amount):
+			with lock:
+				progress[0] += amount
+
+				if progress_obj:
+					progress_obj.update(progress[0])
+
+		def worker(url, failed):
+			grabber = PakfireGrabber(self.pakfire)
+
+			with open(output, "r+b") as f:
+				while True:
+					try:
+						start, end = segments.get_nowait()
+					except Queue.Empty:
+						break
+
+					if not self.fetch(grabber, url, filename, start, end, f, update_progress):
+						# Let another mirror fetch this segment.
+						segments.put((start, end))
+						failed.append(url)
+						break
+
+					# The segment must be on disk before it is recorded.
+					f.flush()
+
+					with lock:
+						done.add(start)
+						self.write_state(state, size, done)
+
+		# Mirrors that did not fail, yet.
+		urls = self.urls[:]
+
+		# Segments that have been given back by a failed mirror are fetched
+		# by the remaining mirrors in another round.
+		while urls and not segments.empty():
+			failed = []
+
+			threads = []
+			for url in urls:
+				thread = threading.Thread(target=worker, args=(url, failed))
+				thread.daemon = True
+				thread.start()
+
+				threads.append(thread)
+
+			for thread in threads:
+				while thread.is_alive():
+					thread.join(1)
+
+			urls = [u for u in urls if not u in failed]
+
+		if progress_obj:
+			progress_obj.end(progress[0])
+
+		return segments.empty()
+
+	def read_state(self, state, output, size):
+		"""
+			Returns the start of all segments that have already
+			been downloaded into output.
+		"""
+		try:
+			with open(state) as f:
+				state = json.load(f)
+
+			if not os.path.getsize(output) == size:
+				return set()
+
+		except (IOError, OSError, ValueError):
+			return set()
+
+		# The file has been downloaded with different segments.
+		if not state.get("size") == size \
+				or not state.get("segment_size") == self.SEGMENT_SIZE:
+			return set()
+
+		return set(state.get("done", []))
+
+	def write_state(self, state, size, done):
+		"""
+			Records which segments have been downloaded.
+		"""
+		with open("%s.tmp" % state, "w") as f:
+			json.dump({
+				"size"         : size,
+				"segment_size" : self.SEGMENT_SIZE,
+				"done"         : sorted(done),
+			}, f)
+
+		os.rename("%s.tmp" % state, state)
+
+	def fetch(self, grabber, url, filename, start, end, f, update_progress):
+		"""
+			Downloads the bytes from start to end from the given mirror
+			and writes them to f.
+		"""
+		time_start = time.time()
+		length = 0
+
+		try:
+			i = grabber.urlopen("%s/%s" % (url.rstrip("/"), filename), range=(start, end))
+
+			try:
+				# The server does not support ranges.
+				if not getattr(i, "http_code", 0) in (0, 206):
+					log.debug("%s does not support byte ranges" % url)
+					return False
+
+				latency = time.time() - time_start
+
+				f.seek(start)
+
+				buf = i.read(BUFFER_SIZE)
+				while buf:
+					if length + len(buf) > end - start:
+						raise IOError, "Received more data than requested"
+
+					f.write(buf)
+					length += len(buf)
+					update_progress(len(buf))
+
+					buf = i.read(BUFFER_SIZE)
+
+			finally:
+				i.close()
+
+			if not length == end - start:
+				raise IOError, "Received %s bytes instead of %s" % (length, end - start)
+
+		except (URLGrabError, IOError), e:
+			log.debug("Could not download %s-%s of %s from %s: %s" \
+				% (start, end, filename, url, e))
+
+			update_progress(-length)
+
+			if self.scoreboard:
+				self.scoreboard.record_failure(url)
+
+			return False
 
-		return MirrorGroup(grabber, mirrors)
+		if self.scoreboard:
+			self.scoreboard.record_success(url, latency=latency,
+				size=length, duration=time.time() - time_start - latency)
 
+		return True
 
 
 class Downloader(object):
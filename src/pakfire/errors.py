@@ -52,6 +52,10 @@ class ConfigError(Error):
 class DatabaseError(Error):
 	pass
 
+class DeltaError(Error):
+	message = _("Could not apply delta.")
+
+
 class DependencyError(Error):
 	exit_code = 4
 
@@ -34,6 +34,8 @@ TYPE_CONT = tarfile.CONTTYPE	# contiguous file
 TYPE_DIR_INT = int(TYPE_DIR)
 
 class _File(object):
+	__slots__ = ("pakfire",)
+
 	def __init__(self, pakfire):
 		self.pakfire = pakfire
 
@@ -87,73 +89,38 @@ class File(_File):
 
 
 class FileDatabase(_File):
-	def __init__(self, pakfire, db, row_id, row=None):
-		_File.__init__(self, pakfire)
+	"""
+		A file of an installed package.
 
-		self.db = db
-		self.row_id = row_id
-		self.__row = row
+		Installed packages can have thousands of files, so this
+		only holds the plain values from the database.
+	"""
+	__slots__ = ("pkg", "name", "size", "type", "config", "datafile", "mode",
+		"user", "group", "hash1", "mtime", "capabilities")
 
-	@property
-	def row(self):
-		"""
-			Lazy fetching of the database row.
-		"""
-		if self.__row is None:
-			c = self.db.cursor()
-			c.execute("SELECT * FROM files WHERE id = ? LIMIT 1", (self.row_id,))
-
-			self.__row = c.fetchone()
-			c.close()
+	def __init__(self, pakfire, pkg, name, size, type, config, datafile, mode,
+			user, group, hash1, mtime, capabilities):
+		_File.__init__(self, pakfire)
 
-		return self.__row
+		self.pkg = pkg
+		self.name = name
+		self.size = size
+		self.type = type
+		self.config = config
+		self.datafile = datafile
+		self.mode = mode
+		self.user = user
+		self.group = group
+		self.hash1 = hash1
+		self.mtime = mtime
+		self.capabilities = capabilities
 
 	def is_dir(self):
 		return self.type == TYPE_DIR_INT \
 			or self.name.endswith("/")
 
 	def is_config(self):
-		return self.row["config"] == 1
+		return self.config == 1
 
 	def is_datafile(self):
-		return self.row["datafile"] == 1
-
-	@property
-	def pkg(self):
-		return self.db.get_package_by_id(self.row["pkg"])
-
-	@property
-	def name(self):
-		return self.row["name"]
-
-	@property
-	def size(self):
-		return self.row["size"]
-
-	@property
-	def hash1(self):
-		return self.row["hash1"]
-
-	@property
-	def type(self):
-		return self.row["type"]
-
-	@property
-	def mode(self):
-		return self.row["mode"]
-
-	@property
-	def user(self):
-		return self.row["user"]
-
-	@property
-	def group(self):
-		return self.row["group"]
-
-	@property
-	def mtime(self):
-		return self.row["mtime"]
-
-	@property
-	def capabilities(self):
-		return self.row["capabilities"]
+		return self.datafile == 1
@@ -46,7 +46,7 @@ class LZMAFile(io.BufferedIOBase):
 
     def __init__(self, filename=None, mode="r",
                  fileobj=None, format=None, check=-1,
-                 preset=None, filters=None):
+                 preset=None, filters=None, threads=1):
         """Open an LZMA-compressed file.
 
         If filename is given, open the named file. Otherwise, operate on
@@ -86,6 +86,9 @@ class LZMAFile(io.BufferedIOBase):
         filters (if provided) should be a sequence of dicts. Each dict
         should have an entry for "id" indicating ID of the filter, plus
         additional entries for options to the filter.
+
+        threads is the number of threads that compress the data when
+        writing with FORMAT_XZ. 0 means one thread per CPU.
         """
         self._fp = None
         self._closefp = False
@@ -100,6 +103,9 @@ class LZMAFile(io.BufferedIOBase):
             if preset is not None:
                 raise ValueError("Cannot specify a preset compression "
                                  "level when opening a file for reading")
+            if threads != 1:
+                raise ValueError("Cannot specify a number of threads "
+                                 "when opening a file for reading")
             if format is None:
                 format = FORMAT_AUTO
             mode_code = _MODE_READ
@@ -114,7 +120,8 @@ class LZMAFile(io.BufferedIOBase):
                 format = FORMAT_XZ
             mode_code = _MODE_WRITE
             self._compressor = LZMACompressor(format=format, check=check,
-                                              preset=preset, filters=filters)
+                                              preset=preset, filters=filters,
+                                              threads=threads)
         else:
             raise ValueError("Invalid mode: {!r}".format(mode))
 
@@ -19,10 +19,8 @@
 #                                                                             #
 ###############################################################################
 
-import tarfile
-
 from base import Package
-from file import BinaryPackage, FilePackage, SourcePackage
+from file import BinaryPackage, FilePackage, SourcePackage, is_archive
 from installed import DatabasePackage, InstalledPackage
 from solv import SolvPackage
 
@@ -39,8 +37,8 @@ def open(pakfire, repo, filename):
 	"""
 	# XXX We should make this check much better...
 
-	# Simply check if the given file is a tarfile.
-	if tarfile.is_tarfile(filename):
+	# Simply check if the given file starts like a tarfile.
+	if is_archive(filename):
 		if filename.endswith(".src.%s" % PACKAGE_EXTENSION):
 			return SourcePackage(pakfire, repo, filename)
 
@@ -506,17 +506,15 @@ class Package(object):
 		# removed, the other one contains the configuration files which are
 		# kept. files and configfiles are disjunct.
 		files = []
-		configfiles = self.configfiles
-		datafiles = self.datafiles
 
 		for file in self.filelist:
-			if file in configfiles:
+			if file.is_config():
 				continue
 
-			if file in datafiles:
+			if file.is_datafile():
 				continue
 
-			assert file.startswith("/")
+			assert file.name.startswith("/")
 			files.append(file)
 
 		self._remove_files(files, message, prefix)
@@ -533,7 +531,7 @@ class Package(object):
 
 		# Sort files by the length of their name to remove all files in
 		# a directory first and then check, if there are any files left.
-		files.sort(cmp=lambda x,y: cmp(len(x.name), len(y.name)), reverse=True)
+		files.sort(key=lambda f: len(f.name), reverse=True)
 
 		# Messages to the user.
 		messages = []
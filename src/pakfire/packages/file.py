@@ -41,6 +41,125 @@ import lexer
 import make
 import tar
 
+def scan_archive(filename, algo="sha512"):
+	"""
+		Reads a package archive in one pass and returns the content of
+		the chksums file, all signatures and the hashes of all other
+		members.
+
+		This is a function of its own, so that it can be run in
+		another process.
+	"""
+	chksums = None
+	signatures = []
+	hashes = {}
+
+	a = tarfile.open(filename, format=tarfile.PAX_FORMAT)
+
+	try:
+		for member in a:
+			if not member.isfile():
+				continue
+
+			f = a.extractfile(member)
+
+			try:
+				if member.name == "chksums":
+					chksums = f.read()
+
+				elif member.name.startswith("signatures/"):
+					signature = f.read()
+
+					if signature:
+						signatures.append(signature)
+
+				else:
+					h = hashlib.new(algo)
+
+					buf = f.read(BUFFER_SIZE)
+					while buf:
+						h.update(buf)
+						buf = f.read(BUFFER_SIZE)
+
+					hashes[member.name] = h.hexdigest()
+
+			finally:
+				f.close()
+
+	finally:
+		a.close()
+
+	return chksums, signatures, hashes
+
+def is_archive(filename):
+	"""
+		Checks if the first header of the given file is a valid tar
+		header without reading the rest of the file.
+	"""
+	try:
+		with open(filename, "rb") as f:
+			buf = f.read(tarfile.BLOCKSIZE)
+
+		tarfile.TarInfo.frombuf(buf)
+
+	except (IOError, tarfile.HeaderError):
+		return False
+
+	return True
+
+class ArchiveMember(object):
+	"""
+		A read-only file object for a member of the outer tarball that
+		reads the data straight from the package file.
+	"""
+	def __init__(self, filename, offset, size):
+		self.fileobj = open(filename, "rb")
+
+		self.offset = offset
+		self.size = size
+		self.position = 0
+
+		# The position of fileobj relative to offset.
+		self.fileobj_position = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def tell(self):
+		return self.position
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.position
+		elif whence == 2:
+			offset += self.size
+
+		self.position = max(0, min(offset, self.size))
+
+	def read(self, size=-1):
+		if size < 0 or self.position + size > self.size:
+			size = self.size - self.position
+
+		# Seeking drops the read buffer of the file, so it is avoided
+		# when reading sequentially.
+		if not self.fileobj_position == self.position:
+			self.fileobj.seek(self.offset + self.position)
+
+		buf = self.fileobj.read(size)
+		self.position += len(buf)
+		self.fileobj_position = self.position
+
+		return buf
+
+	def readlines(self):
+		return self.read().splitlines(True)
+
+	def close(self):
+		self.fileobj.close()
+
 class FilePackage(base.Package):
 	"""
 		This class is a wrapper that reads package data from the (outer)
@@ -59,6 +178,9 @@ class FilePackage(base.Package):
 		self._filelist = None
 		self.__payload_compression = None
 
+		# Place to cache the positions of the members of the outer tarball.
+		self._members = None
+
 		# Store the format of this package file.
 		self.format = self.get_format()
 
@@ -67,13 +189,8 @@ class FilePackage(base.Package):
 
 		# Read the info file.
 		if self.format >= 1:
-			a = self.open_archive()
-			f = a.extractfile("info")
-
-			self.lexer = lexer.FileLexer(f.readlines())
-
-			f.close()
-			a.close()
+			with self.open_member("info") as f:
+				self.lexer = lexer.FileLexer(f.readlines())
 
 		elif self.format == 0:
 			pass
@@ -86,27 +203,19 @@ class FilePackage(base.Package):
 			Initially check if the given file is of the correct type and
 			can be opened.
 		"""
-		if not tarfile.is_tarfile(self.filename):
-			raise FileError, "Given file is not of correct format: %s" % self.filename
-
 		assert self.format in PACKAGE_FORMATS_SUPPORTED, self.format
 
 	def get_format(self):
-		a = self.open_archive()
 		try:
-			f = a.extractfile("pakfire-format")
+			format = self.read_member("pakfire-format")
 		except KeyError:
 			return 0
 
-		format = f.read()
 		try:
 			format = int(format)
 		except TypeError:
 			format = 0
 
-		f.close()
-		a.close()
-
 		return format
 
 	def __repr__(self):
@@ -120,18 +229,60 @@ class FilePackage(base.Package):
 	def open_archive(self, mode="r"):
 		return tarfile.open(self.filename, mode=mode, format=tarfile.PAX_FORMAT)
 
-	def open_payload_archive(self):
-		a = self.open_archive()
+	@property
+	def members(self):
+		"""
+			Walks through the headers of the outer tarball once and
+			caches the position and size of all regular files.
+		"""
+		if self._members is None:
+			members = {}
+
+			try:
+				a = self.open_archive()
+			except tarfile.TarError:
+				raise FileError, "Given file is not of correct format: %s" % self.filename
+
+			try:
+				for member in a:
+					if not member.isfile():
+						continue
+
+					members[member.name] = (member.offset_data, member.size)
+			finally:
+				a.close()
+
+			self._members = members
+
+		return self._members
+
+	def open_member(self, name):
+		"""
+			Opens a file from the outer tarball.
+
+			Raises KeyError if there is no such file.
+		"""
+		offset, size = self.members[name]
 
+		return ArchiveMember(self.filename, offset, size)
+
+	def read_member(self, name):
+		"""
+			Returns the content of a file from the outer tarball.
+		"""
+		with self.open_member(name) as f:
+			return f.read()
+
+	def open_payload_archive(self, writers=0):
 		# Find the payload data.
-		payload = a.extractfile("data.img")
+		payload = self.open_member("data.img")
 
 		# Decompress the payload if needed.
 		if self.payload_compression == "xz":
-			payload_archive = tar.InnerTarFileXz.open(fileobj=payload)
+			payload_archive = tar.InnerTarFileXz.open(fileobj=payload, writers=writers)
 
 		elif self.payload_compression == "none":
-			payload_archive = tar.InnerTarFile.open(fileobj=payload)
+			payload_archive = tar.InnerTarFile.open(fileobj=payload, writers=writers)
 
 		else:
 			raise Exception, "Unhandled payload compression type: %s" % \
@@ -139,14 +290,20 @@ class FilePackage(base.Package):
 
 		return payload_archive
 
-	def extract(self, message=None, prefix=None):
+	def extract(self, message=None, prefix=None, writers=EXTRACT_WRITERS):
+		"""
+			Extracts the payload to prefix.
+
+			writers is the number of threads that write small files
+			while the payload is being decompressed.
+		"""
 		log.debug("Extracting package %s" % self.friendly_name)
 
 		if prefix is None:
 			prefix = ""
 
 		# Open package data for read.
-		payload_archive = self.open_payload_archive()
+		payload_archive = self.open_payload_archive(writers=writers)
 
 		# Load progressbar.
 		pb = None
@@ -167,112 +324,113 @@ class FilePackage(base.Package):
 
 			name2file[name] = file
 
-		i = 0
-		while True:
-			member = payload_archive.next()
-			if not member:
-				break
-
-			# Check if file is also known in metadata.
-			name = member.name
-			if not name.startswith("/"):
-				name = "/%s" % name
-
-			try:
-				file = name2file[name]
-			except KeyError:
-				log.warning(_("File in archive is missing in file metadata: %s. Skipping.") % name)
-				continue
+		try:
+			i = 0
+			while True:
+				member = payload_archive.next()
+				if not member:
+					break
+
+				# Check if file is also known in metadata.
+				name = member.name
+				if not name.startswith("/"):
+					name = "/%s" % name
 
-			# Update progress.
-			if pb:
-				i += 1
-				pb.update(i)
+				try:
+					file = name2file[name]
+				except KeyError:
+					log.warning(_("File in archive is missing in file metadata: %s. Skipping.") % name)
+					continue
 
-			target = os.path.join(prefix, member.name)
+				# Update progress.
+				if pb:
+					i += 1
+					pb.update(i)
 
-			# Check if a configuration file is already present. We don't want to
-			# overwrite that.
-			if file.is_config():
-				config_save = "%s%s" % (target, CONFIG_FILE_SUFFIX_SAVE)
-				config_new  = "%s%s" % (target, CONFIG_FILE_SUFFIX_NEW)
+				target = os.path.join(prefix, member.name)
 
-				if os.path.exists(config_save) and not os.path.exists(target):
-					# Extract new configuration file, save it as CONFIG_FILE_SUFFIX_NEW,
-					# and reuse _SAVE.
-					payload_archive.extract(member, path=prefix)
+				# Check if a configuration file is already present. We don't want to
+				# overwrite that.
+				if file.is_config():
+					config_save = "%s%s" % (target, CONFIG_FILE_SUFFIX_SAVE)
+					config_new  = "%s%s" % (target, CONFIG_FILE_SUFFIX_NEW)
 
-					shutil.move(target, config_new)
-					shutil.move(config_save, target)
-					continue
+					if os.path.exists(config_save) and not os.path.exists(target):
+						# Extract new configuration file, save it as CONFIG_FILE_SUFFIX_NEW,
+						# and reuse _SAVE.
+						payload_archive.extract(member, path=prefix)
 
-				elif os.path.exists(target):
-					# If the files are identical, we skip the extraction of a
-					# new configuration file. We also do that when the new configuration file
-					# is a dummy file.
-					if file.size == 0:
+						shutil.move(target, config_new)
+						shutil.move(config_save, target)
 						continue
 
-					# Calc hash of the current configuration file.
-					config_hash1 = hashlib.new("sha512")
-					f = open(target)
-					while True:
-						buf = f.read(BUFFER_SIZE)
-						if not buf:
-							break
-						config_hash1.update(buf)
-					f.close()
-
-					if file.hash1 == config_hash1.hexdigest():
+					elif os.path.exists(target):
+						# If the files are identical, we skip the extraction of a
+						# new configuration file. We also do that when the new configuration file
+						# is a dummy file.
+						if file.size == 0:
+							continue
+
+						# Calc hash of the current configuration file.
+						config_hash1 = hashlib.new("sha512")
+						f = open(target)
+						while True:
+							buf = f.read(BUFFER_SIZE)
+							if not buf:
+								break
+							config_hash1.update(buf)
+						f.close()
+
+						if file.hash1 == config_hash1.hexdigest():
+							continue
+
+						# Backup old configuration file and extract new one.
+						shutil.move(target, config_save)
+						payload_archive.extract(member, path=prefix)
+
+						# Save new configuration file as CONFIG_FILE_SUFFIX_NEW and
+						# restore old configuration file.
+						shutil.move(target, config_new)
+						shutil.move(config_save, target)
+
+						if prefix:
+							config_new = os.path.relpath(config_new, prefix)
+						messages.append(_("Config file created as %s") % config_new)
 						continue
 
-					# Backup old configuration file and extract new one.
-					shutil.move(target, config_save)
-					payload_archive.extract(member, path=prefix)
+				# Existing files are replaced by the extraction, so we only
+				# need to know if there is one for datafiles and directories.
+				if file.is_datafile() or member.isdir():
+					exists = os.path.exists(target)
+				else:
+					exists = False
 
-					# Save new configuration file as CONFIG_FILE_SUFFIX_NEW and
-					# restore old configuration file.
-					shutil.move(target, config_new)
-					shutil.move(config_save, target)
+				# Don't overwrite target files if they already exist.
+				if file.is_datafile() and exists:
+					log.debug(_("Don't overwrite already existing datafile '/%s'") % member.name)
+					continue
 
-					if prefix:
-						config_new = os.path.relpath(config_new, prefix)
-					messages.append(_("Config file created as %s") % config_new)
+				# If the member is a directory and if it already exists, we
+				# don't need to create it again.
+				if member.isdir() and exists:
 					continue
 
-			# Don't overwrite target files if they already exist.
-			if file.is_datafile() and os.path.exists(target):
-				log.debug(_("Don't overwrite already existing datafile '/%s'") % member.name)
-				continue
+				#if self.pakfire.config.get("debug"):
+				#	msg = "Creating file (%s:%03d:%03d) " % \
+				#		(tarfile.filemode(member.mode), member.uid, member.gid)
+				#	if member.issym():
+				#		msg += "/%s -> %s" % (member.name, member.linkname)
+				#	elif member.islnk():
+				#		msg += "/%s link to /%s" % (member.name, member.linkname)
+				#	else:
+				#		msg += "/%s" % member.name
+				#	log.debug(msg)
 
-			# If the member is a directory and if it already exists, we
-			# don't need to create it again.
-			if os.path.exists(target):
-				if member.isdir():
-					continue
+				payload_archive.extract(member, path=prefix, background=True)
 
-				else:
-					# Remove file if it has been existant
-					try:
-						os.unlink(target)
-					except OSError:
-						messages.append(_("Could not remove file: /%s") % member.name)
-
-			#if self.pakfire.config.get("debug"):
-			#	msg = "Creating file (%s:%03d:%03d) " % \
-			#		(tarfile.filemode(member.mode), member.uid, member.gid)
-			#	if member.issym():
-			#		msg += "/%s -> %s" % (member.name, member.linkname)
-			#	elif member.islnk():
-			#		msg += "/%s link to /%s" % (member.name, member.linkname)
-			#	else:
-			#		msg += "/%s" % member.name
-			#	log.debug(msg)
-
-			payload_archive.extract(member, path=prefix)
-
-		# Close all open files.
-		payload_archive.close()
+		# Close all open files. This waits for the writers, too.
+		finally:
+			payload_archive.close()
 
 		if pb:
 			pb.finish()
@@ -314,10 +472,7 @@ class FilePackage(base.Package):
 		assert self.format == 0, self
 
 		if not self._metadata:
-			a = self.open_archive()
-			f = a.extractfile("info")
-
-			for line in f.readlines():
+			for line in self.read_member("info").splitlines():
 				m = re.match(r"^(\w+)=(.*)$", line)
 				if m is None:
 					continue
@@ -325,9 +480,6 @@ class FilePackage(base.Package):
 				key, val = m.groups()
 				self._metadata[key] = val.strip("\"")
 
-			f.close()
-			a.close()
-
 		return self._metadata
 
 	@property
@@ -351,28 +503,24 @@ class FilePackage(base.Package):
 		return inst_size
 
 	def read_plain_filelist(self, filename):
-		a = self.open_archive()
 		files = []
 
 		try:
-			f = a.extractfile(filename)
-			for line in f.readlines():
-				# Strip newline at end of line.
-				file = line.rstrip()
-
-				# Add a leading / is not present.
-				if not file.startswith("/"):
-					file = "/%s" % file
-
-				files.append(file)
-			f.close()
+			lines = self.read_member(filename).splitlines()
 
 		# Ignore if 'filename' does not exist.
 		except KeyError:
-			pass
+			return files
 
-		finally:
-			a.close()
+		for line in lines:
+			# Strip newline at end of line.
+			file = line.rstrip()
+
+			# Add a leading / is not present.
+			if not file.startswith("/"):
+				file = "/%s" % file
+
+			files.append(file)
 
 		return files
 
@@ -383,20 +531,17 @@ class FilePackage(base.Package):
 		"""
 		ret = []
 
-		a = self.open_archive()
-
 		# Cache configfiles.
 		if self.format >= 5:
 			filename = "configfiles"
 		else:
 			filename = "configs"
-		configfiles = self.read_plain_filelist(filename)
+		configfiles = set(self.read_plain_filelist(filename))
 
 		# Cache datafiles.
-		datafiles = self.read_plain_filelist("datafiles")
+		datafiles = set(self.read_plain_filelist("datafiles"))
 
-		f = a.extractfile("filelist")
-		for line in f.readlines():
+		for line in self.read_member("filelist").splitlines():
 			line = line.strip()
 
 			file = pakfire.filelist.File(self.pakfire)
@@ -472,9 +617,6 @@ class FilePackage(base.Package):
 
 			ret.append(file)
 
-		f.close()
-		a.close()
-
 		return ret
 
 	@property
@@ -499,14 +641,9 @@ class FilePackage(base.Package):
 		"""
 		# We cache that because this is costly.
 		if self.__payload_compression is None:
-			a = self.open_archive()
-			f = a.extractfile("data.img")
-
-			# Go and guess what we do have here.
-			self.__payload_compression = compress.guess_algo(fileobj=f)
-
-			f.close()
-			a.close()
+			with self.open_member("data.img") as f:
+				# Go and guess what we do have here.
+				self.__payload_compression = compress.guess_algo(fileobj=f)
 
 		return self.__payload_compression or "none"
 
@@ -519,41 +656,27 @@ class FilePackage(base.Package):
 		"""
 		ret = {}
 
-		# Open the archive for reading.
-		a = self.open_archive()
-
-		for member in a.getmembers():
+		for name in self.members:
 			# Skip all files that are not a signature.
-			if not member.name.startswith("signatures/"):
+			if not name.startswith("signatures/"):
 				continue
 
 			# Get the ID of the key.
-			key_id = os.path.basename(member.name)
+			key_id = os.path.basename(name)
 
 			# Get the content of the signature file.
-			f = a.extractfile(member.name)
-			signature = f.read()
-			f.close()
+			signature = self.read_member(name)
 
 			if signature:
 				ret[key_id] = signature
 
-		# Close the archive.
-		a.close()
-
 		return ret
 
 	def has_signature(self, key_id):
 		"""
 			Check if the file a signature of the given key.
 		"""
-		f = self.open_file("signatures/%s" % key_id)
-		if f:
-			f.close()
-
-			return True
-
-		return False
+		return "signatures/%s" % key_id in self.members
 
 	def __has_hardlinks(self):
 		"""
@@ -608,14 +731,8 @@ class FilePackage(base.Package):
 
 		# XXX verify the content of the file here.
 
-		# Open the archive and read the checksum file.
-		a = self.open_archive()
-
-		f = a.extractfile("chksums")
-		cleartext = f.read()
-
-		f.close()
-		a.close()
+		# Read the checksum file.
+		cleartext = self.read_member("chksums")
 
 		# Create the signature.
 		signature = self.pakfire.keyring.sign(key_id, cleartext)
@@ -635,68 +752,56 @@ class FilePackage(base.Package):
 		finally:
 			os.unlink(f.name)
 
+			# The content of the archive has changed.
+			self._members = None
+
 		return True
 
-	def verify(self):
+	def verify(self, scan=None):
 		"""
 			Verify the tarball against the given key.
 
 			If not key is given, only the checksums are compared to
 			the actual data.
+
+			scan may be the result of scan_archive() if the archive
+			has already been read.
 		"""
+		if scan is None:
+			scan = scan_archive(self.filename)
 
-		# XXX replace Exception
+		chksums, signatures, hashes = scan
 
-		# Read the data of the checksum file.
-		a = self.open_archive()
-		f = a.extractfile("chksums")
-		chksums = f.read()
-		f.close()
-		a.close()
+		if chksums is None:
+			raise SignatureError, _("%s has got no checksums") % self.friendly_name
 
 		sigs = []
-		for signature in self.signatures.values():
+		for signature in signatures:
 			sigs += self.pakfire.keyring.verify(signature, chksums)
 
-		# Open the archive to access all files we will need.
-		a = self.open_archive()
-
-		# Read the chksums file.
-		chksums = {}
-		f = a.extractfile("chksums")
-		for line in f.readlines():
+		for line in chksums.splitlines():
 			filename, chksum = line.split()
-			chksums[filename] = chksum
-		f.close()
-		a.close()
 
-		for filename, chksum in chksums.items():
-			ret = self.check_chksum(filename, chksum)
-
-			if ret:
+			if hashes.get(filename) == chksum:
 				log.debug("Checksum of %s matches." % filename)
 				continue
-			else:
-				log.debug("Checksum of %s does not match." % filename)
 
-			raise Exception, "Checksum does not match: %s" % filename
+			log.debug("Checksum of %s does not match." % filename)
+
+			raise SignatureError, _("Checksum does not match: %s") % filename
 
 		return sigs
 
 	def check_chksum(self, filename, chksum, algo="sha512"):
-		a = self.open_archive()
-		f = a.extractfile(filename)
-
 		h = hashlib.new(algo)
-		while True:
-			buf = f.read(BUFFER_SIZE)
-			if not buf:
-				break
 
-			h.update(buf)
+		with self.open_member(filename) as f:
+			while True:
+				buf = f.read(BUFFER_SIZE)
+				if not buf:
+					break
 
-		f.close()
-		a.close()
+				h.update(buf)
 
 		return h.hexdigest() == chksum
 
@@ -1015,20 +1120,11 @@ class BinaryPackage(FilePackage):
 	_type = "binary"
 
 	def get_scriptlet(self, type):
-		a = self.open_archive()
-
 		# Path of the scriptlet in the tarball.
 		path = "scriptlets/%s" % type
 
 		try:
-			f = a.extractfile(path)
+			return self.read_member(path)
 		except KeyError:
 			# If the scriptlet is not available, we just return.
 			return
-
-		scriptlet = f.read()
-
-		f.close()
-		a.close()
-
-		return scriptlet
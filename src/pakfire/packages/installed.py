@@ -22,7 +22,6 @@
 import os
 
 import pakfire.downloader
-import pakfire.filelist
 
 from base import Package
 from file import BinaryPackage
@@ -39,6 +38,7 @@ class DatabasePackage(Package):
 		self.db = db
 
 		self._data = {}
+		self._dependencies = None
 		self._filelist = None
 
 		for key in data.keys():
@@ -150,21 +150,17 @@ class DatabasePackage(Package):
 
 		return inst_size
 
-	@property
-	def dependencies(self):
-		if not hasattr(self, "__dependencies"):
-			self.__dependencies = {}
+	def get_dependencies(self):
+		if self._dependencies is None:
+			dependencies = self.db.get_dependencies([self])
+			self._dependencies = dependencies.get(self.id, {})
 
-			c = self.db.cursor()
-			c.execute("SELECT type, dependency FROM dependencies WHERE pkg = ?", (self.id,))
+		return self._dependencies
 
-			for type, dependency in c.fetchall():
-				try:
-					self.__dependencies[type].append(dependency)
-				except KeyError:
-					self.__dependencies[type] = [dependency,]
+	def set_dependencies(self, dependencies):
+		self._dependencies = dependencies
 
-		return self.__dependencies
+	dependencies = property(get_dependencies, set_dependencies)
 
 	@property
 	def provides(self):
@@ -217,19 +213,17 @@ class DatabasePackage(Package):
 	def filename(self):
 		return self.metadata.get("filename")
 
-	@property
-	def filelist(self):
+	def get_filelist(self):
 		if self._filelist is None:
-			self._filelist = []
+			filelists = self.db.get_filelists([self])
+			self._filelist = filelists.get(self.id, [])
 
-			c = self.db.cursor()
-			c.execute("SELECT * FROM files WHERE pkg = ?", (self.id,))
+		return self._filelist
 
-			for row in c.fetchall():
-				file = pakfire.filelist.FileDatabase(self.pakfire, self.db, row["id"], row)
-				self._filelist.append(file)
+	def set_filelist(self, filelist):
+		self._filelist = filelist
 
-		return self._filelist
+	filelist = property(get_filelist, set_filelist)
 
 	@property
 	def configfiles(self):
@@ -259,6 +253,10 @@ class DatabasePackage(Package):
 		"""
 			A faster version to find a file in the database.
 		"""
+		# Lookup plain paths in the index.
+		if not any((c in requires.requires for c in "*?[")):
+			return self.id in self.db.get_file_owners(requires.requires)
+
 		c = self.db.cursor()
 		c.execute("SELECT * FROM files WHERE name GLOB ? AND pkg = ?",
 			(requires.requires, self.id))
@@ -331,33 +329,17 @@ class DatabasePackage(Package):
 		return BinaryPackage(self.pakfire, self.repo, filename)
 
 	def cleanup(self, message, prefix):
-		c = self.db.cursor()
-
 		# Get all files, that are in this package and check for all of
 		# them if they need to be removed.
 		files = self.filelist
 
-		# Fetch the whole filelist of the system from the database and create
-		# a diff. Exclude files from this package - of course.
-		c.execute("SELECT DISTINCT name FROM files WHERE pkg != ?", (self.id,))
-
-		installed_files = set()
-		for row in c:
-			installed_files.add(row["name"])
-		c.close()
-
 		# List with files to be removed.
 		remove_files = []
 
 		for f in files:
 			# Try to find the if an other package owns the file.
 			# Handles packages that move files from / to /usr.
-			try:
-				filename = os.path.abspath(f.name)
-			except OSError:
-				filename = f.name
-
-			if filename in installed_files:
+			if self.db.is_file_owned(f.name, exclude=self.id):
 				continue
 
 			remove_files.append(f)
@@ -225,6 +225,21 @@ class BinaryPackager(Packager):
 		self.builder = builder
 		self.buildroot = buildroot
 
+	@property
+	def compression_preset(self):
+		"""
+			The xz compression level of the payload.
+		"""
+		return self.pakfire.config.get_int("builder", "compression_preset", None)
+
+	@property
+	def compression_threads(self):
+		"""
+			The number of threads that compress the payload
+			(0 means one per CPU).
+		"""
+		return self.pakfire.config.get_int("builder", "compression_threads", 1)
+
 	def create_metafile(self, datafile):
 		info = collections.defaultdict(lambda: "")
 
@@ -401,7 +416,8 @@ class BinaryPackager(Packager):
 
 		datafile = self.mktemp()
 		if self.payload_compression == "xz":
-			t = tar.InnerTarFileXz.open(datafile, mode="w")
+			t = tar.InnerTarFileXz.open(datafile, mode="w",
+				preset=self.compression_preset, threads=self.compression_threads)
 		else:
 			t = tar.InnerTarFile.open(datafile, mode="w")
 
@@ -250,8 +250,8 @@ class SolvPackage(base.Package):
 	def get_from_db(self):
 		return self.pakfire.repos.local.get_package_by_uuid(self.uuid)
 
-	def download(self, text="", logger=None):
+	def download(self, text="", logger=None, **kwargs):
 		if not self.repo.local:
-			self.repo.download(self, text=text, logger=logger)
+			self.repo.download(self, text=text, logger=logger, **kwargs)
 
 		return self.get_from_cache()
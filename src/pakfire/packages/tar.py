@@ -19,8 +19,15 @@
 #                                                                             #
 ###############################################################################
 
+import Queue
+import errno
+import grp
 import os
+import pwd
+import shutil
+import sys
 import tarfile
+import threading
 
 import logging
 log = logging.getLogger("pakfire")
@@ -31,12 +38,34 @@ from pakfire.constants import *
 from pakfire.i18n import _
 
 class InnerTarFile(tarfile.TarFile):
+	# Files are extracted to a temporary name and then renamed.
+	TMP_SUFFIX = ".pakfire-tmp"
+
+	# Files that are bigger than this are not handed over to the writers,
+	# because their data has to be kept in memory until it is written.
+	WRITER_MAX_SIZE = 1024 ** 2
+
 	def __init__(self, *args, **kwargs):
+		# Number of threads that write extracted files to disk.
+		self.writers = kwargs.pop("writers", 0)
+
 		# Force the PAX format.
 		kwargs["format"] = tarfile.PAX_FORMAT
 
 		tarfile.TarFile.__init__(self, *args, **kwargs)
 
+		# Directories that are known to exist.
+		self._directories = set()
+
+		# Cache for the lookups of users and groups.
+		self._ids = {}
+
+		self._queue = None
+		self._threads = []
+
+		# Errors of the writers that are raised by flush() and close().
+		self._errors = []
+
 	def add(self, name, arcname=None, recursive=None, exclude=None, filter=None):
 		"""
 			Emulate the add function with capability support.
@@ -70,39 +99,272 @@ class InnerTarFile(tarfile.TarFile):
 		# Return the tar information about the file
 		return tarinfo
 
-	def extract(self, member, path=""):
-		target = os.path.join(path, member.name)
+	def extract(self, member, path="", background=False):
+		"""
+			Extracts member to path.
 
-		# Remove symlink targets, because tarfile cannot replace them.
-		if member.issym():
-			try:
-				os.unlink(target)
-			except OSError:
-				pass
+			Regular files, symlinks and hardlinks are created under a
+			temporary name and atomically renamed to replace any existing
+			file. If background is True, small files may be written by
+			the writer threads after this function has returned.
+		"""
+		target = os.path.join(path, member.name)
 
-		# Extract file the normal way...
 		try:
-			tarfile.TarFile.extract(self, member, path)
+			if member.isreg():
+				self._extract_file(member, target, background=background)
+
+			elif member.issym() or member.islnk():
+				self._extract_link(member, path, target)
+
+			elif member.isdir():
+				if not target in self._directories:
+					tarfile.TarFile.extract(self, member, path)
+					self._directories.add(target)
+
+			else:
+				# Remove the old file, because tarfile cannot replace it.
+				try:
+					os.unlink(target)
+				except OSError:
+					pass
+
+				self._makedirs(os.path.dirname(target))
+				tarfile.TarFile.extract(self, member, path)
+
 		except OSError, e:
 			log.warning(_("Could not extract file: /%(src)s - %(dst)s") \
 				% { "src" : member.name, "dst" : e, })
 
-		if path:
-			target = os.path.join(path, member.name)
+	def _makedirs(self, path):
+		"""
+			Creates path and all its parents, if they are not known to
+			exist already.
+		"""
+		if not path or path in self._directories:
+			return
+
+		try:
+			os.mkdir(path)
+
+		except OSError, e:
+			# Create the parent directory first.
+			if e.errno == errno.ENOENT:
+				self._makedirs(os.path.dirname(path))
+				os.mkdir(path)
+
+			elif not e.errno == errno.EEXIST or not os.path.isdir(path):
+				raise
+
+		self._directories.add(path)
+
+	def _get_ids(self, member):
+		"""
+			Returns the UID and GID the member has to be owned by.
+		"""
+		key = (member.uname, member.gname, member.uid, member.gid)
+
+		try:
+			return self._ids[key]
+		except KeyError:
+			pass
+
+		try:
+			uid = pwd.getpwnam(member.uname).pw_uid
+		except KeyError:
+			uid = member.uid
+
+		try:
+			gid = grp.getgrnam(member.gname).gr_gid
+		except KeyError:
+			gid = member.gid
+
+		self._ids[key] = uid, gid
+
+		return uid, gid
+
+	def _extract_file(self, member, target, background=False):
+		self._makedirs(os.path.dirname(target))
+
+		source = self.extractfile(member)
+
+		if background and self.writers and member.size <= self.WRITER_MAX_SIZE:
+			# Read the data here, because the archive can only be read in order,
+			# and let one of the writers put it to disk.
+			data = source.read()
+
+			self._start_writers()
+			self._queue.put((member, target, data))
+
+			# Stop as soon as one of the writers has failed.
+			self._raise_errors()
+
 		else:
-			target = "/%s" % member.name
+			self._write_file(member, target, source)
+
+	def _write_file(self, member, target, source):
+		"""
+			Writes the data from source (a file or a string) to a temporary
+			file, sets all attributes and moves it to target.
+		"""
+		tmp = "%s%s" % (target, self.TMP_SUFFIX)
+
+		try:
+			f = open(tmp, "wb")
+			try:
+				if isinstance(source, basestring):
+					f.write(source)
+				else:
+					shutil.copyfileobj(source, f, BUFFER_SIZE)
+
+				# Changing the owner resets the mode, so it has to be done first.
+				if os.geteuid() == 0:
+					os.fchown(f.fileno(), *self._get_ids(member))
 
-		# ...and then apply the capabilities.
-		caps = member.pax_headers.get("PAKFIRE.capabilities", None)
-		if caps:
-			log.debug("Restoring capabilities for /%s: %s" % (member.name, caps))
-			util.set_capabilities(target, caps)
+				os.fchmod(f.fileno(), member.mode)
+			finally:
+				f.close()
+
+			os.utime(tmp, (member.mtime, member.mtime))
+
+			# Restore the capabilities.
+			caps = member.pax_headers.get("PAKFIRE.capabilities", None)
+			if caps:
+				log.debug("Restoring capabilities for /%s: %s" % (member.name, caps))
+				util.set_capabilities(tmp, caps)
+
+			os.rename(tmp, target)
+
+		except:
+			# Keep the original error, because Python 2 would raise
+			# the one of unlink() otherwise.
+			type, value, traceback = sys.exc_info()
+
+			try:
+				os.unlink(tmp)
+			except OSError:
+				pass
+
+			raise type, value, traceback
+
+	def _extract_link(self, member, path, target):
+		self._makedirs(os.path.dirname(target))
+
+		tmp = "%s%s" % (target, self.TMP_SUFFIX)
+
+		try:
+			if member.issym():
+				os.symlink(member.linkname, tmp)
+
+				if os.geteuid() == 0:
+					os.lchown(tmp, *self._get_ids(member))
+
+			else:
+				# The file the hardlink points to must have been written.
+				self.flush()
+
+				os.link(os.path.join(path, member.linkname), tmp)
+
+			os.rename(tmp, target)
+
+		except:
+			# Keep the original error, because Python 2 would raise
+			# the one of unlink() otherwise.
+			type, value, traceback = sys.exc_info()
+
+			try:
+				os.unlink(tmp)
+			except OSError:
+				pass
+
+			raise type, value, traceback
+
+	def _start_writers(self):
+		if self._queue:
+			return
+
+		self._queue = Queue.Queue(self.writers * 16)
+
+		for i in range(self.writers):
+			thread = threading.Thread(target=self._writer)
+			thread.daemon = True
+			thread.start()
+
+			self._threads.append(thread)
+
+	def _writer(self):
+		while True:
+			job = self._queue.get()
+
+			try:
+				# Exit when there is nothing to do any more.
+				if job is None:
+					return
+
+				member, target, data = job
+
+				# Errors are handled the same way as in extract().
+				try:
+					self._write_file(member, target, data)
+
+				except OSError, e:
+					log.warning(_("Could not extract file: /%(src)s - %(dst)s") \
+						% { "src" : member.name, "dst" : e, })
+
+				except:
+					self._errors.append(sys.exc_info())
+
+			finally:
+				self._queue.task_done()
+
+	def _raise_errors(self):
+		"""
+			Raises the first error of the writers.
+		"""
+		if self._errors:
+			type, value, traceback = self._errors[0]
+			self._errors = []
+
+			raise type, value, traceback
+
+	def flush(self):
+		"""
+			Waits until all files have been written to disk.
+		"""
+		if self._queue:
+			self._queue.join()
+
+		self._raise_errors()
+
+	def close(self):
+		try:
+			# Stop all writers.
+			if self._queue:
+				for thread in self._threads:
+					self._queue.put(None)
+
+				for thread in self._threads:
+					thread.join()
+
+				self._queue = None
+				self._threads = []
+
+		finally:
+			tarfile.TarFile.close(self)
+
+		self._raise_errors()
 
 
 class InnerTarFileXz(InnerTarFile):
 	@classmethod
 	def open(cls, name=None, mode="r", fileobj=None, **kwargs):
-		fileobj = lzma.LZMAFile(name, mode, fileobj=fileobj)
+		# The compression settings are only used for writing.
+		options = {}
+		for key in ("preset", "threads"):
+			if key in kwargs:
+				options[key] = kwargs.pop(key)
+
+		fileobj = lzma.LZMAFile(name, mode, fileobj=fileobj, **options)
 
 		try:
 			t = cls.taropen(name, mode, fileobj, **kwargs)
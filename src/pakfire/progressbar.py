@@ -24,6 +24,7 @@ from __future__ import division
 import datetime
 import fcntl
 import math
+import os
 import signal
 import struct
 import sys
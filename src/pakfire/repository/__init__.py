@@ -19,15 +19,22 @@
 #                                                                             #
 ###############################################################################
 
+import Queue
 import re
+import threading
 
 import logging
 log = logging.getLogger("pakfire")
 
+from urlgrabber.progress import TextMultiFileMeter
+
 import pakfire.packages as packages
+import pakfire.util as util
 
 from pakfire.i18n import _
 
+import cache
+
 from base import RepositoryDummy
 from local import RepositoryDir, RepositoryBuild
 from remote import RepositoryRemote
@@ -91,12 +98,68 @@ class Repositories(object):
 			return
 
 		log.info(_("Initializing repositories..."))
+
+		# Download the metadata and databases of all remote repositories
+		# at the same time. Reading them into the pool cannot be done
+		# concurrently and is done afterwards.
+		self.update_remote([r for r in self \
+			if isinstance(r, RepositoryRemote) and not r.opened])
+
 		for repo in self:
 			repo.open()
 
 		# Empty line.
 		log.info("")
 
+	def update_remote(self, repos):
+		"""
+			Updates the given remote repositories in parallel.
+		"""
+		num_threads = self.config.get_int("downloader", "parallel_repositories", 4)
+		num_threads = min(num_threads, len(repos))
+
+		# Nothing to gain from threads.
+		if num_threads < 2:
+			return
+
+		queue = Queue.Queue()
+		for repo in repos:
+			queue.put(repo)
+
+		# Show the progress of all downloads at once.
+		progress = TextMultiFileMeter()
+		progress.start(numfiles=len(repos))
+
+		def worker():
+			while True:
+				try:
+					repo = queue.get_nowait()
+				except Queue.Empty:
+					break
+
+				try:
+					repo.update(progress_obj=progress.newMeter())
+
+				# Errors are raised again when the repository is opened.
+				except Exception, e:
+					log.debug("Could not update repository %s: %s" % (repo.name, e))
+
+		threads = []
+		for i in range(num_threads):
+			thread = threading.Thread(target=worker)
+			thread.daemon = True
+			thread.start()
+
+			threads.append(thread)
+
+		# Join with a timeout so that the main thread can still
+		# be interrupted.
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(1)
+
+		progress.end()
+
 	def shutdown(self):
 		"""
 			Shuts down all repositores.
@@ -197,6 +260,38 @@ class Repositories(object):
 	def whatprovides(self, *args, **kwargs):
 		return self.pool.whatprovides(self.pakfire, *args, **kwargs)
 
+	def clean_cache(self, max_size=None, max_age=None, keep=[]):
+		"""
+			Removes the least recently used packages from the download
+			cache.
+
+			If max_size or max_age are not given, the limits from the
+			configuration are used.
+		"""
+		config = self.pakfire.config
+
+		if max_size is None:
+			max_size = config.get("downloader", "cache_max_size")
+			if max_size:
+				max_size = util.parse_size(max_size)
+
+		if max_age is None:
+			max_age = config.get_int("downloader", "cache_max_age")
+
+		freed = cache.RepositoryCache(self.pakfire, None).clean(
+			max_size=max_size, max_age=max_age, keep=keep)
+
+		if freed:
+			log.info(_("Removed %sB of packages from the cache.") % util.format_size(freed))
+
+		return freed
+
+	def flush_cache_index(self):
+		"""
+			Writes when the packages in the download cache have been used.
+		"""
+		cache.flush_indexes()
+
 	def clean(self):
 		log.info("Cleaning up all repository caches...")
 
@@ -19,13 +19,171 @@
 #                                                                             #
 ###############################################################################
 
+import errno
+import json
 import os
+import sqlite3
 import stat
+import threading
 import time
 
+import logging
+log = logging.getLogger("pakfire")
+
 import pakfire.util as util
 from pakfire.constants import *
 
+class CacheIndex(object):
+	"""
+		Remembers the size and the time of the last access of all
+		packages in the cache, so that the least recently used ones
+		can be found without looking at every file.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.filename = os.path.join(self.path, "cache.db")
+
+		# The index is shared by all threads.
+		self.lock = threading.Lock()
+
+		# Accesses that have not been written to the database yet.
+		self.pending = {}
+
+		self.__db = None
+
+	@property
+	def db(self):
+		if self.__db is None:
+			if not os.path.exists(self.path):
+				os.makedirs(self.path)
+
+			create = not os.path.exists(self.filename)
+
+			self.__db = sqlite3.connect(self.filename, check_same_thread=False)
+			self.__db.execute("CREATE TABLE IF NOT EXISTS files(filename TEXT PRIMARY KEY, \
+				size INTEGER, atime INTEGER)")
+
+			# Import the files that have been downloaded before there was an index.
+			if create:
+				self.scan()
+
+		return self.__db
+
+	def scan(self):
+		"""
+			Adds all packages that are in the cache to the index.
+		"""
+		files = []
+
+		for dir, subdirs, filenames in os.walk(self.path):
+			# Skip the metadata of the repositories.
+			if dir == self.path:
+				subdirs[:] = [d for d in subdirs if not d == "repodata"]
+				continue
+
+			for filename in filenames:
+				if not filename.endswith(".%s" % PACKAGE_EXTENSION):
+					continue
+
+				filename = os.path.join(dir, filename)
+				st = os.stat(filename)
+
+				files.append((os.path.relpath(filename, self.path),
+					st.st_size, int(st.st_atime)))
+
+		log.debug("Adding %s files to the cache index" % len(files))
+
+		self.__db.executemany("INSERT OR REPLACE INTO files(filename, size, atime) \
+			VALUES(?, ?, ?)", files)
+		self.__db.commit()
+
+	def access(self, filename, size):
+		"""
+			Records that a file has just been used.
+
+			The access is only written to the database by flush().
+		"""
+		with self.lock:
+			self.pending[filename] = (size, int(time.time()))
+
+	def flush(self):
+		"""
+			Writes all recorded accesses to the database at once.
+		"""
+		with self.lock:
+			self._flush()
+
+	def _flush(self):
+		if not self.pending:
+			return
+
+		files = [(f, size, atime) for f, (size, atime) in self.pending.items()]
+		self.pending.clear()
+
+		# A cache that we may not write is still usable.
+		try:
+			self.db.executemany("INSERT OR REPLACE INTO files(filename, size, atime) \
+				VALUES(?, ?, ?)", files)
+			self.db.commit()
+
+		except (sqlite3.Error, OSError), e:
+			log.debug("Could not update the cache index: %s" % e)
+
+	def remove(self, filename):
+		with self.lock:
+			self.pending.pop(filename, None)
+
+			self.db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+			self.db.commit()
+
+	@property
+	def size(self):
+		"""
+			The size of all packages in the cache.
+		"""
+		with self.lock:
+			self._flush()
+
+			c = self.db.execute("SELECT SUM(size) FROM files")
+			size, = c.fetchone()
+
+		return size or 0
+
+	def get_lru(self):
+		"""
+			Returns (filename, size, atime) of all files, the least
+			recently used ones first.
+		"""
+		with self.lock:
+			self._flush()
+
+			c = self.db.execute("SELECT filename, size, atime FROM files \
+				ORDER BY atime ASC")
+
+			return c.fetchall()
+
+# All caches in the same directory share an index.
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(path):
+	with _indexes_lock:
+		try:
+			return _indexes[path]
+		except KeyError:
+			index = _indexes[path] = CacheIndex(path)
+			return index
+
+def flush_indexes():
+	"""
+		Writes the pending accesses of all indexes to disk.
+	"""
+	with _indexes_lock:
+		indexes = _indexes.values()
+
+	for index in indexes:
+		index.flush()
+
 class RepositoryCache(object):
 	"""
 		An object that is able to cache all data that is loaded from a
@@ -49,6 +207,10 @@ class RepositoryCache(object):
 
 		return self.__created
 
+	@property
+	def index(self):
+		return get_index(self.path)
+
 	def abspath(self, path, create=True):
 		if create:
 			self.create()
@@ -64,7 +226,13 @@ class RepositoryCache(object):
 			return
 
 		if not os.path.exists(self.path):
-			os.makedirs(self.path)
+			try:
+				os.makedirs(self.path)
+
+			# Another thread might have created it in the meantime.
+			except OSError, e:
+				if not e.errno == errno.EEXIST:
+					raise
 
 		self.__created = True
 
@@ -89,16 +257,107 @@ class RepositoryCache(object):
 
 		return (time.time() - ctime) / 60
 
+	def touch(self, filename):
+		"""
+			Resets the age of a file in the cache.
+		"""
+		os.utime(self.abspath(filename), None)
+
+	def get_validators(self, filename):
+		"""
+			Returns the ETag and Last-Modified headers that were sent
+			by the server when the file was downloaded.
+		"""
+		try:
+			with self.open("%s.validators" % filename) as f:
+				return json.load(f)
+
+		except (IOError, ValueError):
+			return {}
+
+	def set_validators(self, filename, etag=None, last_modified=None):
+		"""
+			Saves the ETag and Last-Modified headers of a downloaded
+			file, so it can be requested conditionally.
+		"""
+		validators = {}
+
+		if etag:
+			validators["etag"] = etag
+
+		if last_modified:
+			validators["last_modified"] = last_modified
+
+		if not validators:
+			self.remove("%s.validators" % filename)
+			return
+
+		with self.open("%s.validators" % filename, "w") as f:
+			json.dump(validators, f)
+
 	def open(self, filename, *args, **kwargs):
 		filename = self.abspath(filename)
 
 		# Create directory if not existant.
 		dirname = os.path.dirname(filename)
 		if not os.path.exists(dirname):
-			os.makedirs(dirname)
+			try:
+				os.makedirs(dirname)
+
+			# Another thread might have created it in the meantime.
+			except OSError, e:
+				if not e.errno == errno.EEXIST:
+					raise
 
 		return open(filename, *args, **kwargs)
 
+	def lock(self, filename, blocking=True):
+		"""
+			Locks a file in the cache, so that it is not written by several
+			threads or processes at the same time.
+		"""
+		# Make sure that the directory exists.
+		lock_filename = "%s.lock" % filename
+		self.open(lock_filename, "a").close()
+
+		return util.lock(self.abspath(lock_filename), blocking=blocking)
+
+	def link(self, filename, hash1):
+		"""
+			Searches the cache for a file with the same content as filename
+			and creates filename as a hardlink to it.
+
+			Returns True if a file was found.
+		"""
+		# All files with the same hash are stored in the same directory.
+		dirname = os.path.dirname(filename)
+
+		try:
+			names = os.listdir(self.abspath(dirname))
+		except OSError:
+			return False
+
+		for name in names:
+			if not name.endswith(".%s" % PACKAGE_EXTENSION):
+				continue
+
+			other = os.path.join(dirname, name)
+			if other == filename or not self.verify(other, hash1):
+				continue
+
+			try:
+				os.link(self.abspath(other), self.abspath(filename))
+			except OSError:
+				return False
+
+			log.debug("Linked %s to %s" % (filename, other))
+			self.set_verified(filename, hash1)
+			self.index.access(filename, os.path.getsize(self.abspath(filename)))
+
+			return True
+
+		return False
+
 	def hash1(self, filename):
 		"""
 			Return hash of the file in the cache.
@@ -108,8 +367,61 @@ class RepositoryCache(object):
 	def verify(self, filename, hash1):
 		"""
 			Return a bool that indicates if a file matches the given hash.
+
+			Files that have already been verified and have not been changed
+			since then are not read again.
 		"""
-		return self.hash1(filename) == hash1
+		if not self.get_verified(filename) == hash1:
+			if not self.hash1(filename) == hash1:
+				return False
+
+			self.set_verified(filename, hash1)
+
+		# Remember when the file has been used for the last time.
+		self.index.access(filename, os.path.getsize(self.abspath(filename)))
+
+		return True
+
+	def _stat_key(self, filename):
+		"""
+			Returns the properties of a file that change when the
+			file is modified or replaced.
+		"""
+		st = os.stat(self.abspath(filename))
+
+		return [st.st_size, st.st_mtime, st.st_ino]
+
+	def get_verified(self, filename):
+		"""
+			Returns the hash a file has been verified with, if the file
+			has not been changed since then.
+		"""
+		try:
+			with open(self.abspath("%s.verified" % filename)) as f:
+				verified = json.load(f)
+
+			if verified.get("stat") == self._stat_key(filename):
+				return verified.get("hash1")
+
+		except (IOError, OSError, ValueError):
+			pass
+
+	def set_verified(self, filename, hash1):
+		"""
+			Remembers that a file has the given hash.
+		"""
+		verified = {
+			"hash1" : hash1,
+			"stat"  : self._stat_key(filename),
+		}
+
+		try:
+			with self.open("%s.verified" % filename, "w") as f:
+				json.dump(verified, f)
+
+		# The file will be verified again the next time.
+		except (IOError, OSError):
+			pass
 
 	def remove(self, filename):
 		"""
@@ -121,9 +433,89 @@ class RepositoryCache(object):
 		filename = self.abspath(filename)
 		os.unlink(filename)
 
+		# Remove the stored headers and hashes, too.
+		for suffix in (".validators", ".verified"):
+			if os.path.exists("%s%s" % (filename, suffix)):
+				os.unlink("%s%s" % (filename, suffix))
+
+	def clean(self, max_size=None, max_age=None, keep=[]):
+		"""
+			Removes packages from the cache until it is not bigger than
+			max_size bytes and removes all packages that have not been used
+			for max_age days. The least recently used packages go first.
+
+			Files in keep are never removed.
+
+			Returns the number of bytes that have been freed.
+		"""
+		# Write when the packages have been used for the last time.
+		self.index.flush()
+
+		if max_size is None and max_age is None:
+			return 0
+
+		keep = set(keep)
+
+		# Files that were not used after this time will be removed.
+		if max_age is None:
+			min_atime = None
+		else:
+			min_atime = time.time() - max_age * 86400
+
+		size = self.index.size
+		freed = 0
+
+		for filename, filesize, atime in self.index.get_lru():
+			if filename in keep:
+				continue
+
+			too_big = max_size is not None and size - freed > max_size
+			too_old = min_atime is not None and atime < min_atime
+
+			# All remaining files have been used later than this one.
+			if not too_big and not too_old:
+				break
+
+			# Skip files that are being downloaded right now.
+			lock = self.lock(filename, blocking=False)
+			if not lock:
+				continue
+
+			log.debug("Removing %s from the cache" % filename)
+
+			try:
+				self.remove(filename)
+				os.unlink(self.abspath("%s.lock" % filename))
+
+			except OSError, e:
+				log.warning("Could not remove %s from the cache: %s" % (filename, e))
+				continue
+
+			finally:
+				lock.close()
+
+			self.index.remove(filename)
+			freed += filesize
+
+			# Remove the directories that are empty now.
+			dirname = os.path.dirname(self.abspath(filename))
+			while not dirname == self.path:
+				try:
+					os.rmdir(dirname)
+				except OSError:
+					break
+
+				dirname = os.path.dirname(dirname)
+
+		return freed
+
 	def destroy(self):
 		"""
 			Remove all files from this cache.
 		"""
 		if self.created:
 			util.rm(self.path)
+
+		# Forget about all files in the index.
+		with _indexes_lock:
+			_indexes.pop(self.path, None)
@@ -28,12 +28,32 @@ import time
 import logging
 log = logging.getLogger("pakfire")
 
+import pakfire.filelist
 import pakfire.packages as packages
 
 from pakfire.constants import *
 from pakfire.errors import *
 from pakfire.i18n import _
 
+def split_path(name):
+	"""
+		Splits a path into its directory and basename the way
+		they are stored in the files table.
+	"""
+	# This is called for every single file, so only paths
+	# that look unusual are normalised the expensive way.
+	if "//" in name or "/." in name:
+		name = os.path.normpath(name)
+
+		# normpath keeps two leading slashes.
+		if name.startswith("//"):
+			name = name[1:]
+
+	dirname, slash, basename = name.rstrip("/").rpartition("/")
+
+	return (dirname or "/", basename)
+
+
 class Database(object):
 	def __init__(self, pakfire, filename):
 		self.pakfire = pakfire
@@ -41,6 +61,9 @@ class Database(object):
 
 		self._db = None
 
+		# Indicates if changes are collected and committed at once.
+		self.batch = False
+
 	def __del__(self):
 		if self._db:
 			self._db.close()
@@ -73,6 +96,19 @@ class Database(object):
 			self._db = sqlite3.connect(self.filename)
 			self._db.row_factory = sqlite3.Row
 
+			# Use write-ahead logging, so that commits need less fsyncs.
+			# The database cannot be corrupted by a crash in this mode
+			# even when not syncing after every commit.
+			# The journal mode is stored in the database file, so it is
+			# only changed when we are allowed to write to it. Otherwise
+			# users without write access could not read it any more.
+			if self.writable:
+				try:
+					self._db.execute("PRAGMA journal_mode = WAL")
+					self._db.execute("PRAGMA synchronous = NORMAL")
+				except sqlite3.OperationalError, e:
+					log.debug("Could not enable write-ahead logging: %s" % e)
+
 			# In the case, the database was not existant, it is
 			# filled with content. In case it has been there
 			# we call the migrate method to update it if neccessary.
@@ -86,9 +122,94 @@ class Database(object):
 			self._db.close()
 			self._db = None
 
+	@property
+	def writable(self):
+		"""
+			Tells if the database file may be written.
+		"""
+		if os.path.exists(self.filename):
+			return os.access(self.filename, os.W_OK) \
+				and os.access(os.path.dirname(self.filename), os.W_OK)
+
+		return os.access(os.path.dirname(self.filename), os.W_OK)
+
+	def begin(self):
+		"""
+			Starts a batch of changes that are written to disk in one
+			transaction when commit() is called.
+		"""
+		self.open()
+
+		# Write everything that is still pending before.
+		self._db.commit()
+
+		# The sqlite3 module commits on its own before some statements
+		# (i.e. SAVEPOINT), so the transaction is controlled by hand
+		# until it is committed or rolled back.
+		self._db.isolation_level = None
+		self._db.execute("BEGIN IMMEDIATE")
+
+		self.batch = True
+
 	def commit(self):
 		if self._db:
-			self._db.commit()
+			if self.batch:
+				self._db.execute("COMMIT")
+				self._db.isolation_level = ""
+			else:
+				self._db.commit()
+
+		self.batch = False
+
+	def rollback(self):
+		"""
+			Discards all changes since the last commit.
+		"""
+		if self._db:
+			if self.batch:
+				self._db.execute("ROLLBACK")
+				self._db.isolation_level = ""
+			else:
+				self._db.rollback()
+
+		self.batch = False
+
+	def savepoint(self, name):
+		"""
+			Marks the current state of a batch, so that all following
+			changes can be discarded with rollback_to().
+		"""
+		assert self.batch
+
+		self._db.execute("SAVEPOINT %s" % name)
+
+	def release(self, name):
+		"""
+			Keeps all changes since the savepoint was set.
+		"""
+		assert self.batch
+
+		self._db.execute("RELEASE SAVEPOINT %s" % name)
+
+	def rollback_to(self, name):
+		"""
+			Discards all changes since the savepoint was set.
+		"""
+		assert self.batch
+
+		self._db.execute("ROLLBACK TO SAVEPOINT %s" % name)
+		self._db.execute("RELEASE SAVEPOINT %s" % name)
+
+	def checkpoint(self):
+		"""
+			Writes all changes from the write-ahead log to the database file
+			and empties the log.
+		"""
+		if self._db:
+			try:
+				self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+			except sqlite3.OperationalError, e:
+				log.debug("Could not checkpoint the database: %s" % e)
 
 	def cursor(self):
 		self.open()
@@ -109,6 +230,9 @@ class DatabaseLocal(Database):
 		# Cache format number.
 		self.__format = None
 
+		# Cache the IDs of all known directory names.
+		self.__dirnames = {}
+
 		Database.__init__(self, pakfire, filename)
 
 	def initialize(self):
@@ -130,6 +254,45 @@ class DatabaseLocal(Database):
 
 		return count
 
+	@property
+	def generation(self):
+		"""
+			A counter that is incremented every time a package is
+			added to or removed from the database.
+		"""
+		generation = 0
+
+		c = self.cursor()
+		c.execute("SELECT val FROM settings WHERE key = 'generation' LIMIT 1")
+		for row in c:
+			try:
+				generation = int(row["val"])
+			except ValueError:
+				pass
+
+		c.close()
+
+		return generation
+
+	def bump_generation(self, c):
+		c.execute("UPDATE settings SET val = val + 1 WHERE key = 'generation'")
+
+		# Databases that have been created by older versions of pakfire
+		# do not have a generation counter, yet.
+		if not c.rowcount:
+			c.execute("INSERT INTO settings(key, val) VALUES('generation', '1')")
+
+	def get_uuids(self):
+		"""
+			Returns a set with the UUIDs of all installed packages.
+		"""
+		c = self.db.execute("SELECT uuid FROM packages")
+
+		try:
+			return set((row["uuid"] for row in c))
+		finally:
+			c.close()
+
 	@property
 	def format(self):
 		if self.__format is None:
@@ -155,10 +318,18 @@ class DatabaseLocal(Database):
 				val			TEXT
 			);
 			INSERT INTO settings(key, val) VALUES('version', '%s');
+			INSERT INTO settings(key, val) VALUES('generation', '0');
+
+			CREATE TABLE dirnames(
+				id		INTEGER PRIMARY KEY,
+				name		TEXT UNIQUE
+			);
 
 			CREATE TABLE files(
 				id		INTEGER PRIMARY KEY,
 				name		TEXT,
+				dirname		INTEGER,
+				basename	TEXT,
 				pkg		INTEGER,
 				size		INTEGER,
 				type		INTEGER,
@@ -172,6 +343,7 @@ class DatabaseLocal(Database):
 				capabilities	TEXT
 			);
 			CREATE INDEX files_pkg_index ON files(pkg);
+			CREATE INDEX files_path_index ON files(basename, dirname);
 
 			CREATE TABLE packages(
 				id		INTEGER PRIMARY KEY,
@@ -324,6 +496,29 @@ class DatabaseLocal(Database):
 				CREATE INDEX packages_name_index ON packages(name);
 			""")
 
+		if self.format < 8:
+			c.executescript("""
+				CREATE TABLE dirnames(id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+
+				ALTER TABLE files ADD COLUMN dirname INTEGER;
+				ALTER TABLE files ADD COLUMN basename TEXT;
+			""")
+
+			c.execute("SELECT id, name FROM files")
+			files = c.fetchall()
+
+			dirnames = self.get_dirname_ids(c, (split_path(f["name"])[0] for f in files))
+
+			rows = []
+			for f in files:
+				dirname, basename = split_path(f["name"])
+
+				rows.append((dirnames[dirname], basename, f["id"]))
+
+			c.executemany("UPDATE files SET dirname = ?, basename = ? WHERE id = ?", rows)
+
+			c.execute("CREATE INDEX files_path_index ON files(basename, dirname)")
+
 		# In the end, we can easily update the version of the database.
 		c.execute("UPDATE settings SET val = ? WHERE key = 'version'", (DATABASE_FORMAT,))
 		self.__format = DATABASE_FORMAT
@@ -402,9 +597,13 @@ class DatabaseLocal(Database):
 			for type, deps in dependencies:
 				c.executemany("INSERT INTO dependencies(pkg, type, dependency) VALUES(?, ?, ?)", ((pkg_id, type, d) for d in deps))
 
-			c.executemany("INSERT INTO files(`name`, `pkg`, `size`, `config`, `datafile`, `type`, `hash1`, `mode`, `user`, `group`, `mtime`, `capabilities`)"
-					" VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-				((f.name, pkg_id, f.size, f.is_config(), f.is_datafile(), f.type, f.hash1, f.mode, f.user, f.group, f.mtime, f.capabilities or "") for f in pkg.filelist))
+			# Add all files.
+			files = [(f, split_path(f.name)) for f in pkg.filelist]
+			dirnames = self.get_dirname_ids(c, (d for f, (d, b) in files))
+
+			c.executemany("INSERT INTO files(`name`, `dirname`, `basename`, `pkg`, `size`, `config`, `datafile`, `type`, `hash1`, `mode`, `user`, `group`, `mtime`, `capabilities`)"
+					" VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				((f.name, dirnames[d], b, pkg_id, f.size, f.is_config(), f.is_datafile(), f.type, f.hash1, f.mode, f.user, f.group, f.mtime, f.capabilities or "") for f, (d, b) in files))
 
 			# Add scriptlets
 			for scriptlet_action in SCRIPTS:
@@ -417,11 +616,14 @@ class DatabaseLocal(Database):
 				c.execute("INSERT INTO scriptlets(pkg, action, scriptlet) VALUES(?, ?, ?)",
 					(pkg_id, scriptlet_action, scriptlet))
 
+			self.bump_generation(c)
+
 		except:
 			raise
 
 		else:
-			self.commit()
+			if not self.batch:
+				self.commit()
 
 		c.close()
 
@@ -434,10 +636,13 @@ class DatabaseLocal(Database):
 		c = self.cursor()
 		c.execute("DELETE FROM files WHERE pkg = ?", (pkg.id,))
 		c.execute("DELETE FROM scriptlets WHERE pkg = ?", (pkg.id,))
+		c.execute("DELETE FROM dependencies WHERE pkg = ?", (pkg.id,))
 		c.execute("DELETE FROM packages WHERE id = ?", (pkg.id,))
+		self.bump_generation(c)
 		c.close()
 
-		self.commit()
+		if not self.batch:
+			self.commit()
 
 	def get_package_by_id(self, id):
 		c = self.cursor()
@@ -475,6 +680,182 @@ class DatabaseLocal(Database):
 
 		return [r["name"] for r in c.fetchall()]
 
+	def get_dependencies(self, pkgs=None):
+		"""
+			Returns a dictionary that maps package IDs to the
+			dependencies of the package (sorted by type).
+
+			If no packages are given, the dependencies of all
+			packages are read in one scan over the table.
+		"""
+		ret = {}
+
+		c = self.cursor()
+		c.row_factory = None
+
+		if pkgs is None:
+			c.execute("SELECT pkg, type, dependency FROM dependencies ORDER BY rowid")
+		else:
+			ids = [pkg.id for pkg in pkgs]
+
+			for id in ids:
+				ret[id] = {}
+
+			c.execute("SELECT pkg, type, dependency FROM dependencies \
+				WHERE pkg IN (%s) ORDER BY rowid" % ", ".join("?" * len(ids)), ids)
+
+		for pkg_id, type, dependency in c:
+			try:
+				deps = ret[pkg_id]
+			except KeyError:
+				deps = ret[pkg_id] = {}
+
+			try:
+				deps[type].append(dependency)
+			except KeyError:
+				deps[type] = [dependency,]
+
+		c.close()
+
+		return ret
+
+	def vacuum(self):
+		"""
+			Removes all data that does not belong to any package
+			anymore and compacts the database file.
+		"""
+		c = self.cursor()
+
+		for table in ("files", "scriptlets", "dependencies"):
+			c.execute("DELETE FROM %s WHERE pkg NOT IN (SELECT id FROM packages)" % table)
+
+			if c.rowcount > 0:
+				log.debug("Removed %s orphaned row(s) from %s" % (c.rowcount, table))
+
+		c.execute("DELETE FROM dirnames WHERE id NOT IN \
+			(SELECT DISTINCT dirname FROM files WHERE dirname IS NOT NULL)")
+		c.close()
+
+		self.commit()
+
+		# Forget about the removed directory names.
+		self.__dirnames.clear()
+
+		# VACUUM cannot run inside a transaction.
+		self._db.execute("VACUUM")
+		self.checkpoint()
+
+	def get_filelists(self, pkgs):
+		"""
+			Loads the filelists of all given packages with one query
+			and returns a dictionary that maps package IDs to them.
+		"""
+		pkgs = dict(((pkg.id, pkg) for pkg in pkgs))
+		ret = dict(((id, []) for id in pkgs))
+
+		ids = pkgs.keys()
+
+		# Fetch plain tuples which is a lot faster than sqlite3.Row.
+		c = self.cursor()
+		c.row_factory = None
+
+		# SQLite limits the number of variables in a statement.
+		while ids:
+			chunk, ids = ids[:500], ids[500:]
+
+			c.execute("SELECT pkg, name, size, type, config, datafile, mode, user, `group`, \
+				hash1, mtime, capabilities FROM files WHERE pkg IN (%s) ORDER BY pkg, id" \
+				% ", ".join("?" * len(chunk)), chunk)
+
+			for row in c:
+				pkg_id = row[0]
+
+				ret[pkg_id].append(
+					pakfire.filelist.FileDatabase(self.pakfire, pkgs[pkg_id], *row[1:])
+				)
+
+		c.close()
+
+		return ret
+
+	def get_dirname_ids(self, c, dirnames):
+		"""
+			Returns a dictionary that maps the given directory names
+			to their IDs. Unknown directories are added.
+		"""
+		ret = {}
+
+		for dirname in dirnames:
+			if ret.has_key(dirname):
+				continue
+
+			try:
+				ret[dirname] = self.__dirnames[dirname]
+				continue
+			except KeyError:
+				pass
+
+			c.execute("INSERT OR IGNORE INTO dirnames(name) VALUES(?)", (dirname,))
+			c.execute("SELECT id FROM dirnames WHERE name = ?", (dirname,))
+
+			ret[dirname] = self.__dirnames[dirname] = c.fetchone()[0]
+
+		return ret
+
+	def rollback(self):
+		Database.rollback(self)
+
+		# Directories might have been added in the rolled back transaction.
+		self.__dirnames.clear()
+
+	def rollback_to(self, name):
+		Database.rollback_to(self, name)
+
+		# Directories might have been added after the savepoint.
+		self.__dirnames.clear()
+
+	def get_file_owners(self, name, exclude=None):
+		"""
+			Returns the IDs of all packages that own the given path,
+			except the package with the ID exclude.
+		"""
+		dirname, basename = split_path(name)
+
+		c = self.cursor()
+		c.execute("SELECT DISTINCT files.pkg FROM files \
+			JOIN dirnames ON files.dirname = dirnames.id \
+			WHERE files.basename = ? AND dirnames.name = ? AND files.pkg != ?",
+			(basename, dirname, exclude or 0))
+
+		try:
+			return [row["pkg"] for row in c]
+		finally:
+			c.close()
+
+	def is_file_owned(self, name, exclude=None):
+		"""
+			Returns True if the given path is owned by any package
+			other than the package with the ID exclude.
+		"""
+		dirname, basename = split_path(name)
+
+		c = self.cursor()
+		c.execute("SELECT 1 FROM files \
+			JOIN dirnames ON files.dirname = dirnames.id \
+			WHERE files.basename = ? AND dirnames.name = ? AND files.pkg != ? LIMIT 1",
+			(basename, dirname, exclude or 0))
+
+		try:
+			return c.fetchone() is not None
+		finally:
+			c.close()
+
+	def get_packages_by_file(self, name):
+		"""
+			Returns all packages that own the given path.
+		"""
+		return [self.get_package_by_id(id) for id in self.get_file_owners(name)]
+
 	def get_package_from_solv(self, solv_pkg):
 		assert solv_pkg.uuid
 
@@ -26,6 +26,52 @@ log = logging.getLogger("pakfire")
 
 import pakfire.packages as packages
 import pakfire.satsolver as satsolver
+import pakfire.util as util
+
+class PackageData(object):
+	"""
+		Holds everything that is needed to add a package to an index,
+		so that it can be passed between processes.
+	"""
+	ATTRIBUTES = ("name", "friendly_version", "arch", "uuid", "hash1", "vendor",
+		"maintainer", "groups", "summary", "description", "license", "url",
+		"build_host", "build_time", "filename", "size", "inst_size")
+
+	DEPENDENCIES = ("requires", "prerequires", "provides", "conflicts",
+		"obsoletes", "recommends", "suggests")
+
+	def __init__(self, pkg):
+		for attr in self.ATTRIBUTES:
+			setattr(self, attr, getattr(pkg, attr))
+
+		for attr in self.DEPENDENCIES:
+			setattr(self, attr, list(getattr(pkg, attr) or []))
+
+		self.filelist = [f.name for f in pkg.filelist]
+
+	def __repr__(self):
+		return "<%s %s-%s.%s>" % (self.__class__.__name__, self.name,
+			self.friendly_version, self.arch)
+
+def read_package(filename, hash1=None):
+	"""
+		Opens the package file and returns a PackageData object.
+
+		If hash1 is given and the file still has this hash, the package
+		has not changed and None is returned.
+
+		This is a function of its own, so that it can be run in
+		another process.
+	"""
+	if hash1 and util.calc_hash1(filename) == hash1:
+		return
+
+	pkg = packages.open(None, None, filename)
+
+	return PackageData(pkg)
+
+def _read_package(args):
+	return read_package(*args)
 
 class Index(object):
 	"""
@@ -57,6 +103,13 @@ class Index(object):
 		"""
 		self.solver_repo.write(filename)
 
+	@property
+	def size(self):
+		"""
+			The number of packages in the index.
+		"""
+		return self.solver_repo.size()
+
 	def optimize(self):
 		"""
 			Optimize the index.
@@ -115,7 +168,7 @@ class Index(object):
 		solvable.set_installsize(pkg.inst_size)
 
 		# Import all requires.
-		requires = pkg.requires
+		requires = list(pkg.requires)
 		prerequires = pkg.prerequires
 		if prerequires:
 			requires.append("solvable:prereqmarker")
@@ -157,6 +210,38 @@ class Index(object):
 			rel = self.pakfire.pool.create_relation(sugg)
 			solvable.add_suggests(rel)
 
+	def rem_package(self, pkg):
+		"""
+			Removes the given package from the index.
+		"""
+		self.rem_packages([pkg.uuid])
+
+	def rem_packages(self, uuids):
+		"""
+			Removes the packages with the given UUIDs from the index.
+
+			A package that is reinstalled is in the index twice for a
+			short time, so only one solvable is removed for every time
+			an UUID is passed.
+		"""
+		counts = {}
+		for uuid in uuids:
+			counts[uuid] = counts.get(uuid, 0) + 1
+
+		if not counts:
+			return
+
+		for solvable in self.solver_repo.get_all():
+			uuid = solvable.get_uuid()
+
+			if not counts.get(uuid):
+				continue
+
+			log.debug("Removing package from index %s: %s" % (self, solvable))
+			self.solver_repo.rem_solvable(solvable)
+
+			counts[uuid] -= 1
+
 	def clear(self):
 		"""
 			Forget all packages from memory.
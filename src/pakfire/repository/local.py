@@ -19,6 +19,9 @@
 #                                                                             #
 ###############################################################################
 
+import itertools
+import json
+import multiprocessing
 import os
 import shutil
 import tempfile
@@ -28,9 +31,11 @@ import logging
 log = logging.getLogger("pakfire")
 
 import base
+import index
 import metadata
 
 import pakfire.compress as compress
+import pakfire.delta as delta
 import pakfire.downloader as downloader
 import pakfire.packages as packages
 import pakfire.util as util
@@ -48,6 +53,13 @@ class RepositoryDir(base.RepositoryFactory):
 		# The key that is used to sign all added packages.
 		self.key_id = key_id
 
+		# The size, mtime, inode and hash1 of all packages in the index.
+		self.manifest = {}
+
+		# Tells if the index differs from the one that has been saved
+		# to the repository.
+		self.changed = True
+
 	def remove(self):
 		self.index.clear()
 		util.rm(self.path)
@@ -119,38 +131,197 @@ class RepositoryDir(base.RepositoryFactory):
 		if not files:
 			return
 
-		# Create progress bar.
-		pb = util.make_progress(_("%s: Adding packages...") % self.name, len(files))
-		i = 0
+		# Load the index that has been saved the last time, so that packages
+		# that did not change do not need to be read again.
+		solvables = {}
+		if not self.index.size:
+			solvables = self.read_index()
 
+		# Copy all packages into the repository and find out which
+		# ones need to be read.
+		jobs = []
 		for file in files:
-			if pb:
-				i += 1
-				pb.update(i)
+			filename = self.import_package(file)
+			basename = os.path.basename(filename)
 
-			# Add the package to the repository.
-			self.add_package(file, optimize_index=False)
+			hash1 = None
+
+			solvable = solvables.pop(basename, None)
+			if solvable:
+				entry = self.manifest.get(basename, {})
+
+				# The file has not been touched since the index was saved.
+				if entry.get("stat") == self._stat_key(filename):
+					continue
+
+				# Otherwise, check if the content is still the same.
+				hash1 = solvable.get_hash1()
+
+			jobs.append((filename, hash1, solvable))
+
+		# Remove all packages that are not part of the repository any more.
+		for basename, solvable in solvables.items():
+			self.index.solver_repo.rem_solvable(solvable)
+			self.manifest.pop(basename, None)
+
+			self.changed = True
+
+		log.debug("%s: Reusing %s packages, reading %s packages" % \
+			(self.name, len(files) - len(jobs), len(jobs)))
+
+		# Create progress bar.
+		pb = util.make_progress(_("%s: Adding packages...") % self.name, len(jobs))
+
+		# Opening the packages takes the most time, so that is done for
+		# several packages at the same time in other processes. They are
+		# added to the index here.
+		processes = min(multiprocessing.cpu_count(), len(jobs))
+
+		args = [(filename, hash1) for filename, hash1, solvable in jobs]
+		if processes > 1:
+			pool = multiprocessing.Pool(processes)
+			results = pool.imap(index._read_package, args, chunksize=4)
+		else:
+			pool = None
+			results = (index._read_package(a) for a in args)
+
+		try:
+			i = 0
+			for (filename, hash1, solvable), pkg in itertools.izip(jobs, results):
+				if pb:
+					i += 1
+					pb.update(i)
+
+				# The package did not change.
+				if pkg is None:
+					self.add_to_manifest(filename, hash1)
+					continue
+
+				# Replace the old version of the package.
+				if solvable:
+					self.index.solver_repo.rem_solvable(solvable)
+
+				self.index.add_package(pkg)
+				self.add_to_manifest(filename, pkg.hash1)
+
+				self.changed = True
+
+			if pool:
+				pool.close()
+
+		finally:
+			if pool:
+				pool.terminate()
+				pool.join()
+
+			if pb:
+				pb.finish()
 
 		# Optimize the index.
 		self.optimize_index()
 
-		if pb:
-			pb.finish()
+	def read_index(self):
+		"""
+			Reads the index that has been saved to the repository before,
+			together with the manifest of all packages in it.
 
-		# Optimize the index.
-		self.index.optimize()
+			Returns a dictionary that maps the filenames to the solvables.
+		"""
+		metapath = os.path.join(self.path, METADATA_DOWNLOAD_PATH)
+		md_path = os.path.join(metapath, METADATA_DOWNLOAD_FILE)
 
-	def add_package(self, filename, optimize_index=True, check_uuids=False):
+		if not os.path.exists(md_path):
+			return {}
+
+		md = metadata.Metadata(self.pakfire, md_path)
+
+		db_path = os.path.join(metapath, md.database)
+		if not os.path.exists(db_path):
+			return {}
+
+		# Decompress the database to a temporary file.
+		f = open(db_path)
+		tmp = tempfile.NamedTemporaryFile(mode="wb", delete=False)
+		try:
+			algo = compress.guess_algo(fileobj=f)
+			if algo:
+				f = compress.decompressobj(fileobj=f, algo=algo)
+
+			while True:
+				buf = f.read(BUFFER_SIZE)
+				if not buf:
+					break
+
+				tmp.write(buf)
+
+			tmp.close()
+
+			self.index.read(tmp.name)
+
+		finally:
+			f.close()
+			os.unlink(tmp.name)
+
+		# Without a manifest, the hashes of all packages will be compared.
+		try:
+			with open(os.path.join(metapath, METADATA_MANIFEST_FILE)) as f:
+				self.manifest = json.load(f)
+
+		except (IOError, ValueError):
+			self.manifest = {}
+
+		# The index is the same as the saved one for now.
+		self.changed = False
+
+		solvables = {}
+		for solvable in self.index.solver_repo.get_all():
+			solvables[solvable.get_filename()] = solvable
+
+		return solvables
+
+	def _stat_key(self, filename):
+		"""
+			Returns the properties of a file that change when the
+			file is modified or replaced.
+		"""
+		st = os.stat(filename)
+
+		return [st.st_size, st.st_mtime, st.st_ino]
+
+	def add_to_manifest(self, filename, hash1):
+		"""
+			Remembers that the package in filename has been indexed.
+		"""
+		basename = os.path.basename(filename)
+
+		entry = {
+			"stat"  : self._stat_key(filename),
+			"hash1" : hash1,
+		}
+
+		self.manifest[basename] = entry
+
+	def save_manifest(self, path):
+		"""
+			Writes the manifest to path.
+		"""
+		with open(path, "w") as f:
+			json.dump(self.manifest, f)
+
+	def import_package(self, filename, check_uuids=False):
+		"""
+			Copies the package file into the repository (if needed)
+			and returns the new filename.
+		"""
 		repo_filename = os.path.join(self.path, os.path.basename(filename))
 
 		# Check if the package needs to be copied.
 		needs_copy = True
 
 		if os.path.exists(repo_filename):
-			pkg2 = packages.open(self.pakfire, self, repo_filename)
-
 			if check_uuids:
 				pkg1 = packages.open(self.pakfire, None, filename)
+				pkg2 = packages.open(self.pakfire, self, repo_filename)
 
 				# Package file does already exist, but the UUID don't match.
 				# Copy the package file and then re-open it.
@@ -170,15 +341,22 @@ class RepositoryDir(base.RepositoryFactory):
 			except OSError:
 				shutil.copy2(filename, repo_filename)
 
-			# Re-open the package.
-			pkg2 = packages.open(self.pakfire, self, repo_filename)
-
 			# The package needs to be signed.
 			if self.key_id:
+				pkg2 = packages.open(self.pakfire, self, repo_filename)
 				pkg2.sign(self.key_id)
 
+		return repo_filename
+
+	def add_package(self, filename, optimize_index=True, check_uuids=False):
+		repo_filename = self.import_package(filename, check_uuids=check_uuids)
+
 		# Add package to the index.
-		self.index.add_package(pkg2)
+		pkg = packages.open(self.pakfire, self, repo_filename)
+		self.index.add_package(pkg)
+		self.add_to_manifest(repo_filename, pkg.hash1)
+
+		self.changed = True
 
 		if optimize_index:
 			self.optimize_index()
@@ -189,10 +367,13 @@ class RepositoryDir(base.RepositoryFactory):
 		"""
 		self.index.optimize()
 
-	def save(self, path=None, algo="xz"):
+	def save(self, path=None, algo="xz", deltas=0):
 		"""
 			This function saves the database and metadata to path so it can
 			be exported to a remote repository.
+
+			If deltas is greater than zero, the last databases are kept and
+			deltas from them to the new one are created.
 		"""
 		if not path:
 			path = self.path
@@ -201,13 +382,38 @@ class RepositoryDir(base.RepositoryFactory):
 		metapath = os.path.join(path, METADATA_DOWNLOAD_PATH)
 		db_path = os.path.join(metapath, METADATA_DATABASE_FILE)
 		md_path = os.path.join(metapath, METADATA_DOWNLOAD_FILE)
+		manifest_path = os.path.join(metapath, METADATA_MANIFEST_FILE)
+
+		# If no package has been added or removed since the index has been
+		# read, the database does not need to be written and compressed again.
+		if not self.changed and path == self.path and os.path.exists(md_path):
+			log.debug("Index of %s has not changed" % self.name)
+
+			self.save_manifest(manifest_path)
+			return
+
+		# Find the previous databases that deltas are created from.
+		history = []
+		if deltas and os.path.exists(md_path):
+			old_md = metadata.Metadata(self.pakfire, md_path)
+
+			if old_md.database:
+				history = [old_md.database] + old_md.database_history
+
+			history = [h for h in history[:deltas] \
+				if os.path.exists(os.path.join(metapath, h))]
 
 		# Remove all pre-existing metadata.
 		if os.path.exists(metapath):
-			util.rm(metapath)
+			for file in os.listdir(metapath):
+				if file in history:
+					continue
+
+				util.rm(os.path.join(metapath, file))
 
 		# Create directory for metdadata.
-		os.makedirs(metapath)
+		else:
+			os.makedirs(metapath)
 
 		# Save the database to path and get the filename.
 		self.index.write(db_path)
@@ -219,6 +425,13 @@ class RepositoryDir(base.RepositoryFactory):
 		db_path2 = os.path.join(os.path.dirname(db_path),
 			"%s-%s" % (db_hash, os.path.basename(db_path)))
 
+		# The database has not changed.
+		if os.path.basename(db_path2) in history:
+			history.remove(os.path.basename(db_path2))
+
+		# Create deltas from all previous databases.
+		db_deltas = self.save_deltas(db_path, db_hash, history, algo=algo)
+
 		# Compress the database.
 		if algo:
 			# Open input file and get filesize of input file.
@@ -265,10 +478,66 @@ class RepositoryDir(base.RepositoryFactory):
 		md.database = os.path.basename(db_path2)
 		md.database_hash1 = db_hash
 		md.database_compression = algo
+		md.database_deltas = db_deltas
+		md.database_history = history
 
 		# Save metdata to repository.
 		md.save(md_path)
 
+		# Save the manifest for the next update.
+		self.save_manifest(manifest_path)
+
+		if path == self.path:
+			self.changed = False
+
+	def save_deltas(self, db_path, db_hash, history, algo="xz"):
+		"""
+			Creates deltas from all databases in history to the database
+			in db_path and returns a dictionary that maps the hashes of the
+			old databases to the filenames of the deltas.
+		"""
+		ret = {}
+
+		if not history:
+			return ret
+
+		metapath = os.path.dirname(db_path)
+
+		with open(db_path) as f:
+			new = f.read()
+
+		for filename in history:
+			# The hash is part of the filename of every database.
+			old_hash = filename.split("-", 1)[0]
+
+			f = open(os.path.join(metapath, filename))
+			try:
+				old_algo = compress.guess_algo(fileobj=f)
+				if old_algo:
+					f = compress.decompressobj(fileobj=f, algo=old_algo)
+
+				old = f.read()
+			finally:
+				f.close()
+
+			log.debug("Creating delta from %s to %s" % (old_hash, db_hash))
+
+			delta_path = os.path.join(metapath, "%s-%s.delta" % (old_hash, db_hash))
+
+			if algo:
+				f = compress.compressobj(delta_path, algo=algo)
+			else:
+				f = open(delta_path, "w")
+
+			try:
+				f.write(delta.create(old, new))
+			finally:
+				f.close()
+
+			ret[old_hash] = os.path.basename(delta_path)
+
+		return ret
+
 
 class RepositoryBuild(RepositoryDir):
 	def __init__(self, pakfire):
@@ -123,3 +123,28 @@ class Metadata(object):
 
 	database_compression = property(get_database_compression,
 		set_database_compression)
+
+	def get_database_deltas(self):
+		"""
+			Returns a dictionary that maps the hashes of previous
+			databases to the filename of the delta that transforms
+			them into the current one.
+		"""
+		return self._data.get("database_deltas", {})
+
+	def set_database_deltas(self, val):
+		self._data["database_deltas"] = val
+
+	database_deltas = property(get_database_deltas, set_database_deltas)
+
+	def get_database_history(self):
+		"""
+			Returns the filenames of the previous databases that are
+			kept to create deltas from (most recent first).
+		"""
+		return self._data.get("database_history", [])
+
+	def set_database_history(self, val):
+		self._data["database_history"] = val
+
+	database_history = property(get_database_history, set_database_history)
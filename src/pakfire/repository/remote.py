@@ -19,7 +19,9 @@
 #                                                                             #
 ###############################################################################
 
+import hashlib
 import os
+import time
 import urlgrabber
 
 import logging
@@ -30,14 +32,14 @@ import cache
 import metadata
 
 import pakfire.compress as compress
+import pakfire.delta as delta
 import pakfire.downloader as downloader
+import pakfire.util as util
 
 from pakfire.constants import *
 from pakfire.i18n import _
 
 class RepositoryRemote(base.RepositoryFactory):
-	# XXX TODO Make metadata age configureable.
-
 	def __init__(self, pakfire, name, description=None, **settings):
 		# Save the settings that come from the configuration file.
 		self.settings = settings
@@ -61,6 +63,9 @@ class RepositoryRemote(base.RepositoryFactory):
 		# Open metadata if any.
 		self.metadata = self.open_metadata()
 
+		# Time it took to update metadata and database.
+		self.update_times = None
+
 	@property
 	def baseurl(self):
 		return self.settings.get("baseurl")
@@ -73,6 +78,23 @@ class RepositoryRemote(base.RepositoryFactory):
 
 		return keyfile
 
+	@property
+	def metadata_expire(self):
+		"""
+			Returns the time (in minutes) after that the metadata is
+			checked for updates again.
+		"""
+		metadata_expire = self.settings.get("metadata_expire", None)
+		if not metadata_expire is None:
+			try:
+				return int(metadata_expire)
+
+			except ValueError:
+				log.error("Configuration value for metadata_expire of %s is invalid." \
+					% self.name)
+
+		return TIME_10M
+
 	@property
 	def priority(self):
 		priority = self.settings.get("priority", None)
@@ -117,18 +139,48 @@ class RepositoryRemote(base.RepositoryFactory):
 		# Remove all files in the files cache.
 		self.cache.destroy()
 
-	def open(self):
+	def update(self, progress_obj=None):
+		"""
+			Downloads the metadata and the package database if necessary.
+
+			This does not access the pool and can run in a separate thread.
+		"""
+		t_start = time.time()
+
 		# First update the repository metadata.
 		self.update_metadata()
-		self.update_database()
+		t_metadata = time.time()
+
+		self.update_database(progress_obj=progress_obj)
+		t_database = time.time()
+
+		# Save the timings for the debug output.
+		self.update_times = (t_metadata - t_start, t_database - t_metadata)
+
+	def open(self):
+		# Download everything that is needed, if that has not
+		# already been done.
+		if self.update_times is None:
+			self.update()
 
 		# Read the database.
+		t_start = time.time()
 		self.open_database()
+		t_end = time.time()
+
+		t_metadata, t_database = self.update_times
+		self.update_times = None
+
+		log.debug("Opened repository %s (metadata: %.3fs, database: %.3fs, loading: %.3fs)" \
+			% (self.name, t_metadata, t_database, t_end - t_start))
 
 		# Mark the repository as open.
 		self.opened = True
 
 	def close(self):
+		# Save how the mirrors performed.
+		self.mirrors.close()
+
 		# Mark the repository as not open.
 		self.opened = False
 
@@ -157,7 +209,7 @@ class RepositoryRemote(base.RepositoryFactory):
 
 		if not force and exists:
 			age = self.cache.age(cache_filename)
-			if age and age < TIME_10M:
+			if age is not None and age < self.metadata_expire:
 				log.debug("Metadata is recent enough. I don't download it again.")
 				return
 
@@ -165,12 +217,34 @@ class RepositoryRemote(base.RepositoryFactory):
 		log.debug("Going to download repository metadata for %s..." % self.name)
 		assert not offline
 
+		# Ask the server to send the metadata only if it has been changed
+		# since we downloaded it.
+		http_headers = [("Pragma", "no-cache"),]
+
+		if exists and not force:
+			validators = self.cache.get_validators(cache_filename)
+
+			if validators.has_key("etag"):
+				http_headers.append(("If-None-Match", str(validators["etag"])))
+
+			if validators.has_key("last_modified"):
+				http_headers.append(("If-Modified-Since", str(validators["last_modified"])))
+
 		grabber = downloader.MetadataDownloader(self.pakfire)
 		grabber = self.mirrors.group(grabber)
 
 		while True:
 			try:
-				data = grabber.urlread(filename, limit=METADATA_DOWNLOAD_LIMIT)
+				fileobj = grabber.urlopen(filename, http_headers=tuple(http_headers))
+
+				try:
+					data = fileobj.read(METADATA_DOWNLOAD_LIMIT + 1)
+				finally:
+					fileobj.close()
+
+				if len(data) > METADATA_DOWNLOAD_LIMIT:
+					raise urlgrabber.grabber.URLGrabError(8, _("Metadata exceeds the size limit."))
+
 			except urlgrabber.grabber.URLGrabError, e:
 				if e.errno == 256:
 					raise DownloadError, _("Could not update metadata for %s from any mirror server") % self.name
@@ -178,6 +252,13 @@ class RepositoryRemote(base.RepositoryFactory):
 				grabber.increment_mirror(grabber)
 				continue
 
+			# The metadata has not been changed.
+			if getattr(fileobj, "http_code", None) == 304:
+				log.debug("Metadata of %s has not been modified." % self.name)
+
+				self.cache.touch(cache_filename)
+				return
+
 			# Parse new metadata for comparison.
 			md = metadata.Metadata(self.pakfire, metadata=data)
 
@@ -192,6 +273,15 @@ class RepositoryRemote(base.RepositoryFactory):
 			f.write(data)
 			f.close()
 
+			# Save the headers that are needed to validate the metadata
+			# the next time.
+			headers = getattr(fileobj, "hdr", None)
+			if headers:
+				self.cache.set_validators(cache_filename,
+					etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+			else:
+				self.cache.set_validators(cache_filename)
+
 			break
 
 		# Re-open metadata.
@@ -209,13 +299,18 @@ class RepositoryRemote(base.RepositoryFactory):
 		self.index.clear()
 		self.index.read(filename)
 
-	def update_database(self, force=False, offline=False):
+	def update_database(self, force=False, offline=False, progress_obj=None):
 		assert self.metadata, "Metadata needs to be openend first."
 
 		# Construct cache and download filename.
 		filename = os.path.join(METADATA_DOWNLOAD_PATH, self.metadata.database)
 		cache_filename = self.cache_path("database", self.metadata.database)
 
+		# The database is stored decompressed in the cache, so that it can
+		# be read directly by the solver. Databases are named after their
+		# checksum and are only moved into place after the checksum has
+		# been verified, so an existing file is always complete and can
+		# be used without downloading and decompressing it again.
 		if not force:
 			force = not self.cache.exists(cache_filename)
 
@@ -233,10 +328,18 @@ class RepositoryRemote(base.RepositoryFactory):
 		grabber = downloader.DatabaseDownloader(
 			self.pakfire,
 			text = _("%s: package database") % self.name,
+			progress_obj = progress_obj,
 		)
 		grabber = self.mirrors.group(grabber)
 
-		while True:
+		# Temporary file the database is decompressed to.
+		tmp_filename = "%s.tmp" % cache_filename
+
+		# Try to update an older database in the cache with a delta
+		# and download the whole database if that is not possible.
+		downloaded = self.update_database_delta(grabber, tmp_filename)
+
+		while not downloaded:
 			# Open file on server.
 			urlobj = fileobj = grabber.urlopen(filename)
 
@@ -245,13 +348,18 @@ class RepositoryRemote(base.RepositoryFactory):
 					algo=self.metadata.database_compression)
 
 			# Make a new file in the cache.
-			cacheobj = self.cache.open(cache_filename, "wb")
+			cacheobj = self.cache.open(tmp_filename, "wb")
+
+			# Calculate the checksum while decompressing.
+			h = hashlib.new("sha1")
 
 			try:
 				while True:
 					buf = fileobj.read(BUFFER_SIZE)
 					if not buf:
 						break
+
+					h.update(buf)
 					cacheobj.write(buf)
 
 			finally:
@@ -263,12 +371,110 @@ class RepositoryRemote(base.RepositoryFactory):
 				if not urlobj == fileobj:
 					urlobj.close()
 
-			break
+			hash1 = self.metadata.database_hash1
+			if hash1 is None or h.hexdigest() == hash1:
+				break
+
+			log.warning(_("The checksum of the downloaded package database did not match."))
+			log.warning(_("Trying an other mirror."))
+
+			# Remove the bad file and go to the next mirror.
+			self.cache.remove(tmp_filename)
+			grabber.increment_mirror(grabber)
+
+		# Move the database into place.
+		os.rename(self.cache.abspath(tmp_filename), self.cache.abspath(cache_filename))
+
+		# Remove all databases that are not used any more.
+		dirname = os.path.dirname(self.cache.abspath(cache_filename))
+
+		for file in os.listdir(dirname):
+			if file == self.metadata.database:
+				continue
+
+			log.debug("Removing outdated package database: %s" % file)
+			os.unlink(os.path.join(dirname, file))
+
+	def update_database_delta(self, grabber, tmp_filename):
+		"""
+			Creates the new database from an older one in the cache
+			by applying a delta. Returns True on success.
+		"""
+		deltas = self.metadata.database_deltas
+		if not deltas:
+			return False
+
+		dirname = os.path.dirname(self.cache.abspath(tmp_filename))
+		if not os.path.exists(dirname):
+			return False
+
+		for file in os.listdir(dirname):
+			# The hash is part of the filename of every database. Other
+			# files (i.e. incomplete downloads) are skipped.
+			old_hash, sep, name = file.partition("-")
+			if not name == METADATA_DATABASE_FILE:
+				continue
+
+			delta_filename = deltas.get(old_hash, None)
+			if not delta_filename:
+				continue
+
+			log.debug("Updating package database of %s with delta %s" \
+				% (self.name, delta_filename))
+
+			try:
+				urlobj = fileobj = grabber.urlopen(
+					os.path.join(METADATA_DOWNLOAD_PATH, delta_filename))
+
+				if self.metadata.database_compression:
+					fileobj = compress.decompressobj(fileobj=fileobj,
+						algo=self.metadata.database_compression)
+
+				try:
+					data = fileobj.read()
+				finally:
+					fileobj.close()
+					if not urlobj == fileobj:
+						urlobj.close()
+
+				with open(os.path.join(dirname, file)) as f:
+					data = delta.apply(f.read(), data)
+
+			# Broken deltas or databases may fail in many ways. The next
+			# database is tried then and the whole database is downloaded
+			# if none of them works.
+			except Exception, e:
+				log.debug("Could not apply delta %s: %s" % (delta_filename, e))
+				continue
+
+			hash1 = self.metadata.database_hash1
+			if hash1 and not util.calc_hash1(data=data) == hash1:
+				log.debug("Delta %s did not result in the expected database" % delta_filename)
+				continue
+
+			f = self.cache.open(tmp_filename, "wb")
+			try:
+				f.write(data)
+			finally:
+				f.close()
+
+			return True
 
-	def download(self, pkg, text="", logger=None):
+		return False
+
+	def download(self, pkg, text="", logger=None, progress_obj=None, mirror=None):
 		"""
 			Downloads 'filename' from repository and returns the local filename.
+
+			If mirror is given, the download is tried there first.
 		"""
+		# Wait until any other process that downloads the same file
+		# has finished.
+		with self.cache.lock(pkg.cache_filename):
+			return self._download(pkg, text=text, logger=logger,
+				progress_obj=progress_obj, mirror=mirror)
+
+	def _download(self, pkg, text="", logger=None, progress_obj=None, mirror=None):
 		if logger is None:
 			logger = log
 
@@ -291,16 +497,34 @@ class RepositoryRemote(base.RepositoryFactory):
 				# The file in cache has a wrong hash. Remove it and repeat download.
 				self.cache.remove(cache_filename)
 
+		# Another repository might have provided the same file under a different name.
+		if download and hash1 and self.cache.link(cache_filename, hash1):
+			logger.debug("Found %s in cache under a different name" % filename)
+			download = False
+
 		# Get a package grabber and add mirror download capabilities to it.
 		grabber = downloader.PackageDownloader(
 			self.pakfire,
 			text=text + os.path.basename(filename),
+			progress_obj=progress_obj,
 		)
-		grabber = self.mirrors.group(grabber)
+		grabber = self.mirrors.group(grabber, first=mirror)
 
 		# Make sure filename is of type string (and not unicode)
 		filename = str(filename)
 
+		# The file is downloaded to a temporary file first. If the download
+		# is interrupted, it will be continued from there.
+		part_filename = "%s.part" % cache_filename
+
+		# Number of interrupted downloads from the current mirror.
+		retries = 0
+
+		# Big files are downloaded from several mirrors at the same time.
+		if download and self.download_segmented(pkg, part_filename, text=text,
+				logger=logger, progress_obj=progress_obj):
+			download = False
+
 		while download:
 			logger.debug("Going to download %s" % filename)
 
@@ -309,27 +533,93 @@ class RepositoryRemote(base.RepositoryFactory):
 				raise OfflineModeError, _("Cannot download this file in offline mode: %s") \
 					% filename
 
+			# Continue a previous download.
+			offset = 0
+			if self.cache.exists(part_filename):
+				offset = os.path.getsize(self.cache.abspath(part_filename))
+
+			# Measure how fast the mirror is.
+			time_start = time.time()
+
 			try:
-				i = grabber.urlopen(filename)
+				if offset:
+					logger.debug("Resuming download of %s at %s" % (filename, offset))
+					i = grabber.urlopen(filename, range=(offset, None))
+				else:
+					i = grabber.urlopen(filename)
+
 			except urlgrabber.grabber.URLGrabError, e:
+				# The partial file is longer than the file on the server,
+				# so it is broken. Start again from zero.
+				if offset and downloader.is_range_error(e):
+					self.cache.remove(part_filename)
+					continue
+
+				# Otherwise the partial file is kept and the download
+				# will be continued the next time.
 				raise DownloadError, _("Could not download %s: %s") % (filename, e)
 
-			# Open input and output files and download the file.
-			o = self.cache.open(cache_filename, "w")
+			mirror = self.mirrors.current(grabber)
+			latency = time.time() - time_start
+			size = 0
+
+			# Calc the hash1 of the file while downloading it.
+			h = hashlib.new("sha1")
+
+			# Append to the partial file. If the server does not support ranges,
+			# urlgrabber skips the data we already have on its own.
+			if offset:
+				o = self.cache.open(part_filename, "ab")
+
+				# Add the data we already got to the hash.
+				with self.cache.open(part_filename) as f:
+					buf = f.read(BUFFER_SIZE)
+					while buf:
+						h.update(buf)
+						buf = f.read(BUFFER_SIZE)
+			else:
+				o = self.cache.open(part_filename, "wb")
 
-			buf = i.read(BUFFER_SIZE)
-			while buf:
-				o.write(buf)
+			try:
 				buf = i.read(BUFFER_SIZE)
+				while buf:
+					h.update(buf)
+					o.write(buf)
+					size += len(buf)
+					buf = i.read(BUFFER_SIZE)
+
+			# Keep everything we got so far and try again.
+			except (urlgrabber.grabber.URLGrabError, IOError), e:
+				logger.warning(_("The download of %s was interrupted: %s") % (filename, e))
+
+				if mirror:
+					self.mirrors.scoreboard.record_failure(mirror)
 
-			i.close()
-			o.close()
+				retries += 1
+				if retries >= 3:
+					retries = 0
+					grabber.increment_mirror(grabber)
 
-			# Calc the hash1 of the downloaded file.
-			calc_hash1 = self.cache.hash1(cache_filename)
+				continue
+
+			finally:
+				i.close()
+				o.close()
+
+			calc_hash1 = h.hexdigest()
 
 			if calc_hash1 == hash1:
 				logger.debug("Successfully downloaded %s (%s)." % (filename, hash1))
+
+				if mirror:
+					self.mirrors.scoreboard.record_success(mirror, latency=latency,
+						size=size, duration=time.time() - time_start - latency)
+
+				os.rename(self.cache.abspath(part_filename),
+					self.cache.abspath(cache_filename))
+
+				# Remember that the file is okay, so it is not read again.
+				self.cache.set_verified(cache_filename, hash1)
 				break
 
 			sums = {
@@ -342,13 +632,83 @@ class RepositoryRemote(base.RepositoryFactory):
 			logger.warning(_("Trying an other mirror."))
 
 			# Remove the bad file.
-			self.cache.remove(cache_filename)
+			self.cache.remove(part_filename)
+
+			if mirror:
+				self.mirrors.scoreboard.record_failure(mirror)
 
 			# Go to the next mirror.
+			retries = 0
 			grabber.increment_mirror(grabber)
 
 		return os.path.join(self.cache.path, cache_filename)
 
+	def download_segmented(self, pkg, part_filename, text="", logger=None, progress_obj=None):
+		"""
+			Downloads a big package in several parts from different
+			mirrors at the same time.
+
+			Returns False if the package needs to be downloaded as a whole.
+		"""
+		if logger is None:
+			logger = log
+
+		min_size = self.pakfire.config.get("downloader", "segmented_downloads_min_size", "64M")
+		try:
+			min_size = util.parse_size(min_size)
+		except ValueError:
+			min_size = 0
+
+		if not min_size or not pkg.size or pkg.size < min_size or not pkg.hash1:
+			return False
+
+		# Partial downloads are continued from the mirror they came from.
+		if self.pakfire.offline or self.cache.exists(part_filename):
+			return False
+
+		urls = self.mirrors.get_urls()
+		if len(urls) < 2:
+			return False
+
+		logger.debug("Downloading %s from %s mirrors" % (pkg.filename, len(urls)))
+
+		if progress_obj is None:
+			progress_obj = urlgrabber.progress.TextMeter()
+
+		# The segments are written to a file of their own, which has got
+		# the full size from the start. The partial file of a download from
+		# one mirror must only contain the data from the beginning.
+		segments_filename = "%s.segments" % pkg.cache_filename
+		state_filename = "%s.state" % segments_filename
+
+		# Create the directory.
+		self.cache.open(state_filename, "a").close()
+
+		grabber = downloader.SegmentedDownloader(self.pakfire, urls,
+			scoreboard=self.mirrors.scoreboard)
+
+		if grabber.download(str(pkg.filename), pkg.size, self.cache.abspath(segments_filename),
+				self.cache.abspath(state_filename), text=text + os.path.basename(pkg.filename),
+				progress_obj=progress_obj):
+			self.cache.remove(state_filename)
+
+			if self.cache.hash1(segments_filename) == pkg.hash1:
+				os.rename(self.cache.abspath(segments_filename),
+					self.cache.abspath(pkg.cache_filename))
+
+				self.cache.set_verified(pkg.cache_filename, pkg.hash1)
+				return True
+
+			logger.warning(_("The checksum of the downloaded file did not match."))
+
+		logger.debug("Falling back to downloading %s from one mirror" % pkg.filename)
+
+		# Start again from zero.
+		self.cache.remove(segments_filename)
+		self.cache.remove(state_filename)
+
+		return False
+
 	def get_config(self):
 		if self.enabled:
 			enabled = "1"
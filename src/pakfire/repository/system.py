@@ -19,8 +19,12 @@
 #                                                                             #
 ###############################################################################
 
+import json
 import os
 
+import logging
+log = logging.getLogger("pakfire")
+
 import base
 import database
 
@@ -40,10 +44,23 @@ class RepositorySystem(base.RepositoryFactory):
 		# Tell the solver, that these are the installed packages.
 		self.pool.set_installed(self.solver_repo)
 
+		# UUIDs of all packages that have been added or removed
+		# since the last commit.
+		self.added = []
+		self.removed = []
+
+		# The number of added and removed packages when the
+		# currently running action was started.
+		self.action = None
+
 	@property
 	def cache_file(self):
 		return os.path.join(self.pakfire.path, PACKAGES_SOLV)
 
+	@property
+	def cache_key_file(self):
+		return os.path.join(self.pakfire.path, PACKAGES_SOLV_KEY)
+
 	@property
 	def priority(self):
 		"""
@@ -55,27 +72,158 @@ class RepositorySystem(base.RepositoryFactory):
 		# Initialize database.
 		self.db.initialize()
 
+		# Remove all data from the current index.
+		self.index.clear()
+
+		# Get the key that describes the current state of the database.
+		key = self.get_cache_key()
+
+		# Try to load the snapshot of the index that has been written when
+		# the database was changed for the last time.
+		uptodate = False
+
+		if self.read_cache():
+			cache_key = self.read_cache_key() or {}
+			uptodate = cache_key == key
+
+			# If the snapshot is outdated, we apply all changes that have
+			# been made since it has been written. Snapshots of a different
+			# database format are rebuilt from scratch.
+			if not uptodate:
+				if cache_key.get("format") == key["format"]:
+					self.update_index()
+				else:
+					self.rebuild_index()
+		else:
+			self.rebuild_index()
+
+		self.index.optimize()
+
+		# Save a new snapshot for the next time.
+		if not uptodate:
+			self.write_cache(key)
+
+		# Mark repo as open.
+		self.opened = True
+
+	def rebuild_index(self):
+		"""
+			Reads all packages from the database into the index.
+		"""
+		log.debug("Rebuilding index of installed packages")
+
 		# Create a progressbar.
 		pb = util.make_progress(_("Loading installed packages"), len(self.db))
 
 		# Remove all data from the current index.
 		self.index.clear()
 
+		# Read the dependencies of all packages at once.
+		dependencies = self.db.get_dependencies()
+
 		i = 0
 		for pkg in self.db.packages:
 			if pb:
 				i += 1
 				pb.update(i)
 
+			pkg.dependencies = dependencies.get(pkg.id, {})
 			self.index.add_package(pkg)
 
-		self.index.optimize()
-
 		if pb:
 			pb.finish()
 
-		# Mark repo as open.
-		self.opened = True
+	def update_index(self):
+		"""
+			Adds all packages to the index that have been installed and
+			removes all packages that have been uninstalled after the
+			snapshot was taken.
+		"""
+		indexed = set((s.get_uuid() for s in self.solver_repo.get_all()))
+		installed = self.db.get_uuids()
+
+		removed = indexed - installed
+		self.index.rem_packages(removed)
+
+		added = installed - indexed
+		for uuid in added:
+			pkg = self.db.get_package_by_uuid(uuid)
+			self.index.add_package(pkg)
+
+		log.debug("Updated index snapshot: %s package(s) added, %s removed" \
+			% (len(added), len(removed)))
+
+	def get_cache_key(self):
+		"""
+			Returns the key that describes the current state of the database.
+			A snapshot of the index is only valid for exactly this key.
+		"""
+		try:
+			mtime = os.path.getmtime(self.db.filename)
+		except OSError:
+			mtime = None
+
+		# Changes that have not been checkpointed yet are only in the
+		# write-ahead log and do not change the database file.
+		try:
+			wal = os.path.getsize("%s-wal" % self.db.filename)
+		except OSError:
+			wal = 0
+
+		return {
+			"format"     : self.db.format,
+			"generation" : self.db.generation,
+			"mtime"      : mtime,
+			"wal"        : wal,
+		}
+
+	def read_cache_key(self):
+		try:
+			with open(self.cache_key_file) as f:
+				return json.load(f)
+
+		except (IOError, ValueError):
+			return None
+
+	def read_cache(self):
+		"""
+			Loads the snapshot of the index. Returns True on success.
+		"""
+		if not os.path.exists(self.cache_file):
+			return False
+
+		try:
+			self.index.read(self.cache_file)
+
+		# Throw away snapshots that cannot be read.
+		except RuntimeError, e:
+			log.debug("Could not read index snapshot: %s" % e)
+			self.index.clear()
+
+			return False
+
+		return True
+
+	def write_cache(self, key):
+		"""
+			Writes a snapshot of the index to disk that is valid
+			for the given key.
+		"""
+		try:
+			# Invalidate the old snapshot first.
+			if os.path.exists(self.cache_key_file):
+				os.unlink(self.cache_key_file)
+
+			self.index.write("%s.tmp" % self.cache_file)
+			os.rename("%s.tmp" % self.cache_file, self.cache_file)
+
+			with open("%s.tmp" % self.cache_key_file, "w") as f:
+				json.dump(key, f)
+			os.rename("%s.tmp" % self.cache_key_file, self.cache_key_file)
+
+		# A missing snapshot is not fatal (i.e. read-only file systems).
+		except (IOError, OSError, RuntimeError), e:
+			log.debug("Could not write index snapshot: %s" % e)
 
 	def close(self):
 		# Commit all data that is currently pending for writing.
@@ -90,23 +238,91 @@ class RepositorySystem(base.RepositoryFactory):
 		# Mark repo as closed.
 		self.opened = False
 
+	def begin(self):
+		"""
+			Collects all following changes and writes them to the
+			database in one go when commit() is called.
+		"""
+		self.db.begin()
+
+	def rollback(self):
+		"""
+			Discards all changes since begin() was called.
+		"""
+		self.db.rollback()
+
+		# Drop the packages that have been added from the index again.
+		# Removed packages are still in it.
+		self.index.rem_packages(self.added)
+
+		self.added = []
+		self.removed = []
+		self.action = None
+
+	def begin_action(self):
+		"""
+			Marks the start of a single action of a transaction.
+		"""
+		self.db.savepoint("action")
+
+		self.action = (len(self.added), len(self.removed))
+
+	def end_action(self):
+		"""
+			Marks that the running action has been completed.
+		"""
+		self.db.release("action")
+
+		self.action = None
+
+	def abort_action(self):
+		"""
+			Discards all changes of the running action.
+		"""
+		if self.action is None:
+			return
+
+		added, removed = self.action
+
+		self.db.rollback_to("action")
+
+		self.index.rem_packages(self.added[added:])
+
+		del self.added[added:]
+		del self.removed[removed:]
+
+		self.action = None
+
 	def commit(self):
 		# Commit the database to disk.
 		self.db.commit()
 
+		# Drop all removed packages from the index. This is not done
+		# earlier, because the solvables might still be used by the
+		# running transaction.
+		self.index.rem_packages(self.removed)
+
+		self.added = []
+		self.removed = []
+		self.action = None
+
+		# Write back the write-ahead log, so that the database file does
+		# not change any more when it is closed.
+		self.db.checkpoint()
+
 		# Make sure that all data in the index is accessable.
 		self.index.optimize()
 
-		# Write the content of the index to a file
-		# for fast parsing.
-		# XXX this is currently disabled
-		#self.index.write(self.cache_file)
+		# Write the content of the index to a file for fast parsing.
+		self.write_cache(self.get_cache_key())
 
 	def add_package(self, pkg):
 		# Add package to the database.
 		self.db.add_package(pkg)
 		self.index.add_package(pkg)
 
+		self.added.append(pkg.uuid)
+
 	def rem_package(self, pkg):
 		if isinstance(pkg, packages.SolvPackage):
 			pkg = pkg.get_from_db()
@@ -116,12 +332,43 @@ class RepositorySystem(base.RepositoryFactory):
 			if pkg is None:
 				return
 
-		# Remove package from the database.
+		# Remove package from the database. It is removed from the
+		# index when the changes are committed.
 		self.db.rem_package(pkg)
 
+		self.removed.append(pkg.uuid)
+
 	def get_package_by_uuid(self, uuid):
 		return self.db.get_package_by_uuid(uuid)
 
+	def vacuum(self):
+		"""
+			Cleans up and compacts the database of installed packages.
+		"""
+		log.debug("Vacuuming the database of installed packages")
+
+		self.db.vacuum()
+
+		# The database has been rewritten, so save a new snapshot.
+		self.write_cache(self.get_cache_key())
+
+	def load_filelists(self, pkgs):
+		"""
+			Loads the filelists of all given installed packages
+			at once.
+		"""
+		pkgs = [p for p in pkgs if isinstance(p, packages.DatabasePackage)]
+		filelists = self.db.get_filelists(pkgs)
+
+		for pkg in pkgs:
+			pkg.filelist = filelists.get(pkg.id, [])
+
+	def get_packages_by_file(self, name):
+		return self.db.get_packages_by_file(name)
+
+	def is_file_owned(self, name):
+		return self.db.is_file_owned(name)
+
 	@property
 	def filelist(self):
 		return self.db.get_filelist()
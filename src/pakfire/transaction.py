@@ -19,11 +19,14 @@
 #                                                                             #
 ###############################################################################
 
+import itertools
+import multiprocessing
 import os
 import progressbar
 import sys
 import time
 
+import downloader
 import i18n
 import packages
 import satsolver
@@ -48,24 +51,44 @@ class TransactionCheck(object):
 		# A place to store errors.
 		self.errors = []
 
-		# Get a list of all installed files from the database.
-		self.filelist = self.load_filelist()
+		# Counts how many packages will own a file after the transaction.
+		# Installed files are looked up in the database when they
+		# are touched for the first time.
+		self.filelist = {}
+
+		# All files that will be owned by more than one package.
+		self.conflicts = set()
+
+		# Remember which packages are installed and removed.
+		self.installs = []
+		self.removes = []
 
 		# Get information about the mounted filesystems.
 		self.mountpoints = system.Mountpoints(self.pakfire.path)
 
 	@property
 	def error_files(self):
-		ret = []
+		return sorted(self.conflicts)
 
-		for name, count in self.filelist.items():
-			if count > 1:
-				ret.append(name)
+	def provides_file(self, name):
+		"""
+			Returns the names of all packages that will own the
+			given file after the transaction.
+		"""
+		removes = [p.uuid for p in self.removes]
 
-		return sorted(ret)
+		pkgs = []
+		for pkg in self.pakfire.repos.local.get_packages_by_file(name):
+			if pkg.uuid in removes:
+				continue
 
-	def provides_file(self, name):
-		return [] # XXX TODO
+			pkgs.append(pkg.friendly_name)
+
+		for pkg in self.installs:
+			if name in (f.name for f in pkg.filelist):
+				pkgs.append(pkg.friendly_name)
+
+		return pkgs
 
 	@property
 	def successful(self):
@@ -111,36 +134,41 @@ class TransactionCheck(object):
 			logger.critical(_("There is not enough space left on %(name)s. Need at least %(size)s to perform transaction.") \
 				% { "name" : mp.path, "size" : util.format_size(mp.space_needed) })
 
-	def load_filelist(self):
-		filelist = {}
-
-		for file in self.pakfire.repos.local.filelist:
-			filelist[file] = 1
+	def count_file(self, name, count):
+		try:
+			self.filelist[name] += count
+		except KeyError:
+			# Check if the file is already owned by an installed package.
+			if self.pakfire.repos.local.is_file_owned(name):
+				self.filelist[name] = 1 + count
+			else:
+				self.filelist[name] = count
 
-		return filelist
+		if self.filelist[name] > 1:
+			self.conflicts.add(name)
+		else:
+			self.conflicts.discard(name)
 
 	def install(self, pkg):
+		self.installs.append(pkg)
+
 		for file in pkg.filelist:
 			if file.is_dir():
 				continue
 
-			try:
-				self.filelist[file.name] += 1
-			except KeyError:
-				self.filelist[file.name] = 1
+			self.count_file(file.name, 1)
 
 		# Add all filesize data to mountpoints.
 		self.mountpoints.add_pkg(pkg)
 
 	def remove(self, pkg):
+		self.removes.append(pkg)
+
 		for file in pkg.filelist:
 			if file.is_dir():
 				continue
 
-			try:
-				self.filelist[file.name] -= 1
-			except KeyError:
-				pass
+			self.count_file(file.name, -1)
 
 		# Remove all filesize data from mountpoints.
 		self.mountpoints.rem_pkg(pkg)
@@ -159,6 +187,8 @@ class Step(object):
 		self.type = type
 		self.pkg = pkg
 
+		self._binary_pkg = None
+
 	@classmethod
 	def from_step(cls, pakfire, step):
 		pkg = packages.SolvPackage(pakfire, step.get_solvable())
@@ -169,17 +199,17 @@ class Step(object):
 		return "<%s %s %s>" % (self.__class__.__name__, self.type, self.pkg)
 
 	def get_binary_pkg(self):
-		if not hasattr(self, "__binary_pkg"):
+		if self._binary_pkg is None:
 			if self.type in (ActionCleanup.type, ActionRemove.type):
-				self.__binary_pkg = self.pkg.get_from_db()
-				assert self.__binary_pkg
+				self._binary_pkg = self.pkg.get_from_db()
+				assert self._binary_pkg
 			else:
-				self.__binary_pkg = self.pkg.get_from_cache()
+				self._binary_pkg = self.pkg.get_from_cache()
 
-		return self.__binary_pkg
+		return self._binary_pkg
 
 	def set_binary_pkg(self, pkg):
-		self.__binary_pkg = pkg
+		self._binary_pkg = pkg
 
 	binary_pkg = property(get_binary_pkg, set_binary_pkg)
 
@@ -335,6 +365,31 @@ class Transaction(object):
 
 		return self.__download_size
 
+	def check_download_space(self):
+		"""
+			Raises DownloadError if there is not enough space
+			to download all packages.
+		"""
+		# Get free space of the download location.
+		path = os.path.realpath(REPO_CACHE_DIR)
+		while not os.path.ismount(path):
+			path = os.path.dirname(path)
+		path_stat = os.statvfs(path)
+
+		if self.download_size >= path_stat.f_bavail * path_stat.f_bsize:
+			raise DownloadError, _("Not enough space to download %s of packages.") \
+				% util.format_size(self.download_size)
+
+	def clean_cache(self):
+		"""
+			Keeps the cache within its limits, but never removes the
+			packages that are needed for this transaction.
+		"""
+		keep = [s.pkg.cache_filename for s in self.steps \
+			if isinstance(s.pkg, packages.SolvPackage)]
+
+		self.pakfire.repos.clean_cache(keep=keep)
+
 	def download(self, logger=None):
 		if logger is None:
 			logger = logging.getLogger("pakfire")
@@ -343,30 +398,39 @@ class Transaction(object):
 
 		# If there are no downloads, we can just stop here.
 		if not downloads:
+			# Remember that the cached packages have been used.
+			self.pakfire.repos.flush_cache_index()
 			return
 
-		# Get free space of the download location.
-		path = os.path.realpath(REPO_CACHE_DIR)
-		while not os.path.ismount(path):
-			path = os.path.dirname(path)
-		path_stat = os.statvfs(path)
-
-		if self.download_size >= path_stat.f_bavail * path_stat.f_bsize:
-			raise DownloadError, _("Not enough space to download %s of packages.") \
-				% util.format_size(self.download_size)
+		self.check_download_space()
 
 		logger.info(_("Downloading packages:"))
 		time_start = time.time()
 
-		counter = 0
-		counter_downloads = len(downloads)
-		for step in downloads:
-			counter += 1
+		queue = downloader.DownloadQueue(self.pakfire)
+
+		# Download many packages at the same time.
+		if queue.max_threads > 1 and len(downloads) > 1:
+			binary_pkgs = queue.download([s.pkg for s in downloads], logger=logger)
+
+			for step, binary_pkg in zip(downloads, binary_pkgs):
+				step.binary_pkg = binary_pkg
 
-			# Download the package file.
-			step.binary_pkg = step.pkg.download(
-				text="(%d/%d): " % (counter, counter_downloads),
-				logger=logger)
+		else:
+			counter = 0
+			counter_downloads = len(downloads)
+			for step in downloads:
+				counter += 1
+
+				# Download the package file.
+				step.binary_pkg = step.pkg.download(
+					text="(%d/%d): " % (counter, counter_downloads),
+					logger=logger)
+
+		# Format and calculate download information.
+		time_stop = time.time()
+
+		self.clean_cache()
 
 		# Write an empty line to the console when there have been any downloads.
 		width, height = util.terminal_size()
@@ -374,8 +438,6 @@ class Transaction(object):
 		# Print a nice line.
 		logger.info("-" * width)
 
-		# Format and calculate download information.
-		time_stop = time.time()
 		download_time = time_stop - time_start
 		download_speed = self.download_size / download_time
 		download_speed = util.format_speed(download_speed)
@@ -493,6 +555,10 @@ class Transaction(object):
 		# Initialize the check object.
 		check = TransactionCheck(self.pakfire, self)
 
+		# Load the filelists of all installed packages that are
+		# touched by this transaction with one query.
+		self.local.load_filelists([a.pkg for a in actions])
+
 		for action in actions:
 			try:
 				action.check(check)
@@ -509,74 +575,140 @@ class Transaction(object):
 
 		raise TransactionCheckError, _("Transaction test was not successful")
 
+	def get_signatures_mode(self, mode=None):
+		"""
+			Returns the mode of the signature verification.
+		"""
+		if mode is None:
+			mode = self.pakfire.config.get("signatures", "mode", "strict")
+
+		return mode
+
+	def needs_verification(self, step):
+		"""
+			Tells if the package of step has to be verified.
+		"""
+		if not step.type in (ActionInstall.type, ActionReinstall.type,
+				ActionUpdate.type, ActionDowngrade.type):
+			return False
+
+		# Packages from local repositories need no verification.
+		if not step.binary_pkg or step.pkg.repo.local:
+			return False
+
+		return True
+
+	def verify_step(self, step, scan):
+		"""
+			Checks the signatures and checksums of the package of step
+			and returns a list of all errors.
+
+			scan is the result of scan_archive() for the package.
+		"""
+		chksums, signatures, hashes = scan
+
+		# Check if there are any signatures at all.
+		if not signatures:
+			return [_("%s has got no signatures") % step.binary_pkg.friendly_name]
+
+		try:
+			sigs = step.binary_pkg.verify(scan=scan)
+
+		except SignatureError, e:
+			return ["%s" % e]
+
+		if not sigs:
+			return [_("%s has got no valid signatures") % step.binary_pkg.friendly_name]
+
+		return []
+
+	def handle_signature_errors(self, errors, mode, logger):
+		"""
+			Raises a SignatureError in strict mode or warns about
+			errors in permissive mode.
+		"""
+		# If no errors were found everything is fine.
+		if not errors:
+			return
+
+		# Raise a SignatureError in strict mode.
+		if mode == "strict":
+			raise SignatureError, "\n".join(errors)
+
+		elif mode == "permissive":
+			logger.warning(_("Found %s signature error(s)!") % len(errors))
+			for error in errors:
+				logger.warning("  %s" % error)
+			logger.warning("")
+
+			logger.warning(_("Going on because we are running in permissive mode."))
+			logger.warning(_("This is dangerous!"))
+			logger.warning("")
+
 	def verify_signatures(self, mode=None, logger=None):
 		"""
 			Check the downloaded files for valid signatures.
 		"""
 		if not logger:
-			logger = log.getLogger("pakfire")
+			logger = logging.getLogger("pakfire")
 
-		if mode is None:
-			mode = self.pakfire.config.get("signatures", "mode", "strict")
+		mode = self.get_signatures_mode(mode)
 
 		# If this disabled, we do nothing.
 		if mode == "disabled":
 			return
 
 		# Search for steps we need to process.
-		steps = []
-		for step in self.steps:
-			if not step.binary_pkg:
-				continue
+		steps = [s for s in self.steps if self.needs_verification(s)]
 
-			steps.append(step)
+		if not steps:
+			return
 
 		# Make a nice progressbar.
-		p = progressbar.ProgressBar(len(steps))
-		p.add(_("Verifying signatures..."))
-		p.add(progressbar.WidgetBar())
-		p.add(progressbar.WidgetPercentage())
+		p = util.make_progress(_("Verifying signatures..."), len(steps), eta=False)
 
 		# Collect all errors.
 		errors = []
 
-		try:
-			p.start()
+		# Reading and hashing the archives takes the most time, so that is
+		# done for several packages at the same time in other processes.
+		# The signatures are checked here.
+		processes = min(multiprocessing.cpu_count(), len(steps))
+
+		if processes > 1:
+			pool = multiprocessing.Pool(processes)
+			scans = pool.imap(packages.file.scan_archive,
+				[s.binary_pkg.filename for s in steps])
+		else:
+			pool = None
+			scans = (packages.file.scan_archive(s.binary_pkg.filename) for s in steps)
 
+		try:
 			# Do the verification for every action.
 			i = 0
-			for step in steps:
+			for step, scan in itertools.izip(steps, scans):
 				# Update the progressbar.
 				if p:
 					i += 1
 					p.update(i)
 
-				try:
-					step.pkg.verify()
+				errors += self.verify_step(step, scan)
+
+			if pool:
+				pool.close()
 
-				except SignatureError, e:
-					errors.append("%s" % e)
 		finally:
+			if pool:
+				pool.terminate()
+				pool.join()
+
 			if p: p.finish()
 
-		# If no errors were found everything is fine.
 		if not errors:
 			logger.info("")
 			return
 
-		# Raise a SignatureError in strict mode.
-		if mode == "strict":
-			raise SignatureError, "\n".join(errors)
-
-		elif mode == "permissive":
-			logger.warning(_("Found %s signature error(s)!") % len(errors))
-			for error in errors:
-				logger.warning("  %s" % error)
-			logger.warning("")
-
-			logger.warning(_("Going on because we are running in permissive mode."))
-			logger.warning(_("This is dangerous!"))
-			logger.warning("")
+		self.handle_signature_errors(errors, mode, logger)
 
 	def create_actions(self):
 		"""
@@ -597,17 +729,52 @@ class Transaction(object):
 
 		return actions_pre + actions + actions_post
 
-	def run(self, logger=None, signatures_mode=None):
+	@property
+	def pipelined(self):
+		"""
+			Tells if packages are installed while others are still being
+			downloaded. This is only allowed in build environments, which
+			are thrown away if anything goes wrong.
+		"""
+		if not self.pakfire.builder:
+			return False
+
+		return self.pakfire.config.get_bool("builder", "pipelined_transactions", False)
+
+	def run_action(self, action, logger):
+		"""
+			Runs a single action and logs all kinds of ActionError.
+		"""
+		# Changes of an action that does not finish are discarded.
+		self.local.begin_action()
+
+		try:
+			action.run()
+
+		except ActionError, e:
+			logger.error("Action finished with an error: %s - %s" % (action, e))
+		#except Exception, e:
+		#	logger.error(_("An unforeseen error occoured: %s") % e)
+
+		self.local.end_action()
+
+	def run(self, logger=None, signatures_mode=None, pipelined=None):
 		if logger is None:
 			logger = logging.getLogger("pakfire")
 
+		if pipelined is None:
+			pipelined = self.pipelined
+
+		if pipelined and self.get_downloads():
+			return self.run_pipelined(logger=logger, signatures_mode=signatures_mode)
+
 		# Download all packages.
 		# (don't add logger here because I do not want to see downloads
 		# in the build logs on the build service)
 		self.download()
 
 		# Verify signatures.
-		#self.verify_signatures(mode=signatures_mode, logger=logger)
+		self.verify_signatures(mode=signatures_mode, logger=logger)
 
 		# Create actions.
 		actions = self.create_actions()
@@ -616,15 +783,22 @@ class Transaction(object):
 		self.check(actions, logger=logger)
 
 		logger.info(_("Running transaction"))
-		# Run all actions in order and catch all kinds of ActionError.
-		for action in actions:
-			try:
-				action.run()
 
-			except ActionError, e:
-				logger.error("Action finished with an error: %s - %s" % (action, e))
-			#except Exception, e:
-			#	logger.error(_("An unforeseen error occoured: %s") % e)
+		# Write all changes to the database in one database transaction.
+		self.local.begin()
+
+		# Remembers if any action has already been completed.
+		completed = False
+
+		try:
+			# Run all actions in order and catch all kinds of ActionError.
+			for action in actions:
+				self.run_action(action, logger)
+				completed = True
+
+		except:
+			self.abort(completed, logger)
+			raise
 
 		logger.info("")
 
@@ -633,3 +807,131 @@ class Transaction(object):
 
 		# Call sync to make sure all buffers are written to disk.
 		_pakfire.sync()
+
+	def abort(self, completed, logger):
+		"""
+			Finishes the database transaction after running the actions
+			has been aborted by an unexpected error.
+
+			The changes of the interrupted action are always discarded.
+			If no action has been completed, the database is left untouched.
+
+			Otherwise the files of the completed actions are already on
+			disk and cannot be taken back. The changes of those actions
+			are committed, so that the database matches the files on disk.
+		"""
+		self.local.abort_action()
+
+		if not completed:
+			self.local.rollback()
+			return
+
+		logger.error(_("The transaction has been aborted."))
+		logger.error(_("The changes of all completed actions are kept in the database."))
+
+		self.local.commit()
+
+	def run_pipelined(self, logger, signatures_mode=None):
+		"""
+			Runs the transaction while the packages are still being
+			downloaded.
+
+			The packages are downloaded in the order of the steps and
+			every step is checked and run as soon as its package has
+			arrived. Pre-transaction scripts run right before the other
+			actions of their step.
+
+			All steps that need no download are checked first, so that
+			a conflict is found as soon as the first package that is
+			involved in it has arrived. However, the steps before that
+			package may already have been run.
+
+			Every package is verified as soon as it has arrived.
+		"""
+		downloads = self.get_downloads()
+
+		signatures_mode = self.get_signatures_mode(signatures_mode)
+
+		self.check_download_space()
+
+		queue = downloader.DownloadQueue(self.pakfire)
+		binary_pkgs = queue.iter_download([s.pkg for s in downloads], logger=logger)
+
+		check = TransactionCheck(self.pakfire, self)
+
+		def check_step(step):
+			actions = step.create_actions()
+
+			for action in actions:
+				action.check(check)
+
+			if not check.successful:
+				check.print_errors(logger=logger)
+
+				raise TransactionCheckError, _("Transaction test was not successful")
+
+			return actions
+
+		logger.info(_("Running transaction"))
+
+		# Write all changes to the database in one database transaction.
+		self.local.begin()
+
+		# Remembers if any action has already been completed.
+		completed = False
+
+		try:
+			# Removing packages only makes room for the new ones, so these
+			# steps are checked first.
+			self.local.load_filelists([s.binary_pkg for s in self.steps \
+				if not s in downloads])
+
+			actions = {}
+			for step in self.steps:
+				if not step in downloads:
+					actions[step] = check_step(step)
+
+			actions_post = []
+
+			for step in self.steps:
+				if step in downloads:
+					step.binary_pkg = binary_pkgs.next()
+
+					# Verify the package before anything is done with it.
+					if not signatures_mode == "disabled" and self.needs_verification(step):
+						scan = packages.file.scan_archive(step.binary_pkg.filename)
+
+						self.handle_signature_errors(self.verify_step(step, scan),
+							signatures_mode, logger)
+
+					actions[step] = check_step(step)
+
+				for action in actions.pop(step):
+					# Post-transaction scripts run after all other actions.
+					if isinstance(action, ActionScriptPostTrans):
+						actions_post.append(action)
+						continue
+
+					self.run_action(action, logger)
+					completed = True
+
+			for action in actions_post:
+				self.run_action(action, logger)
+				completed = True
+
+		except:
+			self.abort(completed, logger)
+
+			# Stop all downloads.
+			queue.stop()
+			raise
+
+		logger.info("")
+
+		# Commit repository metadata.
+		self.local.commit()
+
+		# Call sync to make sure all buffers are written to disk.
+		_pakfire.sync()
+
+		self.clean_cache()
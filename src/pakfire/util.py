@@ -21,6 +21,7 @@
 
 from __future__ import division
 
+import errno
 import fcntl
 import hashlib
 import math
@@ -172,6 +173,56 @@ def format_size(s):
 
 	return "%d%s" % (round(s) * sign, units[unit])
 
+def lock(filename, blocking=True):
+	"""
+		Takes an exclusive lock on filename, which is created if it
+		does not exist. The lock is held by the returned file object
+		until it is closed.
+
+		If blocking is False, None is returned when somebody else
+		holds the lock.
+	"""
+	flags = fcntl.LOCK_EX
+	if not blocking:
+		flags |= fcntl.LOCK_NB
+
+	while True:
+		f = open(filename, "a")
+
+		try:
+			fcntl.flock(f.fileno(), flags)
+		except IOError, e:
+			f.close()
+
+			if e.errno in (errno.EAGAIN, errno.EACCES):
+				return
+
+			raise
+
+		# The lock file might have been removed while we were waiting.
+		try:
+			if os.stat(filename).st_ino == os.fstat(f.fileno()).st_ino:
+				return f
+		except OSError:
+			pass
+
+		f.close()
+
+def parse_size(s):
+	"""
+		Converts a size like "10G" into bytes.
+	"""
+	units = ("k", "M", "G", "T")
+
+	s = s.strip()
+
+	unit = 0
+	if s and s[-1].upper() in [u.upper() for u in units]:
+		unit = [u.upper() for u in units].index(s[-1].upper()) + 1
+		s = s[:-1]
+
+	return int(s) * 1024 ** unit
+
 def format_time(s):
 	return "%02d:%02d" % (s // 60, s % 60)
 
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pakfire.repository.cache import RepositoryCache
+
+class CacheCleanTest(unittest.TestCase):
+	def setUp(self):
+		self.cache = RepositoryCache(None, None)
+		self.cache.path = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.cache.path)
+
+	def add(self, filename, size, age):
+		"""
+			Adds a package that has been used age days ago.
+		"""
+		with self.cache.open(filename, "w") as f:
+			f.write("x" * size)
+
+		index = self.cache.index
+		index.access(filename, size)
+		index.flush()
+
+		index.db.execute("UPDATE files SET atime = ? WHERE filename = ?",
+			(int(time.time() - age * 86400), filename))
+		index.db.commit()
+
+	def files(self):
+		return sorted(f for f, size, atime in self.cache.index.get_lru())
+
+	def test_lru(self):
+		self.add("a/a.pfm", 100, 3)
+		self.add("b/b.pfm", 100, 1)
+		self.add("c/c.pfm", 100, 2)
+
+		self.assertEqual(self.cache.index.size, 300)
+		self.assertEqual([f for f, size, atime in self.cache.index.get_lru()],
+			["a/a.pfm", "c/c.pfm", "b/b.pfm"])
+
+	def test_max_age(self):
+		self.add("a/a.pfm", 100, 40)
+		self.add("b/b.pfm", 100, 20)
+		self.add("c/c.pfm", 100, 50)
+
+		self.assertEqual(self.cache.clean(max_age=30, keep=["c/c.pfm"]), 100)
+		self.assertEqual(self.files(), ["b/b.pfm", "c/c.pfm"])
+
+		# The file and its directory are gone.
+		self.assertFalse(os.path.exists(self.cache.abspath("a")))
+		self.assertTrue(self.cache.exists("b/b.pfm"))
+
+	def test_max_size(self):
+		for i, age in enumerate((5, 1, 4, 2, 3)):
+			self.add("p%d/p%d.pfm" % (i, i), 100, age)
+
+		# The least recently used packages go first, except p0.
+		self.assertEqual(self.cache.clean(max_size=250, keep=["p0/p0.pfm"]), 300)
+		self.assertEqual(self.files(), ["p0/p0.pfm", "p1/p1.pfm"])
+
+		for i in range(5):
+			filename = "p%d/p%d.pfm" % (i, i)
+			self.assertEqual(self.cache.exists(filename), filename in self.files())
+
+		# Nothing to do.
+		self.assertEqual(self.cache.clean(max_size=250), 0)
+		self.assertEqual(self.cache.clean(), 0)
+
+	def test_pending_access(self):
+		self.add("a/a.pfm", 100, 2)
+		self.add("b/b.pfm", 100, 1)
+
+		# The access is not in the database yet, but clean() must see it.
+		self.cache.index.access("a/a.pfm", 100)
+
+		self.assertEqual(self.cache.clean(max_size=100), 100)
+		self.assertEqual(self.files(), ["a/a.pfm"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pakfire.compress
+
+class CompressTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+
+		# Some data that compresses well and some that does not. With
+		# preset 1, it is large enough to be split into several blocks
+		# when more than one thread is used.
+		self.data = "".join("line %d\n" % i for i in range(600000)) + os.urandom(256 * 1024)
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def roundtrip(self, **kwargs):
+		filename = os.path.join(self.path, "data.xz")
+
+		f = pakfire.compress.compressobj(filename, **kwargs)
+		for i in range(0, len(self.data), 65536):
+			f.write(self.data[i:i + 65536])
+		f.close()
+
+		with open(filename) as f:
+			self.assertEqual(pakfire.compress.guess_algo(fileobj=f), "xz")
+
+		f = pakfire.compress.decompressobj(filename)
+		try:
+			self.assertEqual(f.read(), self.data)
+		finally:
+			f.close()
+
+	def test_single_thread(self):
+		self.roundtrip(preset=1)
+
+	def test_threads(self):
+		self.roundtrip(preset=1, threads=2)
+
+	def test_all_cpus(self):
+		self.roundtrip(preset=1, threads=0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+import shutil
+import tempfile
+import unittest
+
+import pakfire.filelist
+import pakfire.repository.database as database
+
+class Pakfire(object):
+	def __init__(self, path):
+		self.path = path
+
+
+class Repository(object):
+	name = "test"
+
+
+class Package(object):
+	def __init__(self, name, files):
+		self.name = self.friendly_name = name
+		self.uuid = "uuid-%s" % name
+
+		self.epoch = 0
+		self.version = "1.0"
+		self.release = "1"
+		self.arch = "x86_64"
+		self.groups = []
+		self.filename = "%s.pfm" % name
+		self.size = self.inst_size = 1024
+		self.hash1 = "0" * 40
+		self.license = "GPLv3+"
+		self.summary = self.description = name
+		self.vendor = self.build_id = self.build_host = self.build_date = ""
+		self.build_time = 0
+		self.repo = Repository()
+
+		self.provides = [name,]
+		self.requires = self.conflicts = self.obsoletes = []
+		self.recommends = self.suggests = []
+
+		self.filelist = []
+		for filename in files:
+			f = pakfire.filelist.File(None)
+			f.name = filename
+			f.size = 1024
+			f.pkg = self
+
+			if filename.endswith("/"):
+				f.type = pakfire.filelist.TYPE_DIR_INT
+
+			self.filelist.append(f)
+
+	def get_scriptlet(self, action):
+		return None
+
+
+class SplitPathTest(unittest.TestCase):
+	def test_split_path(self):
+		for name, result in (
+			("/usr/bin/pakfire", ("/usr/bin", "pakfire")),
+			("/usr/bin/",        ("/usr", "bin")),
+			("/usr",             ("/", "usr")),
+			("/",                ("/", "")),
+			("//usr/./bin//x",   ("/usr/bin", "x")),
+			("/usr/lib/../bin",  ("/usr", "bin")),
+			("/usr/.hidden",     ("/usr", ".hidden")),
+		):
+			self.assertEqual(database.split_path(name), result, name)
+
+
+class FileOwnersTest(unittest.TestCase):
+	def setUp(self):
+		self.pakfire = Pakfire(tempfile.mkdtemp())
+
+		self.db = database.DatabaseLocal(self.pakfire, Repository())
+		self.db.open()
+
+		self.db.add_package(Package("a", ["/usr/share/a/", "/usr/share/a/file",
+			"/usr/share/shared"]))
+		self.db.add_package(Package("b", ["/usr/share/b/", "/usr/share/b/file",
+			"/usr/share/shared"]))
+		self.db.commit()
+
+		self.ids = {}
+		for name in ("a", "b"):
+			c = self.db.cursor()
+			c.execute("SELECT id FROM packages WHERE name = ?", (name,))
+			self.ids[name] = c.fetchone()[0]
+			c.close()
+
+	def tearDown(self):
+		self.db.close()
+		shutil.rmtree(self.pakfire.path)
+
+	def test_get_file_owners(self):
+		a, b = self.ids["a"], self.ids["b"]
+
+		self.assertEqual(self.db.get_file_owners("/usr/share/a/file"), [a])
+		self.assertEqual(self.db.get_file_owners("/usr/share//a/./file"), [a])
+		self.assertEqual(self.db.get_file_owners("/usr/share/b/"), [b])
+		self.assertEqual(sorted(self.db.get_file_owners("/usr/share/shared")), sorted([a, b]))
+		self.assertEqual(self.db.get_file_owners("/usr/share/shared", exclude=a), [b])
+		self.assertEqual(self.db.get_file_owners("/usr/share/a/file", exclude=a), [])
+		self.assertEqual(self.db.get_file_owners("/usr/share/missing"), [])
+
+	def test_is_file_owned(self):
+		a = self.ids["a"]
+
+		self.assertTrue(self.db.is_file_owned("/usr/share/a/file"))
+		self.assertTrue(self.db.is_file_owned("/usr/share/shared", exclude=a))
+		self.assertFalse(self.db.is_file_owned("/usr/share/a/file", exclude=a))
+		self.assertFalse(self.db.is_file_owned("/usr/share/missing"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+import os
+import unittest
+
+import pakfire.delta
+from pakfire.errors import DeltaError
+
+class DeltaTest(unittest.TestCase):
+	def roundtrip(self, old, new):
+		delta = pakfire.delta.create(old, new)
+		self.assertEqual(pakfire.delta.apply(old, delta), new)
+
+		return delta
+
+	def test_empty(self):
+		self.roundtrip("", "")
+		self.roundtrip("", "new data")
+		self.roundtrip("old data", "")
+
+	def test_identical(self):
+		data = os.urandom(64 * 1024)
+		delta = self.roundtrip(data, data)
+
+		# Identical data must be copied, not inserted.
+		self.assertTrue(len(delta) < 64)
+
+	def test_changed(self):
+		old = os.urandom(64 * 1024)
+		new = "prefix" + old[:1000] + "changed" + old[1000:50000] + old[60000:] + "suffix"
+
+		delta = self.roundtrip(old, new)
+		self.assertTrue(len(delta) < 1024)
+
+	def test_unrelated(self):
+		self.roundtrip(os.urandom(4096), os.urandom(4096))
+
+	def test_truncated(self):
+		old = os.urandom(4096)
+		delta = pakfire.delta.create(old, "insert" + old)
+
+		for length in (len(delta) - 1, len(pakfire.delta.DELTA_MAGIC) + 3):
+			self.assertRaises(DeltaError, pakfire.delta.apply, old, delta[:length])
+
+	def test_corrupt(self):
+		self.assertRaises(DeltaError, pakfire.delta.apply, "", "garbage")
+		self.assertRaises(DeltaError, pakfire.delta.apply, "",
+			pakfire.delta.DELTA_MAGIC + "X")
+
+		# Copy beyond the end of the old data.
+		old = os.urandom(4096)
+		delta = pakfire.delta.create(old, old)
+		self.assertRaises(DeltaError, pakfire.delta.apply, old[:100], delta)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import shutil
+import tempfile
+import unittest
+
+from pakfire.downloader import MirrorScoreboard
+from pakfire.repository.cache import RepositoryCache
+
+class MirrorScoreboardTest(unittest.TestCase):
+	def setUp(self):
+		self.cache = RepositoryCache(None, None)
+		self.cache.path = tempfile.mkdtemp()
+
+		self.scoreboard = MirrorScoreboard(self.cache, "mirrors.scores")
+
+	def tearDown(self):
+		shutil.rmtree(self.cache.path)
+
+	def test_rank(self):
+		s = self.scoreboard
+
+		s.record_success("http://slow", latency=0.1, size=1024**2, duration=10)
+		s.record_success("http://fast", latency=0.1, size=1024**2, duration=1)
+		s.record_success("http://far", latency=2.0, size=1024**2, duration=1)
+
+		# Only probed, so the median throughput is assumed.
+		s.record_success("http://probed", latency=0.5)
+
+		# Fast, but failed recently.
+		s.record_success("http://flaky", latency=0.1, size=1024**2, duration=1)
+		s.record_failure("http://flaky")
+
+		# Never answered.
+		s.record_failure("http://broken")
+
+		urls = ["http://broken", "http://new1", "http://flaky", "http://slow",
+			"http://probed", "http://new2", "http://far", "http://fast"]
+
+		ranked = s.rank(urls)
+
+		self.assertEqual(sorted(ranked), sorted(urls))
+		self.assertEqual(ranked[:5],
+			["http://fast", "http://probed", "http://far", "http://flaky", "http://slow"])
+		self.assertEqual(sorted(ranked[5:7]), ["http://new1", "http://new2"])
+		self.assertEqual(ranked[7], "http://broken")
+
+	def test_rank_unknown(self):
+		urls = ["http://a", "http://b", "http://c"]
+
+		self.assertEqual(sorted(self.scoreboard.rank(urls)), urls)
+
+	def test_failures_decay(self):
+		s = self.scoreboard
+
+		s.record_success("http://a", latency=0.1)
+		s.record_failure("http://a")
+		s.record_success("http://b", latency=0.2)
+
+		self.assertEqual(s.rank(["http://a", "http://b"]), ["http://b", "http://a"])
+
+		# Successful downloads make the mirror first again.
+		for i in range(10):
+			s.record_success("http://a", latency=0.1)
+
+		self.assertEqual(s.rank(["http://a", "http://b"]), ["http://a", "http://b"])
+
+	def test_save(self):
+		self.scoreboard.record_success("http://a", latency=0.1)
+
+		# Scores are not written after every update...
+		self.assertFalse(self.cache.exists("mirrors.scores"))
+
+		# ...but when they are flushed.
+		self.scoreboard.flush()
+
+		scoreboard = MirrorScoreboard(self.cache, "mirrors.scores")
+		self.assertEqual(scoreboard.scores, self.scoreboard.scores)
+
+if __name__ == "__main__":
+	unittest.main()
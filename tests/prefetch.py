@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pakfire.daemon import PrefetchStatistics
+
+class Job(object):
+	def __init__(self, arch, config):
+		self.arch = arch
+		self.config = config
+
+
+class Package(object):
+	def __init__(self, name):
+		self.name = name
+
+
+class PrefetchStatisticsTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+
+		self.stats = PrefetchStatistics()
+		self.stats.filename = os.path.join(self.path, "prefetch.json")
+		self.stats.data = {}
+
+	def tearDown(self):
+		shutil.rmtree(self.path)
+
+	def entry(self, job):
+		entries = [e for e in self.stats.data.values() \
+			if e["arch"] == job.arch and e["config"] == job.config]
+		self.assertEqual(len(entries), 1)
+
+		return entries[0]
+
+	def test_add_buildroot(self):
+		job = Job("x86_64", "[distro]")
+
+		self.stats.add_buildroot(job, [Package("gcc"), Package("make")])
+		self.stats.add_buildroot(job, [Package("gcc")])
+
+		entry = self.entry(job)
+		self.assertEqual(entry["buildroots"], 2)
+		self.assertEqual(entry["packages"], { "gcc" : 2, "make" : 1 })
+
+		# Other configurations are counted separately.
+		self.stats.add_buildroot(Job("i686", "[distro]"), [Package("gcc")])
+		self.assertEqual(self.entry(job)["packages"]["gcc"], 2)
+
+	def test_decay(self):
+		job = Job("x86_64", "[distro]")
+
+		for i in range(PrefetchStatistics.MAX_BUILDROOTS):
+			self.stats.add_buildroot(job, [Package("gcc"), Package("make")])
+
+		# A package that has been used only once.
+		self.stats.add_buildroot(job, [Package("gcc"), Package("perl")])
+
+		# All counters have been halved and perl has been forgotten.
+		entry = self.entry(job)
+		self.assertEqual(entry["buildroots"], (PrefetchStatistics.MAX_BUILDROOTS + 1) // 2)
+		self.assertEqual(entry["packages"], {
+			"gcc"  : (PrefetchStatistics.MAX_BUILDROOTS + 1) // 2,
+			"make" : PrefetchStatistics.MAX_BUILDROOTS // 2,
+		})
+
+	def test_persistence(self):
+		job = Job("x86_64", "[distro]")
+		self.stats.add_buildroot(job, [Package("gcc")])
+
+		stats = PrefetchStatistics()
+		stats.filename = self.stats.filename
+		stats.data = stats.load()
+
+		self.assertEqual(stats.data, self.stats.data)
+
+	def test_get_recent(self):
+		jobs = [Job("x86_64", "config%d" % i) for i in range(3)]
+
+		for job in jobs:
+			self.stats.add_job(job)
+
+		for i, job in enumerate(jobs):
+			self.entry(job)["last_used"] = time.time() - i * 86400
+
+		# Too old.
+		self.entry(jobs[2])["last_used"] = time.time() - 8 * 86400
+
+		recent = self.stats.get_recent()
+		self.assertEqual([e["config"] for e in recent], ["config0", "config1"])
+
+		self.assertEqual(len(self.stats.get_recent(count=1)), 1)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+###############################################################################
+#                                                                             #
+# Pakfire - The IPFire package management system                              #
+# Copyright (C) 2011 Pakfire development team                                 #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU General Public License as published by        #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU General Public License for more details.                                #
+#                                                                             #
+# You should have received a copy of the GNU General Public License           #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+#                                                                             #
+###############################################################################
+
+#
+# Measures how fast packages are added to the local package database.
+#
+# Usage: tools/benchmark-database.py [directory] [packages] [files]
+#
+# The database is created in the given directory (a temporary directory
+# by default), because the results depend on how expensive fsync is on
+# the file system that holds it. Every mode is run with a fresh database:
+#
+#   delete - rollback journal, commit after every package (old behaviour)
+#   wal    - write-ahead log, commit after every package
+#   batch  - write-ahead log, one transaction for all packages
+#            (this is what Transaction.run() does)
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pakfire.filelist
+import pakfire.repository.database as database
+
+class Pakfire(object):
+	def __init__(self, path):
+		self.path = path
+
+
+class Repository(object):
+	name = "benchmark"
+
+
+class Package(object):
+	def __init__(self, i, files):
+		self.name = "package%d" % i
+		self.friendly_name = self.name
+		self.uuid = "uuid-%d" % i
+
+		self.epoch = 0
+		self.version = "1.0"
+		self.release = "1"
+		self.arch = "x86_64"
+		self.groups = []
+		self.filename = "%s.pfm" % self.name
+		self.size = self.inst_size = 1024
+		self.hash1 = "0" * 40
+		self.license = "GPLv3+"
+		self.summary = self.description = self.name
+		self.vendor = self.build_id = self.build_host = self.build_date = ""
+		self.build_time = 0
+		self.repo = Repository()
+
+		self.provides = [self.name,]
+		self.requires = ["libc.so.6()(64bit)",]
+		self.conflicts = self.obsoletes = []
+		self.recommends = self.suggests = []
+
+		self.filelist = []
+		for name in ["/usr/share/%s/" % self.name] + \
+				["/usr/share/%s/file%d" % (self.name, j) for j in range(files)]:
+			f = pakfire.filelist.File(None)
+			f.name = name
+			f.size = 1024
+			f.pkg = self
+
+			if name.endswith("/"):
+				f.type = pakfire.filelist.TYPE_DIR_INT
+
+			self.filelist.append(f)
+
+	def get_scriptlet(self, action):
+		return None
+
+
+def run(path, mode, pkgs):
+	pakfire = Pakfire(tempfile.mkdtemp(dir=path))
+
+	try:
+		db = database.DatabaseLocal(pakfire, Repository())
+		db.open()
+
+		if mode == "delete":
+			db.db.execute("PRAGMA journal_mode = DELETE")
+			db.db.execute("PRAGMA synchronous = FULL")
+
+		time_start = time.time()
+
+		if mode == "batch":
+			db.begin()
+
+		for pkg in pkgs:
+			db.add_package(pkg)
+
+		db.commit()
+		db.checkpoint()
+
+		duration = time.time() - time_start
+		db.close()
+
+	finally:
+		shutil.rmtree(pakfire.path)
+
+	return len(pkgs) / duration
+
+if __name__ == "__main__":
+	path = None
+	if len(sys.argv) > 1:
+		path = sys.argv[1]
+
+	count = 500
+	if len(sys.argv) > 2:
+		count = int(sys.argv[2])
+
+	files = 200
+	if len(sys.argv) > 3:
+		files = int(sys.argv[3])
+
+	pkgs = [Package(i, files) for i in range(count)]
+
+	print "%d packages with %d files each" % (count, files)
+
+	for mode in ("delete", "wal", "batch"):
+		print "  %-6s %8.1f packages/s" % (mode, run(path, mode, pkgs))